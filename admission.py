@@ -0,0 +1,92 @@
+"""
+SMS Bot - Допуск запитів на запис
+
+ClientLimiter - token bucket для кожного клієнта у формі GCRA: стан
+клієнта - одне число (час, коли його відро знову стане повним), а
+клієнти зберігаються в OrderedDict і найдавніший витісняється, коли їх
+більше max_clients. Gate обмежує кількість одночасних запитів воркера:
+кілька запитів можуть чекати в обмеженій черзі, решта одразу отримує
+відмову. Обидва працюють у межах одного процесу.
+"""
+
+import math
+import time
+import threading
+from collections import OrderedDict
+
+
+class ClientLimiter:
+    """rate запитів на секунду з одного клієнта із запасом burst"""
+
+    def __init__(self, rate, burst, max_clients=10000, clock=time.monotonic):
+        self.interval = 1.0 / rate
+        # Наскільки час клієнта може випереджати поточний (повне відро)
+        self.tolerance = burst * self.interval
+        self.max_clients = max_clients
+        self.clock = clock
+        # Клієнт -> теоретичний час наступного запиту (TAT); порядок - LRU
+        self.clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, client, cost=1):
+        """0 - запит дозволено, інакше - через скільки секунд буде досить токенів"""
+        now = self.clock()
+        with self._lock:
+            tat = self.clients.get(client)
+            if tat is None or tat < now:
+                tat = now
+            new_tat = tat + cost * self.interval
+            wait = new_tat - now - self.tolerance
+            # Похибка додавання float не повинна забирати останній токен запасу
+            if wait > 1e-9:
+                return wait
+            self.clients[client] = new_tat
+            self.clients.move_to_end(client)
+            if len(self.clients) > self.max_clients:
+                # Найдавніший клієнт найімовірніше вже має повне відро
+                self.clients.popitem(last=False)
+            return 0
+
+
+class Gate:
+    """Не більше limit одночасних запитів; до queue_size чекають до timeout секунд"""
+
+    def __init__(self, limit, queue_size, timeout):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+
+    def acquire(self):
+        """True - запит допущено (потрібен release), False - черга повна або час вийшов"""
+        with self._cond:
+            # Нові запити не обганяють тих, хто вже чекає
+            if self.active < self.limit and not self.waiting:
+                self.active += 1
+                return True
+            if self.waiting >= self.queue_size:
+                return False
+            self.waiting += 1
+            deadline = time.monotonic() + self.timeout
+            try:
+                while self.active >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+                self.active += 1
+                return True
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+
+def retry_after(seconds):
+    """Значення заголовка Retry-After: цілі секунди, не менше 1"""
+    return str(max(1, math.ceil(seconds)))
@@ -0,0 +1,169 @@
+"""
+SMS Bot - Агрегати реєстрацій за часом
+
+Кількість живих номерів за часом реєстрації зберігається в кільцевих
+буферах похвилинних, погодинних і поденних кошиків з розбивкою за
+операторами. Реєстрація і видалення змінюють по одному кошику кожної
+роздільності, а запит читає лише кошики свого вікна, тож не залежить
+від розміру реєстру. Кошики вирівняні за UTC. Як і пошуковий індекс,
+агрегати будуються з записів під час першого запиту, а не на старті.
+"""
+
+import time
+from collections import Counter
+
+from numbering import CARRIER_PREFIX_LEN, carrier_of
+
+# Роздільність -> (ширина кошика в секундах, кількість кошиків у кільці)
+RESOLUTIONS = {
+    'minute': (60, 24 * 60),
+    'hour': (3600, 31 * 24),
+    'day': (86400, 400),
+}
+# Назва для номерів, оператора яких не визначено
+UNKNOWN_CARRIER = "Невідомий"
+
+
+class RingSeries:
+    """Кільце кошиків однієї роздільності
+
+    Комірка i зберігає кошик slot (час // ширина), для якого slot % size == i;
+    комірка зі старішим кошиком вважається порожньою.
+    """
+
+    def __init__(self, width, size):
+        self.width = width
+        self.size = size
+        self.clear()
+
+    def clear(self):
+        self.slots = [-1] * self.size
+        self.totals = [0] * self.size
+        self.carriers = [None] * self.size
+        # Найновіший кошик, що потрапляв у кільце
+        self.head = -1
+
+    def add(self, slot, carrier, count=1):
+        if slot <= self.head - self.size:
+            # Старіше за все кільце
+            return
+        if slot > self.head:
+            self.head = slot
+        i = slot % self.size
+        if self.slots[i] != slot:
+            self.slots[i] = slot
+            self.totals[i] = 0
+            self.carriers[i] = {}
+        self.totals[i] += count
+        carriers = self.carriers[i]
+        carriers[carrier] = carriers.get(carrier, 0) + count
+
+    def remove(self, slot, carrier):
+        i = slot % self.size
+        if self.slots[i] != slot:
+            # Кошик уже витіснено з кільця
+            return
+        self.totals[i] -= 1
+        carriers = self.carriers[i]
+        count = carriers.get(carrier, 0) - 1
+        if count > 0:
+            carriers[carrier] = count
+        else:
+            carriers.pop(carrier, None)
+
+    def window(self, end, count):
+        """Кошики від end - count + 1 до end: (slot, кількість, {оператор: кількість})"""
+        for slot in range(end - count + 1, end + 1):
+            i = slot % self.size
+            if self.slots[i] == slot:
+                yield slot, self.totals[i], self.carriers[i]
+            else:
+                yield slot, 0, {}
+
+
+class RegistrationStats:
+    """Агрегати живих номерів: за часом реєстрації і за операторами"""
+
+    def __init__(self):
+        self.series = {name: RingSeries(width, size) for name, (width, size) in RESOLUTIONS.items()}
+        # Усі живі номери за операторами
+        self.carriers = {}
+        self.total = 0
+        self.built = False
+
+    def clear(self):
+        for series in self.series.values():
+            series.clear()
+        self.carriers = {}
+        self.total = 0
+        self.built = True
+
+    def invalidate(self):
+        """Скинути агрегати до наступного rebuild"""
+        self.clear()
+        self.built = False
+
+    def add(self, registered_at, carrier, count=1):
+        if not self.built:
+            return
+        for series in self.series.values():
+            series.add(int(registered_at // series.width), carrier, count)
+        self.carriers[carrier] = self.carriers.get(carrier, 0) + count
+        self.total += count
+
+    def remove(self, registered_at, carrier):
+        if not self.built:
+            return
+        for series in self.series.values():
+            series.remove(int(registered_at // series.width), carrier)
+        count = self.carriers.get(carrier, 0) - 1
+        if count > 0:
+            self.carriers[carrier] = count
+        else:
+            self.carriers.pop(carrier, None)
+        self.total -= 1
+
+    def rebuild(self, records):
+        """Побудувати агрегати з записів (після завантаження бази)"""
+        self.clear()
+        # Записи групуються за хвилиною і префіксом ключа: оператор
+        # визначається один раз на префікс, кільця оновлюються раз на групу
+        groups = Counter((int(record.registered_at // 60), record.key[:CARRIER_PREFIX_LEN]) for record in records)
+        carriers = {}
+        for (minute, prefix), count in groups.items():
+            carrier = carriers.get(prefix)
+            if carrier is None:
+                carrier = carriers[prefix] = carrier_of(prefix) or ''
+            self.add(minute * 60, carrier or None, count)
+
+    def query(self, resolution, last, carrier=None, now=None):
+        """Останні last кошиків роздільності (не більше, ніж у кільці) і підсумки вікна"""
+        series = self.series[resolution]
+        last = min(last, series.size)
+        end = int((now if now is not None else time.time()) // series.width)
+        buckets = []
+        window_carriers = {}
+        window_total = 0
+        for slot, total, carriers in series.window(end, last):
+            if carrier is not None:
+                total = carriers.get(None if carrier == UNKNOWN_CARRIER else carrier, 0)
+                carriers = {carrier: total} if total else {}
+            buckets.append({
+                'start': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(slot * series.width)),
+                'total': total,
+                'carriers': {name or UNKNOWN_CARRIER: count for name, count in carriers.items()},
+            })
+            window_total += total
+            for name, count in carriers.items():
+                window_carriers[name] = window_carriers.get(name, 0) + count
+        return {
+            'resolution': resolution,
+            'bucket_seconds': series.width,
+            'total': window_total,
+            'carriers': {name or UNKNOWN_CARRIER: count for name, count in window_carriers.items()},
+            'buckets': buckets,
+            'all_time': {
+                'total': self.total,
+                'carriers': {name or UNKNOWN_CARRIER: count for name, count in self.carriers.items()},
+            },
+        }
@@ -0,0 +1,175 @@
+"""
+SMS Bot - Архів номерів із вичерпаним строком зберігання
+
+Записи переносяться в архів пакетами: кожен пакет - окремий член gzip
+з NDJSON-рядками, дописаний у кінець файлу. Поруч лежить індекс пакетів
+(зміщення, довжина, кількість і діапазон registered_at), тож запит за
+часом розпаковує лише пакети, що з ним перетинаються. Пакет потрапляє
+в архів раніше, ніж записи видаляються з реєстру: збій між цими кроками
+дає повтор запису в архіві, а не втрату.
+"""
+
+import os
+import json
+import gzip
+import time
+import threading
+
+from workers import wait_for_lock
+
+encode_record = json.JSONEncoder(ensure_ascii=False).encode
+
+
+class Archive:
+    """Архівний файл і його індекс пакетів (спільні для всіх воркерів)"""
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + '.idx'
+        self._lock = threading.Lock()
+        # Прочитані записи індексу і скільки байтів індексу вже прочитано
+        self._batches = []
+        self._index_size = 0
+
+    def append(self, records):
+        """Дописати пакет записів, упорядкованих за registered_at
+
+        Запис - словник у форматі API з додатковим полем key (нормалізований
+        номер): пошук номера відкидає рядки без нього, не розбираючи JSON.
+        """
+        if not records:
+            return
+        data = gzip.compress(''.join(encode_record(r) + '\n' for r in records).encode('utf-8'), 6)
+        with self._lock:
+            with open(self.path, 'ab') as f:
+                offset = f.tell()
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            entry = {'offset': offset, 'length': len(data), 'count': len(records),
+                     'first': records[0]['registered_at'], 'last': records[-1]['registered_at']}
+            # Пакет без запису в індексі (збій між записами) для запитів не існує
+            with open(self.index_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+    def batches(self):
+        """Записи індексу, зокрема дописані іншими воркерами"""
+        with self._lock:
+            try:
+                size = os.path.getsize(self.index_path)
+            except FileNotFoundError:
+                size = 0
+            if size < self._index_size:
+                # Індекс замінено - читаємо спочатку
+                self._batches = []
+                self._index_size = 0
+            if size > self._index_size:
+                with open(self.index_path, 'rb') as f:
+                    f.seek(self._index_size)
+                    data = f.read(size - self._index_size)
+                # Останній рядок може бути ще не дописаний
+                complete = data.rfind(b'\n') + 1
+                self._batches += [json.loads(line) for line in data[:complete].splitlines() if line]
+                self._index_size += complete
+            return self._batches
+
+    def count(self):
+        return sum(entry['count'] for entry in self.batches())
+
+    def _read_batch(self, f, entry):
+        f.seek(entry['offset'])
+        return gzip.decompress(f.read(entry['length'])).decode('utf-8').splitlines()
+
+    def query(self, key=None, since=None, until=None, cursor=None, limit=100):
+        """Записи архіву в порядку перенесення: (записи, наступний курсор або None)
+
+        key - лише записи цього номера; since/until - межі registered_at;
+        cursor - "пакет:рядок", з якого продовжити.
+        """
+        batches = self.batches()
+        start_batch, start_line = map(int, cursor.split(':')) if cursor else (0, 0)
+        if start_batch < 0 or start_line < 0:
+            raise ValueError(f"невірний курсор: {cursor}")
+        found = []
+        if not batches:
+            return found, None
+        with open(self.path, 'rb') as f:
+            for number in range(start_batch, len(batches)):
+                entry = batches[number]
+                first_line = start_line if number == start_batch else 0
+                if (since is not None and entry['last'] < since) or (until is not None and entry['first'] >= until):
+                    continue
+                lines = self._read_batch(f, entry)
+                for line in range(first_line, len(lines)):
+                    if key is not None and key not in lines[line]:
+                        continue
+                    record = json.loads(lines[line])
+                    if record.pop('key', None) != key and key is not None:
+                        continue
+                    if since is not None and record['registered_at'] < since:
+                        continue
+                    if until is not None and record['registered_at'] >= until:
+                        continue
+                    if len(found) == limit:
+                        return found, f"{number}:{line}"
+                    found.append(record)
+        return found, None
+
+
+class Expirer:
+    """Періодичне перенесення записів в архів у фоновому потоці
+
+    Переносить лише один воркер - той, що утримує блокування lock_file;
+    решта чекають, щоб підхопити роботу, якщо він завершиться.
+    """
+
+    def __init__(self, expire, interval, lock_file=None):
+        # expire() переносить записи з вичерпаним строком і повертає їх кількість
+        self.expire = expire
+        self.interval = interval
+        self.lock_file = lock_file
+        self.running = False
+        self.expired = 0
+        self.last_run_at = None
+        self._stopping = threading.Event()
+        self._thread = None
+        self._lock_fd = None
+
+    def start(self):
+        """Запустити потік (працювати він почне, коли отримає блокування)"""
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="phones-expiry", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def status(self):
+        return {'running': self.running, 'expired': self.expired, 'last_run_at': self.last_run_at}
+
+    def _run(self):
+        if self.lock_file:
+            self._lock_fd = wait_for_lock(self.lock_file, self._stopping.is_set, self._stopping.wait)
+            if self._lock_fd is None:
+                return
+        self.running = True
+        try:
+            while not self._stopping.is_set():
+                try:
+                    self.expired += self.expire()
+                except Exception as e:  # noqa: BLE001 - наступний прохід спробує знову
+                    print(f"⚠️ Архів: помилка перенесення: {e}")
+                self.last_run_at = time.time()
+                self._stopping.wait(self.interval)
+        finally:
+            self.running = False
+            if self._lock_fd is not None:
+                os.close(self._lock_fd)
+                self._lock_fd = None
@@ -0,0 +1,1107 @@
+"""
+SMS Bot - Бенчмарки реєстру номерів
+
+Запуск:
+    python bench.py register --sizes 1000,10000,100000,1000000
+    python bench.py bulk --batch 10000
+    python bench.py home --size 10000
+    python bench.py search --sizes 1000,100000,1000000
+    python bench.py normalize --count 200000
+    python bench.py stats --sizes 1000,100000,1000000
+    python bench.py expire --sizes 100000,1000000 --expired 20000
+    python bench.py memory --count 200000
+    python bench.py startup --sizes 100000,1000000
+    python bench.py stress --writers 8 --readers 4 --seconds 10
+    python bench.py suite --sizes 1000,100000,1000000 --target both --output bench-results.json
+    python bench.py monitor --numbers 2000 --sites 5 --rate 100
+    python bench.py dispatch --messages 100000 --gateways 2 --fail-rate 0.02 --ack-loss 0.02
+    python bench.py admission --flood 32 --rows 5000 --seconds 10
+"""
+
+import os
+import sys
+import json
+import asyncio
+import time
+import shutil
+import socket
+import random
+import platform
+import argparse
+import tempfile
+import threading
+import subprocess
+import statistics
+import http.client
+from collections import Counter
+from urllib.parse import urlparse, parse_qs, urlencode
+
+# main.py читає снапшот бази з поточної теки під час імпорту,
+# тому бенчмарк працює в окремій тимчасовій теці
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+START_DIR = os.getcwd()
+sys.path.insert(0, REPO_DIR)
+os.chdir(tempfile.mkdtemp(prefix="sms-bot-bench-"))
+# Бенчмарки шлють усе з однієї адреси - обмеження допуску їм не потрібні
+# (bench.py admission вмикає їх сам)
+os.environ.setdefault("ADMISSION_RATE", "0")
+os.environ.setdefault("ADMISSION_CONCURRENCY", "0")
+
+import main  # noqa: E402
+from monitor import Monitor, ResultStore, Site  # noqa: E402
+from dispatch import Dispatcher, DispatchQueue, FakeGateway  # noqa: E402
+from numbering import normalize, normalize_many  # noqa: E402
+
+
+NAMES = ['Іван', 'Оксана', 'Мар’яна', 'Петро', 'Ганна', 'Юрій', 'Ольга', 'Тарас']
+SURNAMES = ['Коваленко', 'Бондаренко', 'Ткаченко', 'Шевчук', 'Кравчук', 'Ковальчук',
+            'Олійник', 'Мельник', 'Поліщук', 'Лисенко', 'Гончаренко', 'Савченко']
+NOTES = ['клієнт OLX', 'замовлення Rozetka', 'доставка НоваПошта', None]
+
+
+def seed(count, with_text=False, base_time=None):
+    """Заповнити реєстр синтетичними номерами (з base_time - відтворювано)"""
+    main.phones_database = [
+        main.make_record({
+            'phone': f'+38050{i:07d}',
+            'name': f'{NAMES[i % len(NAMES)]} {SURNAMES[i // len(NAMES) % len(SURNAMES)]}' if with_text else None,
+            'notes': NOTES[i % len(NOTES)] if with_text else None,
+            'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'registered_at': base_time + i / 1000 if base_time else time.time()
+        })
+        for i in range(count)
+    ]
+    main.rebuild_index()
+    main.publish()
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def bench_register(sizes, rounds):
+    """Затримка POST /register залежно від розміру реєстру"""
+    # Запис на диск ізольовано: тут вимірюється лише перевірка дублікатів.
+    # Операції нумеруються, як у справжніх сховищах (seq потрібен журналу змін)
+    def commit(ops):
+        for op in ops:
+            main.storage.seq += 1
+            op['seq'] = main.storage.seq
+        return [], ops
+
+    main.storage.commit = commit
+    client = main.app.test_client()
+    print(f"{'stored':>10} {'p50 us':>10} {'p99 us':>10} {'mean us':>10}")
+    for size in sizes:
+        seed(size)
+        samples = []
+        for i in range(rounds):
+            # Половина запитів - дублікати, половина - нові номери
+            phone = f'+38050{i % size:07d}' if i % 2 else f'+38067{i:07d}'
+            started = time.perf_counter()
+            response = client.post('/register', data={'phone': phone})
+            samples.append((time.perf_counter() - started) * 1e6)
+            # Реєстрація і дублікат перенаправляють на головну; помилка не повинна потрапити в заміри
+            assert response.status_code == 302, (phone, response.status_code)
+        print(f"{size:>10} {percentile(samples, 50):>10.1f} "
+              f"{percentile(samples, 99):>10.1f} {statistics.mean(samples):>10.1f}")
+
+
+def bench_bulk(batch, rounds):
+    """Пропускна здатність POST /api/phones/bulk"""
+    client = main.app.test_client()
+    seed(0)
+    fmt_bodies = {
+        'json': ('application/json', lambda n: json.dumps(
+            [{'phone': f'+38067{n + i:07d}', 'name': 'Тест'} for i in range(batch)])),
+        'ndjson': ('application/x-ndjson', lambda n: '\n'.join(
+            json.dumps({'phone': f'+38068{n + i:07d}'}) for i in range(batch))),
+        'csv': ('text/csv', lambda n: 'phone,name,notes\n' + '\n'.join(
+            f'+38073{n + i:07d},Тест,' for i in range(batch))),
+    }
+    print(f"{'format':>8} {'batch':>8} {'rows/s':>12}")
+    for fmt, (content_type, make_body) in fmt_bodies.items():
+        elapsed = 0.0
+        for r in range(rounds):
+            body = make_body(r * batch)
+            started = time.perf_counter()
+            response = client.post('/api/phones/bulk', data=body, content_type=content_type)
+            elapsed += time.perf_counter() - started
+            assert response.json['registered'] == batch, response.json
+        print(f"{fmt:>8} {batch:>8} {batch * rounds / elapsed:>12.0f}")
+
+
+def bench_home(size, rounds):
+    """GET /: шаблон, скомпільований при старті, проти компіляції на кожен запит"""
+    from flask import render_template_string
+    seed(size)
+    client = main.app.test_client()
+    # Колишній варіант: стилі та скрипт вбудовані в сторінку
+    inline_template = main.HTML_TEMPLATE.replace(
+        """<link rel="stylesheet" href="{{ assets['app.css'] }}">""",
+        "<style>" + main.APP_CSS + "</style>").replace(
+        """<script src="{{ assets['app.js'] }}"></script>""",
+        "<script>" + main.APP_JS + "</script>")
+
+    def inline_home():
+        phones, next_cursor = main.page_phones(main.snapshot, None, main.HOME_PAGE_SIZE)
+        return render_template_string(inline_template, phones=phones, total=main.snapshot.total,
+                                      cursor=None, next_cursor=next_cursor, sites=main.SITES,
+                                      stats=main.stats, requests=main.metrics.total_requests(),
+                                      assets=main.ASSET_URLS, message=None)
+
+    main.app.add_url_rule('/bench-inline', 'bench_inline', inline_home)
+    print(f"{'variant':>12} {'p50 us':>10} {'p99 us':>10} {'bytes':>8}")
+    for variant, path in (('before', '/bench-inline'), ('after', '/')):
+        samples = []
+        size_bytes = 0
+        for _ in range(rounds):
+            started = time.perf_counter()
+            response = client.get(path)
+            samples.append((time.perf_counter() - started) * 1e6)
+            size_bytes = len(response.data)
+        print(f"{variant:>12} {percentile(samples, 50):>10.1f} {percentile(samples, 99):>10.1f} {size_bytes:>8}")
+
+
+def bench_search(sizes, rounds):
+    """Затримка пошуку за цифрами і текстом залежно від розміру реєстру"""
+    queries = {
+        'prefix': lambda i: main.search_index.search_prefix(f'38050{i % 1000:03d}', 100),
+        'suffix': lambda i: main.search_index.search_suffix(f'{i % 10000:04d}', 100),
+        'word': lambda i: main.search_index.search_text(
+            f'{NAMES[i % len(NAMES)]} {SURNAMES[i % len(SURNAMES)]}', 100),
+        'ngram': lambda i: main.search_index.search_text(SURNAMES[i % len(SURNAMES)][:5], 100),
+        'rare': lambda i: main.search_index.search_text(f'{NAMES[i % len(NAMES)]} нема{i}', 100),
+    }
+    print(f"{'stored':>10} {'query':>8} {'p50 us':>10} {'p99 us':>10}")
+    for size in sizes:
+        seed(size, with_text=True)
+        main.ensure_search_index()
+        for name, query in queries.items():
+            samples = []
+            for i in range(rounds):
+                started = time.perf_counter()
+                query(i)
+                samples.append((time.perf_counter() - started) * 1e6)
+            print(f"{size:>10} {name:>8} {percentile(samples, 50):>10.1f} {percentile(samples, 99):>10.1f}")
+
+
+def bench_normalize(count):
+    """Нормалізація і визначення оператора: мікросекунди на номер"""
+    rnd = random.Random(1)
+    formats = ('0{}', '+380{}', '380{}', '+380 ({}) {} {} {}', '0{}-{}-{}-{}')
+    operators = ('67', '50', '63', '93', '44', '95', '91')
+
+    def sample(i):
+        national = rnd.choice(operators) + f'{i:07d}'
+        fmt = rnd.choice(formats)
+        if fmt.count('{}') == 1:
+            return fmt.format(national)
+        return fmt.format(national[:2], national[2:5], national[5:7], national[7:])
+
+    # Невірні номери не мають пройти нормалізацію ні окремо, ні пакетом
+    invalid = ('067123456', '0000000000', '6712345678', '+0671234567', '00067123456')
+    accepted = [value for value, number in zip(invalid, normalize_many(invalid)) if number]
+    accepted += [value for value in invalid if normalize(value)]
+    if accepted:
+        print(f"  ✗ прийнято невірні номери: {', '.join(accepted)}")
+        sys.exit(1)
+
+    inputs = [sample(i) for i in range(count)]
+    # Частина вводу повторюється (той самий номер з форми або файлу)
+    repeated = [rnd.choice(inputs[:1000]) for _ in range(count)]
+    print(f"{'case':>16} {'count':>8} {'µs/номер':>9} {'cache hits':>11}")
+    for case, values, batch in (('унікальні', inputs, False), ('повтори', repeated, False),
+                                ('пакет', inputs, True)):
+        normalize.cache_clear()
+        started = time.perf_counter()
+        if batch:
+            numbers = normalize_many(values)
+        else:
+            numbers = [normalize(value) for value in values]
+        elapsed = time.perf_counter() - started
+        if any(number is None for number in numbers):
+            print("  ✗ невірні номери серед синтетичних")
+            sys.exit(1)
+        print(f"{case:>16} {len(values):>8} {elapsed / len(values) * 1e6:>9.2f} {normalize.cache_info().hits:>11}")
+
+
+def bench_stats(sizes, rounds):
+    """Агрегати реєстрацій: перебудова, оновлення і запит залежно від розміру реєстру"""
+    span = 30 * 86400
+    print(f"{'stored':>10} {'rebuild s':>10} {'add us':>8} {'remove us':>10} {'query':>8} {'p50 us':>10} {'p99 us':>10}")
+    for size in sizes:
+        seed(size)
+        # Реєстрації розподілені за останні 30 днів, оператори чергуються
+        now = time.time()
+        records = main.phones_database
+        for i, record in enumerate(records):
+            record.key = f'+380{("50", "67", "63", "93")[i % 4]}{i:07d}'
+            record.registered_at = now - span + span * i / size
+        started = time.perf_counter()
+        main.registrations.invalidate()
+        main.ensure_registrations()
+        rebuild = time.perf_counter() - started
+
+        expected = Counter(record.carrier for record in records)
+        result = main.registrations.query('day', 31)
+        if result['total'] != size or sum(expected.values()) != result['all_time']['total']:
+            print(f"  ✗ у кошиках {result['total']} записів замість {size}")
+            sys.exit(1)
+
+        stats = main.registrations
+        started = time.perf_counter()
+        for i in range(rounds):
+            stats.add(now - i, 'Київстар')
+        add = (time.perf_counter() - started) / rounds * 1e6
+        started = time.perf_counter()
+        for i in range(rounds):
+            stats.remove(now - i, 'Київстар')
+        remove = (time.perf_counter() - started) / rounds * 1e6
+
+        for resolution, last in (('minute', 60), ('hour', 168), ('day', 30)):
+            samples = []
+            for _ in range(rounds):
+                started = time.perf_counter()
+                stats.query(resolution, last)
+                samples.append((time.perf_counter() - started) * 1e6)
+            print(f"{size:>10} {rebuild:>10.3f} {add:>8.2f} {remove:>10.2f} {resolution:>8} "
+                  f"{percentile(samples, 50):>10.1f} {percentile(samples, 99):>10.1f}")
+
+
+def bench_expire(sizes, expired, rounds):
+    """Перенесення в архів: час залежить від кількості перенесених записів, а не від розміру реєстру"""
+    print(f"{'stored':>10} {'expired':>8} {'total s':>8} {'us/record':>10} {'archive KB':>11} {'query ms':>9}")
+    for size in sizes:
+        base_time = time.time() - 86400
+        seed(size, base_time=base_time)
+        main.reset_changes()
+        if os.path.exists(main.ARCHIVE_FILE):
+            os.remove(main.ARCHIVE_FILE)
+            os.remove(main.archive.index_path)
+        main.archive = main.Archive(main.ARCHIVE_FILE)
+        # Щораунду виходить наступна порція: записи зареєстровано через 1 мс
+        elapsed = 0.0
+        moved = 0
+        for r in range(1, rounds + 1):
+            started = time.perf_counter()
+            moved += main.expire_phones(base_time + r * expired / 1000)
+            elapsed += time.perf_counter() - started
+        if moved != expired * rounds or len(main.phones_by_id) != size - moved:
+            print(f"  ✗ перенесено {moved} замість {expired * rounds}")
+            sys.exit(1)
+        started = time.perf_counter()
+        found, _ = main.archive.query(f'+38050{expired // 2:07d}', limit=1)
+        query = (time.perf_counter() - started) * 1000
+        if len(found) != 1:
+            print("  ✗ номер не знайдено в архіві")
+            sys.exit(1)
+        print(f"{size:>10} {moved:>8} {elapsed:>8.2f} {elapsed / moved * 1e6:>10.1f} "
+              f"{os.path.getsize(main.ARCHIVE_FILE) / 1024:>11.0f} {query:>9.1f}")
+
+
+def bench_memory(count):
+    """Байти на запис: dict на п'ять ключів проти PhoneRecord"""
+    import tracemalloc
+
+    def measure(make):
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        records = [make(i) for i in range(count)]
+        used = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        del records
+        return used / count
+
+    def as_dict(i):
+        registered_at = time.time()
+        return {
+            'phone': f'+38050{i:07d}',
+            'name': f'{NAMES[i % len(NAMES)]} {SURNAMES[i // len(NAMES) % len(SURNAMES)]}',
+            'notes': NOTES[i % len(NOTES)],
+            'timestamp': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(registered_at)),
+            'registered_at': registered_at
+        }
+
+    def as_record(i):
+        data = as_dict(i)
+        return main.make_record(data)
+
+    print(f"{'layout':>12} {'bytes/record':>14}")
+    print(f"{'dict':>12} {measure(as_dict):>14.1f}")
+    print(f"{'PhoneRecord':>12} {measure(as_record):>14.1f}")
+
+
+def bench_startup(sizes):
+    """Час load_phones: JSON-снапшот (з переносом) проти бінарного, sqlite з рядків і зі снапшоту"""
+    import gc
+    import glob
+    from storage import SQLiteStorage
+    journal = main.storage
+    print(f"{'stored':>10} {'snapshot':>10} {'load s':>8} {'file MB':>8} {'search s':>9}")
+    for size in sizes:
+        main.storage = journal
+        seed(size, with_text=True)
+        for name in (main.SNAPSHOT_FILE, main.STATS_FILE + '.migrated',
+                     *glob.glob(main.SQLITE_FILE + '*')):
+            if os.path.exists(name):
+                os.remove(name)
+        with open(main.STATS_FILE, 'w', encoding='utf-8') as f:
+            json.dump({'seq': 0, 'phones': [r.to_dict() for r in main.phones_database]}, f, ensure_ascii=False)
+        # Перший старт читає JSON і одразу переписує його в бінарний формат
+        for variant, path in (('json', main.STATS_FILE), ('binary', main.SNAPSHOT_FILE)):
+            file_size = os.path.getsize(path) / 1e6
+            main.phones_database = []
+            gc.collect()
+            started = time.perf_counter()
+            main.load_phones()
+            loaded = time.perf_counter() - started
+            assert len(main.phones_by_id) == size
+            # Перший пошук будує індекс і розбирає всі записи
+            started = time.perf_counter()
+            main.ensure_search_index()
+            indexed = time.perf_counter() - started
+            print(f"{size:>10} {variant:>10} {loaded:>8.2f} {file_size:>8.1f} {indexed:>9.2f}")
+        # Sqlite переносить бінарний снапшот у базу; далі перший старт читає всі рядки
+        # і пише снапшот, наступний читає снапшот і хвіст oplog
+        main.storage = SQLiteStorage(main.SQLITE_FILE, main.normalize_phone, main.make_record_id,
+                                     legacy=journal, compact_every=main.JOURNAL_COMPACT_EVERY)
+        main.load_phones()
+        for variant in ('sqlite', 'sqlite+bin'):
+            if variant == 'sqlite':
+                for name in glob.glob(main.SQLITE_FILE + '.*.snapshot'):
+                    os.remove(name)
+            main.phones_database = []
+            gc.collect()
+            started = time.perf_counter()
+            main.load_phones()
+            loaded = time.perf_counter() - started
+            assert len(main.phones_by_id) == size
+            file_size = sum(os.path.getsize(name) for name in glob.glob(main.SQLITE_FILE + '*')) / 1e6
+            print(f"{size:>10} {variant:>10} {loaded:>8.2f} {file_size:>8.1f} {'':>9}")
+    main.storage = journal
+
+
+def stress(writers, readers, seconds, pool):
+    """Паралельні записники і читачі; повертає (помилки, записів, читань, секунд)
+
+    Перевіряє: жодної 5xx, без дублікатів і розірваних знімків, count
+    збігається з кількістю записів, а живі номери - з балансом успішних
+    реєстрацій і видалень. Спільна частина bench.py stress і tests/test_stress.py.
+    """
+    seed(0)
+    # Часте перемикання потоків, щоб перемежовувались навіть короткі ділянки коду
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    numbers = [f'+38063{i:07d}' for i in range(pool)]
+    registered = Counter()
+    deleted = Counter()
+    errors = []
+    reads = Counter()
+    stop = threading.Event()
+    counter_lock = threading.Lock()
+
+    def check_status(where, response):
+        if response.status_code >= 500:
+            errors.append(f"{where}: {response.status_code}")
+            return False
+        return True
+
+    def writer(seed_value):
+        rnd = random.Random(seed_value)
+        client = main.app.test_client()
+        while not stop.is_set():
+            if rnd.random() < 0.7:
+                phone = rnd.choice(numbers)
+                response = client.post('/register', data={'phone': phone})
+                if not check_status("/register", response):
+                    continue
+                if parse_qs(urlparse(response.location).query)['type'] == ['success']:
+                    with counter_lock:
+                        registered[phone] += 1
+            else:
+                record = main.phones_index.get(rnd.choice(numbers))
+                if record is None:
+                    continue
+                response = client.delete(f'/api/phones/{record.id}')
+                check_status("DELETE /api/phones", response)
+                if response.status_code == 200:
+                    with counter_lock:
+                        deleted[response.json['deleted']['phone']] += 1
+
+    def check_records(where, records, total=None):
+        keys = [r['phone'] if isinstance(r, dict) else r.key for r in records]
+        if len(keys) != len(set(keys)):
+            errors.append(f"{where}: дублікати {[k for k, n in Counter(keys).items() if n > 1][:5]}")
+        if total is not None and total != len(keys):
+            errors.append(f"{where}: count={total}, а записів {len(keys)}")
+
+    def reader(seed_value):
+        rnd = random.Random(seed_value)
+        client = main.app.test_client()
+        while not stop.is_set():
+            choice = rnd.randrange(3)
+            if choice == 0:
+                view = main.snapshot
+                records = list(view)
+                check_records("знімок", records, view.total)
+                order = [main.record_sort_key(r) for r in records]
+                if order != sorted(order):
+                    errors.append("знімок: порушено порядок записів")
+            elif choice == 1:
+                response = client.get('/export?gzip=0')
+                if check_status("/export", response):
+                    check_records("/export", response.json['phones'], response.json['count'])
+            else:
+                response = client.get('/api/phones?limit=50')
+                if check_status("/api/phones", response):
+                    check_records("/api/phones", response.json['phones'])
+            reads[choice] += 1
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    threads += [threading.Thread(target=reader, args=(1000 + i,)) for i in range(readers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    sys.setswitchinterval(switch_interval)
+
+    # Кожен номер живий рівно тоді, коли успішних реєстрацій на одну більше, ніж видалень
+    for phone in numbers:
+        balance = registered[phone] - deleted[phone]
+        if balance != (phone in main.phones_index):
+            errors.append(f"{phone}: реєстрацій {registered[phone]}, видалень {deleted[phone]}, "
+                          f"у базі {'є' if phone in main.phones_index else 'немає'}")
+    check_records("база", list(main.snapshot), len(main.phones_index))
+    # Журнал на диску відтворює той самий стан
+    live = set(main.phones_index)
+    main.load_phones()
+    if set(main.phones_index) != live:
+        errors.append("після перезавантаження зі сховища стан відрізняється")
+    return errors, sum(registered.values()) + sum(deleted.values()), sum(reads.values()), elapsed
+
+
+def bench_stress(writers, readers, seconds, pool):
+    """Паралельні записники і читачі: без дублікатів і без розірваних знімків"""
+    errors, writes, reads, elapsed = stress(writers, readers, seconds, pool)
+    print(f"{'writes':>8} {'reads':>8} {'ops/s':>8} {'live':>6} {'errors':>7}")
+    print(f"{writes:>8} {reads:>8} {(writes + reads) / elapsed:>8.0f} "
+          f"{len(main.phones_index):>6} {len(errors):>7}")
+    for error in errors[:20]:
+        print("  ✗", error)
+    if errors:
+        sys.exit(1)
+
+
+# Ендпоінти набору в порядку запуску: спершу читання, потім зміни бази
+SUITE_ENDPOINTS = ('health', 'home', 'api_phones', 'export', 'register', 'delete')
+# Фіксований час реєстрації засіяних номерів: однакові ID і курсори між запусками
+SUITE_BASE_TIME = 1700000000.0
+
+
+def suite_requests(endpoint, count, rnd):
+    """Запити (метод, шлях, тіло форми) для ендпоінта; номери й ID детерміновані"""
+    size = len(main.phones_database)
+    if endpoint == 'health':
+        return [('GET', '/health', None)] * count
+    if endpoint == 'home':
+        return [('GET', '/', None)] * count
+    if endpoint == 'api_phones':
+        # Сторінки з випадкових місць списку
+        return [('GET', f'/api/phones?limit={main.API_PAGE_SIZE}&cursor='
+                 f'{main.encode_cursor(main.phones_database[rnd.randrange(size)])}', None)
+                if size else ('GET', f'/api/phones?limit={main.API_PAGE_SIZE}', None)
+                for _ in range(count)]
+    if endpoint == 'export':
+        return [('GET', '/export?gzip=0', None)] * count
+    if endpoint == 'register':
+        return [('POST', '/register', {'phone': f'+38068{i:07d}', 'name': 'Бенчмарк'}) for i in range(count)]
+    if endpoint == 'delete':
+        return [('DELETE', f'/api/phones/{main.phones_database[i].id}', None)
+                for i in rnd.sample(range(size), min(count, size))]
+    raise ValueError(endpoint)
+
+
+def summarize(target, size, endpoint, latencies, elapsed, errors, total_bytes):
+    count = len(latencies)
+    return {
+        'target': target,
+        'size': size,
+        'endpoint': endpoint,
+        'requests': count,
+        'errors': errors,
+        'throughput_rps': round(count / elapsed, 1) if elapsed else None,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3) if latencies else None,
+        'mean_ms': round(statistics.mean(latencies) * 1000, 3) if latencies else None,
+        'bytes_per_response': round(total_bytes / count) if count else 0,
+    }
+
+
+def run_client(requests):
+    """Послідовні запити через тестовий клієнт Flask: (затримки, тривалість, помилки, байти)"""
+    client = main.app.test_client()
+    latencies = []
+    errors = 0
+    total_bytes = 0
+    started = time.perf_counter()
+    for method, path, form in requests:
+        request_started = time.perf_counter()
+        response = client.open(path, method=method, data=form)
+        body = response.get_data()
+        latencies.append(time.perf_counter() - request_started)
+        total_bytes += len(body)
+        errors += response.status_code >= 400
+    return latencies, time.perf_counter() - started, errors, total_bytes
+
+
+def run_http(port, requests, concurrency):
+    """Запити до gunicorn з concurrency паралельних з'єднань"""
+    latencies = []
+    counters = {'errors': 0, 'bytes': 0}
+    lock = threading.Lock()
+    queue = iter(requests)
+
+    def worker():
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=300)
+        while True:
+            with lock:
+                item = next(queue, None)
+            if item is None:
+                break
+            method, path, form = item
+            body = headers = None
+            if form is not None:
+                body = urlencode(form).encode()
+                headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+            request_started = time.perf_counter()
+            try:
+                conn.request(method, path, body=body, headers=headers or {})
+                response = conn.getresponse()
+                data = response.read()
+                status = response.status
+            except (http.client.HTTPException, OSError):
+                # Сервер закрив з'єднання - відкриваємо нове і рахуємо помилку
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=300)
+                data, status = b'', 599
+            elapsed = time.perf_counter() - request_started
+            with lock:
+                latencies.append(elapsed)
+                counters['bytes'] += len(data)
+                counters['errors'] += status >= 400
+        conn.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, time.perf_counter() - started, counters['errors'], counters['bytes']
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(data_dir, workers, threads, timeout=600, env=None):
+    """Запустити gunicorn у теці з даними і дочекатися /health (env - додаткові змінні)"""
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'main:app',
+         '--chdir', data_dir, '--pythonpath', REPO_DIR,
+         '--bind', f'127.0.0.1:{port}', '--workers', str(workers),
+         '--threads', str(threads), '--timeout', str(timeout), '--log-level', 'warning'],
+        env=dict(os.environ, STORAGE_BACKEND='journal', METRICS_DIR='', **(env or {})),
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn завершився: {process.stderr.read().decode(errors='replace')}")
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', '/health')
+            if conn.getresponse().status == 200:
+                conn.close()
+                return process, port
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("gunicorn не відповів на /health")
+
+
+def stop_gunicorn(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def suite_meta(args):
+    """Умови запуску для порівняння результатів між комітами"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=REPO_DIR,
+                                    capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        commit, dirty = None, None
+    return {
+        'commit': commit,
+        'dirty': dirty,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'write_behind': main.WRITE_BEHIND,
+        'args': vars(args),
+    }
+
+
+def bench_suite(args):
+    """Пропускна здатність і p50/p99 ендпоінтів для кількох розмірів реєстру"""
+    sizes = [int(s) for s in args.sizes.split(',')]
+    targets = ('client', 'gunicorn') if args.target == 'both' else (args.target,)
+    results = []
+    print(f"{'target':>9} {'size':>8} {'endpoint':>11} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>6}")
+    for size in sizes:
+        seed(size, with_text=True, base_time=SUITE_BASE_TIME)
+        # Стан на диску - спільна точка старту для обох цілей
+        main.save_phones()
+        data_dir = tempfile.mkdtemp(prefix="sms-bot-suite-")
+        shutil.copy(main.SNAPSHOT_FILE, data_dir)
+        # Однакові запити для обох цілей, складені до того, як база зміниться
+        rnd = random.Random(args.seed)
+        plan = {endpoint: suite_requests(endpoint, args.export_rounds if endpoint == 'export' else args.rounds, rnd)
+                for endpoint in SUITE_ENDPOINTS}
+        for target in targets:
+            if target == 'client':
+                main.load_phones()
+            else:
+                process, port = start_gunicorn(data_dir, args.workers, args.threads)
+            try:
+                for endpoint, requests in plan.items():
+                    if target == 'client':
+                        measured = run_client(requests)
+                    else:
+                        measured = run_http(port, requests, args.concurrency)
+                    result = summarize(target, size, endpoint, *measured)
+                    results.append(result)
+                    print(f"{target:>9} {size:>8} {endpoint:>11} {result['throughput_rps']:>9.1f} "
+                          f"{result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f} {result['errors']:>6}")
+            finally:
+                if target == 'gunicorn':
+                    stop_gunicorn(process)
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    output = os.path.join(START_DIR, args.output)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({'meta': suite_meta(args), 'results': results}, f, ensure_ascii=False, indent=2)
+    print(f"Результати: {output}")
+
+
+class StubSite:
+    """Локальний HTTP-сервер, що імітує сайт: затримка, збої, 429 з Retry-After"""
+
+    def __init__(self, latency, fail_rate, seed):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.rnd = random.Random(seed)
+        self.active = 0
+        self.peak = 0
+        # Час початку кожного запиту і кількість запитів на номер
+        self.times = []
+        self.requests = Counter()
+
+    async def handle(self, reader, writer):
+        request_line = await reader.readline()
+        while await reader.readline() not in (b'\r\n', b''):
+            pass
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        self.times.append(time.monotonic())
+        phone = parse_qs(urlparse(request_line.split()[1].decode()).query)['phone'][0]
+        self.requests[phone] += 1
+        await asyncio.sleep(self.latency)
+        self.active -= 1
+        roll = self.rnd.random()
+        extra = ''
+        if roll < self.fail_rate / 10:
+            status, extra = '429 Too Many Requests', 'Retry-After: 1\r\n'
+        elif roll < self.fail_rate:
+            status = '503 Service Unavailable'
+        else:
+            # Детермінований результат: парні номери "знайдено"
+            status = '200 OK' if int(phone[-1]) % 2 == 0 else '404 Not Found'
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\nConnection: close\r\n{extra}\r\n".encode())
+        await writer.drain()
+        writer.close()
+
+    def peak_rate(self, window=1.0):
+        """Найбільша кількість запитів за будь-яке вікно window секунд"""
+        times = sorted(self.times)
+        peak = start = 0
+        for end, moment in enumerate(times):
+            while moment - times[start] >= window:
+                start += 1
+            peak = max(peak, end - start + 1)
+        return peak
+
+
+# Процес, що опитує /health кожні 100 мс і друкує затримки (мс) JSON-масивом
+HEALTH_PROBE = '''
+import sys, json, time, http.client
+port, seconds = int(sys.argv[1]), float(sys.argv[2])
+deadline = time.monotonic() + seconds
+samples = []
+while time.monotonic() < deadline:
+    started = time.perf_counter()
+    try:
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        conn.request('GET', '/health')
+        conn.getresponse().read()
+        conn.close()
+    except (http.client.HTTPException, OSError):
+        pass
+    samples.append((time.perf_counter() - started) * 1000)
+    time.sleep(0.1)
+print(json.dumps(samples))
+'''
+
+
+def bench_admission(flood, rows, seconds, threads):
+    """Затримка /health під потоком масових імпортів з однієї адреси: без допуску і з ним"""
+    print(f"{'admission':>9} {'flood ok':>9} {'flood 429':>10} {'polite ok':>10} {'polite 429':>11} "
+          f"{'probes':>7} {'health p50 ms':>14} {'p99 ms':>8} {'max ms':>8}")
+    errors = []
+    for enabled in (False, True):
+        env = {'TRUSTED_PROXIES': '1'}
+        if enabled:
+            env.update(ADMISSION_RATE='5', ADMISSION_BURST='20', ADMISSION_CONCURRENCY='2', ADMISSION_QUEUE='4')
+        data_dir = tempfile.mkdtemp(prefix="sms-bot-admission-")
+        process, port = start_gunicorn(data_dir, 1, threads, env=env)
+        deadline = time.monotonic() + seconds
+        lock = threading.Lock()
+        counts = Counter()
+        # /health опитує окремий процес: потоки клієнта-порушника не спотворюють виміри
+        prober = subprocess.Popen([sys.executable, '-c', HEALTH_PROBE, str(port), str(seconds)],
+                                  stdout=subprocess.PIPE, text=True)
+
+        def post(conn, path, body, content_type, client):
+            conn.request('POST', path, body=body, headers={'Content-Type': content_type, 'X-Forwarded-For': client})
+            response = conn.getresponse()
+            response.read()
+            if response.status == 429 and not response.getheader('Retry-After'):
+                errors.append("429 без Retry-After")
+            return response.status
+
+        def flooder(n):
+            # Тіло готується один раз: повтори - дублікати, але розбір і нормалізація ті самі
+            body = json.dumps([f'+38067{(n * rows + i) % 10 ** 7:07d}' for i in range(rows)])
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            while time.monotonic() < deadline:
+                try:
+                    status = post(conn, '/api/phones/bulk', body, 'application/json', '10.0.0.1')
+                except (http.client.HTTPException, OSError):
+                    conn.close()
+                    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+                    status = 599
+                with lock:
+                    counts['flood 429' if status == 429 else 'flood ok'] += 1
+            conn.close()
+
+        def polite():
+            # Інший клієнт реєструє номер раз на секунду
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            i = 0
+            while time.monotonic() < deadline:
+                status = post(conn, '/register', urlencode({'phone': f'+38050{i:07d}'}),
+                              'application/x-www-form-urlencoded', '10.0.0.2')
+                counts['polite 429' if status == 429 else 'polite ok'] += 1
+                i += 1
+                time.sleep(1)
+            conn.close()
+
+        workers = [threading.Thread(target=flooder, args=(n,)) for n in range(flood)]
+        workers.append(threading.Thread(target=polite))
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        health = json.loads(prober.communicate()[0])
+        stop_gunicorn(process)
+        shutil.rmtree(data_dir, ignore_errors=True)
+        print(f"{'on' if enabled else 'off':>9} {counts['flood ok']:>9} {counts['flood 429']:>10} "
+              f"{counts['polite ok']:>10} {counts['polite 429']:>11} {len(health):>7} "
+              f"{percentile(health, 50):>14.1f} {percentile(health, 99):>8.1f} {max(health):>8.1f}")
+        if enabled:
+            # Запас burst плюс rate за час тесту
+            if counts['flood ok'] > 20 + 5 * seconds + 1:
+                errors.append(f"клієнт пройшов {counts['flood ok']} разів при обмеженні 5/с")
+            if counts['polite 429']:
+                errors.append(f"ввічливий клієнт отримав {counts['polite 429']} відмов")
+    for error in sorted(set(errors))[:20]:
+        print("  ✗", error)
+    if errors:
+        sys.exit(1)
+
+
+def bench_monitor(numbers, site_count, concurrency, rate, latency_ms, fail_rate, timeout):
+    """Перевірка номерів на локальних сайтах-заглушках: пропускна здатність і дотримання обмежень"""
+    keys = [f'+38067{i:07d}' for i in range(numbers)]
+    stubs = [StubSite(latency_ms / 1000, fail_rate, seed) for seed in range(site_count)]
+    ready = threading.Event()
+    ports = []
+
+    def serve():
+        async def run():
+            for stub in stubs:
+                server = await asyncio.start_server(stub.handle, '127.0.0.1', 0, backlog=1024)
+                ports.append(server.sockets[0].getsockname()[1])
+            ready.set()
+            await asyncio.Event().wait()
+        asyncio.run(run())
+
+    threading.Thread(target=serve, daemon=True).start()
+    ready.wait()
+    sites = [Site(f"site{i}", f"http://127.0.0.1:{port}/check?phone={{phone}}",
+                  concurrency=concurrency, rate=rate, timeout=5)
+             for i, port in enumerate(ports)]
+    store = ResultStore(os.path.join(os.getcwd(), 'bench-monitor.db'))
+    monitor = Monitor(sites, store, keys_func=lambda: keys, interval=3600, tick=0.2,
+                      backoff=0.05, backoff_max=0.5)
+
+    started = time.perf_counter()
+    monitor.start()
+    while not monitor.running:
+        time.sleep(0.01)
+    # Друга половина номерів ще чекає в чергах обходу: поставлені вдруге (і втретє),
+    # вони не повинні дати повторних запитів
+    for _ in range(2):
+        for key in keys[numbers // 2:]:
+            monitor.schedule(key)
+    expected = numbers * site_count
+    while time.perf_counter() - started < timeout:
+        done = sum(sum(counts.values()) for counts in store.summary().values())
+        if done >= expected:
+            break
+        time.sleep(0.1)
+    elapsed = time.perf_counter() - started
+    state = monitor.status()
+    monitor.stop()
+
+    errors = []
+    print(f"{'site':>6} {'requests':>9} {'retries':>8} {'found':>6} {'missing':>8} {'error':>6} "
+          f"{'peak conc':>10} {'peak rps':>9}")
+    for site, stub in zip(sites, stubs):
+        counts = state['sites'][site.name]
+        print(f"{site.name:>6} {len(stub.times):>9} {counts['retries']:>8} {counts['found']:>6} "
+              f"{counts['not_found']:>8} {counts['error']:>6} {stub.peak:>10} {stub.peak_rate():>9}")
+        if stub.peak > concurrency:
+            errors.append(f"{site.name}: {stub.peak} одночасних запитів при обмеженні {concurrency}")
+        # Token bucket дозволяє сплеск до concurrency запитів понад частоту;
+        # час приходу запиту на сервер трохи "гуляє" відносно видачі токена
+        if rate and stub.peak_rate() > rate * 1.05 + concurrency:
+            errors.append(f"{site.name}: {stub.peak_rate()} запитів за секунду при обмеженні {rate}")
+        # Кожен запит - перша спроба пари або її повтор
+        if len(stub.times) != len(stub.requests) + counts['retries']:
+            errors.append(f"{site.name}: {len(stub.times)} запитів, а пар {len(stub.requests)} "
+                          f"і повторів {counts['retries']} - перевірки дублюються")
+    saved = store.summary()
+    done = sum(sum(counts.values()) for counts in saved.values())
+    if done != expected:
+        errors.append(f"збережено {done} результатів з {expected}")
+    sample = store.for_key(keys[0])
+    if sample and any(result['status'] != 'found' for result in sample.values() if result['status'] != 'error'):
+        errors.append(f"{keys[0]}: неочікуваний результат {sample}")
+
+    print(f"{done} перевірок за {elapsed:.1f} с: {done / elapsed:.0f}/с, {done / elapsed * 3600:,.0f}/год")
+    for error in errors[:20]:
+        print("  ✗", error)
+    if errors:
+        sys.exit(1)
+
+
+def bench_dispatch(count, gateway_count, workers, batch, rate, latency_ms, fail_rate, ack_loss, timeout):
+    """Розсилка через локальні шлюзи: постановка в чергу, пропускна здатність, жодних подвійних SMS"""
+    queue = DispatchQueue(os.path.join(os.getcwd(), 'bench-dispatch.db'))
+    # 90% масової розсилки, потім 10% термінових - вони мають піти першими
+    bulk = [(f"bench:bulk:{i}", f'+38066{i:07d}', "Масова розсилка") for i in range(count - count // 10)]
+    urgent = [(f"bench:high:{i}", f'+38068{i:07d}', "Термінове повідомлення") for i in range(count // 10)]
+    started = time.perf_counter()
+    added = queue.enqueue(bulk, 'bulk')[0] + queue.enqueue(urgent, 'high')[0]
+    enqueue_elapsed = time.perf_counter() - started
+    # Повтор тих самих ключів нічого не додає
+    duplicates = queue.enqueue(urgent, 'high')[1]
+
+    gateways = [FakeGateway(f"fake{i}", max_batch=batch, rate=rate, workers=workers, latency=latency_ms / 1000,
+                            fail_rate=fail_rate, ack_loss=ack_loss, seed=i)
+                for i in range(gateway_count)]
+    dispatcher = Dispatcher(queue, gateways, max_attempts=50, backoff=0.05, backoff_max=0.5, idle=0.05)
+    started = time.perf_counter()
+    dispatcher.start()
+    while time.perf_counter() - started < timeout and sum(queue.depth().values()):
+        time.sleep(0.1)
+    elapsed = time.perf_counter() - started
+    dispatcher.stop()
+
+    errors = []
+    if added != count:
+        errors.append(f"у черзі {added} повідомлень з {count}")
+    if duplicates != len(urgent):
+        errors.append(f"повторна постановка: {duplicates} дублікатів з {len(urgent)}")
+    delivered = Counter(key for gateway in gateways for key in gateway.delivered)
+    double = [key for key, n in delivered.items() if n > 1]
+    if double:
+        errors.append(f"{len(double)} повідомлень доставлено кількома шлюзами, напр. {double[:3]}")
+    if len(delivered) != count:
+        errors.append(f"доставлено {len(delivered)} з {count}")
+    counts = queue.counts()
+    if counts.get('sent') != count:
+        errors.append(f"статуси в черзі: {counts}")
+    # Лічильники смуг мають збігатися з підрахунком за статусами
+    if sum(queue.depth().values()) != counts.get('queued', 0) + counts.get('sending', 0):
+        errors.append(f"глибина черги {queue.depth()} не збігається зі статусами {counts}")
+
+    print(f"{'gateway':>8} {'batches':>8} {'sent':>8} {'retries':>8} {'errors':>7} {'deduped':>8} {'peak/s':>7}")
+    for gateway in gateways:
+        stats = dispatcher.stats[gateway.name]
+        times = sorted(moment for _, _, moment in gateway.delivered.values())
+        peak = start = 0
+        for end, moment in enumerate(times):
+            while moment - times[start] >= 1.0:
+                start += 1
+            peak = max(peak, end - start + 1)
+        print(f"{gateway.name:>8} {stats['batches']:>8} {stats['sent']:>8} {stats['retries']:>8} "
+              f"{stats['errors']:>7} {gateway.duplicates:>8} {peak:>7}")
+        # Пакет - сплеск понад частоту, який token bucket дозволяє
+        if rate and peak > rate + batch:
+            errors.append(f"{gateway.name}: {peak} повідомлень за секунду при обмеженні {rate}")
+
+    # Термінові доставлені раніше за масові (за медіаною часу доставки)
+    delivered_at = {key: moment for gateway in gateways for key, (_, _, moment) in gateway.delivered.items()}
+    if urgent and bulk:
+        urgent_median = statistics.median(delivered_at[key] for key, _, _ in urgent if key in delivered_at)
+        bulk_median = statistics.median(delivered_at[key] for key, _, _ in bulk if key in delivered_at)
+        if urgent_median >= bulk_median:
+            errors.append("термінові повідомлення не випередили масові")
+
+    print(f"черга: {count} за {enqueue_elapsed:.2f} с ({count / enqueue_elapsed:,.0f}/с); "
+          f"розсилка: {elapsed:.1f} с ({len(delivered) / elapsed:,.0f} SMS/с)")
+    for error in errors[:20]:
+        print("  ✗", error)
+    if errors:
+        sys.exit(1)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__)
+    sub = parser.add_subparsers(dest="command", required=True)
+    register = sub.add_parser("register", help="затримка реєстрації номера")
+    register.add_argument("--sizes", default="1000,10000,100000,1000000")
+    register.add_argument("--rounds", type=int, default=2000)
+    bulk = sub.add_parser("bulk", help="масовий імпорт номерів")
+    bulk.add_argument("--batch", type=int, default=10000)
+    bulk.add_argument("--rounds", type=int, default=5)
+    home = sub.add_parser("home", help="рендер головної сторінки")
+    home.add_argument("--size", type=int, default=10000)
+    home.add_argument("--rounds", type=int, default=500)
+    search = sub.add_parser("search", help="пошук номерів")
+    search.add_argument("--sizes", default="1000,100000,1000000")
+    search.add_argument("--rounds", type=int, default=1000)
+    normalize_cmd = sub.add_parser("normalize", help="нормалізація номерів і визначення оператора")
+    normalize_cmd.add_argument("--count", type=int, default=200000)
+    stats = sub.add_parser("stats", help="агрегати реєстрацій за часом")
+    stats.add_argument("--sizes", default="1000,100000,1000000")
+    stats.add_argument("--rounds", type=int, default=1000)
+    expire = sub.add_parser("expire", help="перенесення номерів з вичерпаним строком в архів")
+    expire.add_argument("--sizes", default="100000,1000000")
+    expire.add_argument("--expired", type=int, default=20000, help="записів, що виходять за раунд")
+    expire.add_argument("--rounds", type=int, default=3)
+    memory = sub.add_parser("memory", help="пам'ять на один запис")
+    memory.add_argument("--count", type=int, default=200000)
+    startup = sub.add_parser("startup", help="завантаження снапшоту при старті")
+    startup.add_argument("--sizes", default="100000,1000000")
+    stress = sub.add_parser("stress", help="паралельні записи і читання")
+    stress.add_argument("--writers", type=int, default=8)
+    stress.add_argument("--readers", type=int, default=4)
+    stress.add_argument("--seconds", type=float, default=10)
+    stress.add_argument("--pool", type=int, default=200)
+    suite = sub.add_parser("suite", help="набір навантажувальних тестів ендпоінтів з JSON-звітом")
+    suite.add_argument("--sizes", default="1000,100000,1000000")
+    suite.add_argument("--target", choices=("client", "gunicorn", "both"), default="both")
+    suite.add_argument("--rounds", type=int, default=500)
+    suite.add_argument("--export-rounds", type=int, default=5)
+    suite.add_argument("--workers", type=int, default=1, help="журнал - сховище одного процесу")
+    suite.add_argument("--threads", type=int, default=4)
+    suite.add_argument("--concurrency", type=int, default=4)
+    suite.add_argument("--seed", type=int, default=42)
+    suite.add_argument("--output", default="bench-results.json")
+    monitor = sub.add_parser("monitor", help="перевірка номерів на локальних сайтах-заглушках")
+    monitor.add_argument("--numbers", type=int, default=2000)
+    monitor.add_argument("--sites", type=int, default=5)
+    monitor.add_argument("--concurrency", type=int, default=8)
+    monitor.add_argument("--rate", type=float, default=100, help="запитів на секунду до сайту (0 - без обмеження)")
+    monitor.add_argument("--latency-ms", type=float, default=20)
+    monitor.add_argument("--fail-rate", type=float, default=0.05)
+    monitor.add_argument("--timeout", type=float, default=300)
+    dispatch = sub.add_parser("dispatch", help="розсилка SMS через локальні шлюзи")
+    dispatch.add_argument("--messages", type=int, default=100000)
+    dispatch.add_argument("--gateways", type=int, default=2)
+    dispatch.add_argument("--workers", type=int, default=2, help="одночасних пакетів на шлюз")
+    dispatch.add_argument("--batch", type=int, default=100)
+    dispatch.add_argument("--rate", type=float, default=0, help="SMS на секунду на шлюз (0 - без обмеження)")
+    dispatch.add_argument("--latency-ms", type=float, default=5)
+    dispatch.add_argument("--fail-rate", type=float, default=0.02)
+    dispatch.add_argument("--ack-loss", type=float, default=0.02)
+    dispatch.add_argument("--timeout", type=float, default=600)
+    admission = sub.add_parser("admission", help="/health під потоком записів з однієї адреси (gunicorn)")
+    admission.add_argument("--flood", type=int, default=32, help="одночасних з'єднань клієнта-порушника")
+    admission.add_argument("--rows", type=int, default=5000, help="номерів в одному імпорті")
+    admission.add_argument("--seconds", type=float, default=10)
+    admission.add_argument("--threads", type=int, default=8, help="потоків gunicorn")
+    args = parser.parse_args()
+
+    if args.command == "register":
+        bench_register([int(s) for s in args.sizes.split(',')], args.rounds)
+    elif args.command == "bulk":
+        bench_bulk(args.batch, args.rounds)
+    elif args.command == "home":
+        bench_home(args.size, args.rounds)
+    elif args.command == "search":
+        bench_search([int(s) for s in args.sizes.split(',')], args.rounds)
+    elif args.command == "normalize":
+        bench_normalize(args.count)
+    elif args.command == "stats":
+        bench_stats([int(s) for s in args.sizes.split(',')], args.rounds)
+    elif args.command == "expire":
+        bench_expire([int(s) for s in args.sizes.split(',')], args.expired, args.rounds)
+    elif args.command == "memory":
+        bench_memory(args.count)
+    elif args.command == "startup":
+        bench_startup([int(s) for s in args.sizes.split(',')])
+    elif args.command == "stress":
+        bench_stress(args.writers, args.readers, args.seconds, args.pool)
+    elif args.command == "suite":
+        bench_suite(args)
+    elif args.command == "dispatch":
+        bench_dispatch(args.messages, args.gateways, args.workers, args.batch, args.rate, args.latency_ms,
+                       args.fail_rate, args.ack_loss, args.timeout)
+    elif args.command == "admission":
+        bench_admission(args.flood, args.rows, args.seconds, args.threads)
+    elif args.command == "monitor":
+        bench_monitor(args.numbers, args.sites, args.concurrency, args.rate, args.latency_ms,
+                      args.fail_rate, args.timeout)
+
+
+if __name__ == '__main__':
+    main_cli()
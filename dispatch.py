@@ -0,0 +1,474 @@
+"""
+SMS Bot - Черга розсилки SMS
+
+Повідомлення лежать у SQLite і переживають перезапуск. Кожне має ключ
+ідемпотентності: повторна постановка з тим самим ключем ігнорується, а
+шлюз отримує ключ разом із повідомленням і не доставляє його вдруге,
+навіть якщо відповідь на попередню спробу загубилась.
+
+Черги-смуги: high, normal, bulk - спершу розсилаються вищі. Для кожного
+шлюзу працюють потоки, що забирають пакети до max_batch повідомлень під
+оренду (lease), обмежують пропускну здатність шлюзу (token bucket) і
+повторюють невдалі спроби з експоненційною затримкою і випадковим
+розкидом. Повідомлення, оренда якого минула (процес упав посеред
+відправлення), повертається в чергу.
+"""
+
+import os
+import time
+import random
+import sqlite3
+import threading
+from importlib import import_module
+
+from workers import WalConnection, wait_for_lock
+
+# Смуги черги: менше число - вищий пріоритет
+PRIORITIES = {'high': 0, 'normal': 1, 'bulk': 2}
+LANES = {value: name for name, value in PRIORITIES.items()}
+# Скільки повідомлень ставити в чергу однією транзакцією
+ENQUEUE_CHUNK = 10000
+
+
+class GatewayError(Exception):
+    """Пакет не відправлено (або невідомо, чи відправлено) - варто повторити"""
+
+
+class Message:
+    """Повідомлення, передане шлюзу"""
+
+    __slots__ = ('id', 'key', 'phone', 'text', 'attempts')
+
+    def __init__(self, id, key, phone, text, attempts):
+        self.id = id
+        # Ключ ідемпотентності: шлюз не доставляє двічі повідомлення з тим самим ключем
+        self.key = key
+        self.phone = phone
+        self.text = text
+        self.attempts = attempts
+
+
+class SendResult:
+    """Результат відправлення одного повідомлення"""
+
+    __slots__ = ('ok', 'gateway_id', 'error', 'retryable')
+
+    def __init__(self, ok, gateway_id=None, error=None, retryable=True):
+        self.ok = ok
+        self.gateway_id = gateway_id
+        self.error = error
+        self.retryable = retryable
+
+
+class Gateway:
+    """Інтерфейс шлюзу SMS
+
+    send_batch отримує до max_batch повідомлень і повертає SendResult для
+    кожного в тому самому порядку. Виняток означає, що весь пакет треба
+    повторити. rate - повідомлень на секунду (0 - без обмеження), workers -
+    скільки пакетів відправляти одночасно.
+    """
+
+    name = "gateway"
+    max_batch = 100
+    rate = 0
+    workers = 1
+
+    def send_batch(self, messages):
+        raise NotImplementedError
+
+
+class FakeGateway(Gateway):
+    """Локальний шлюз для розробки і бенчмарків: нічого не відправляє
+
+    Доставлені повідомлення запам'ятовуються за ключем ідемпотентності.
+    fail_rate - частка пакетів, що падають цілком, і частка повідомлень з
+    тимчасовою помилкою; ack_loss - частка пакетів, що доставлені, але
+    відповідь на них "загубилась".
+    """
+
+    name = "fake"
+
+    def __init__(self, name="fake", max_batch=100, rate=0, workers=1, latency=0.0,
+                 fail_rate=0.0, ack_loss=0.0, seed=None):
+        self.name = name
+        self.max_batch = max_batch
+        self.rate = rate
+        self.workers = workers
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.ack_loss = ack_loss
+        self.rnd = random.Random(seed)
+        self.lock = threading.Lock()
+        # Ключ -> (номер, текст, час доставки)
+        self.delivered = {}
+        # Спроби доставити вже доставлене (відхилені за ключем)
+        self.duplicates = 0
+        self.batches = 0
+
+    def send_batch(self, messages):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.batches += 1
+            if self.rnd.random() < self.fail_rate:
+                raise GatewayError("шлюз тимчасово недоступний")
+            results = []
+            now = time.monotonic()
+            for message in messages:
+                if message.key in self.delivered:
+                    self.duplicates += 1
+                elif self.rnd.random() < self.fail_rate:
+                    results.append(SendResult(False, error="тимчасова помилка оператора"))
+                    continue
+                else:
+                    self.delivered[message.key] = (message.phone, message.text, now)
+                results.append(SendResult(True, gateway_id=f"{self.name}-{message.key}"))
+            if self.rnd.random() < self.ack_loss:
+                raise GatewayError("відповідь шлюзу втрачено")
+            return results
+
+
+def load_gateway(spec):
+    """Шлюз за назвою: fake або "модуль:Клас" (клас створюється без аргументів)"""
+    if spec == "fake":
+        return FakeGateway()
+    module, _, name = spec.partition(':')
+    if not name:
+        raise ValueError(f"Невідомий шлюз: {spec}")
+    return getattr(import_module(module), name)()
+
+
+class Throttle:
+    """Потокобезпечний token bucket: acquire(n) чекає, доки можна відправити n повідомлень"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, count):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Токени резервуються одразу, тож наступні потоки стають у чергу за цим
+            self.tokens -= count
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+    def release(self, count):
+        """Повернути зарезервовані, але не використані токени"""
+        if not self.rate or not count:
+            return
+        with self._lock:
+            self.tokens = min(self.burst, self.tokens + count)
+
+
+class DispatchQueue:
+    """Постійна черга повідомлень у SQLite"""
+
+    def __init__(self, path):
+        self.path = path
+        self._db = WalConnection(path, self._create_tables)
+        self._lock = threading.Lock()
+
+    def _create_tables(self, conn):
+        conn.execute("""CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            key TEXT NOT NULL UNIQUE,
+            phone TEXT NOT NULL,
+            text TEXT NOT NULL,
+            priority INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_at REAL NOT NULL DEFAULT 0,
+            lease_until REAL,
+            created_at REAL NOT NULL,
+            sent_at REAL,
+            gateway TEXT,
+            gateway_id TEXT,
+            error TEXT
+        )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS messages_queue ON messages (status, priority, id)")
+        self._create_lane_depth(conn)
+
+    def _create_lane_depth(self, conn):
+        """Лічильники глибини смуг для depth(): тригери оновлюють їх у тих самих
+        транзакціях, що й повідомлення, тож підрахунок черги не потрібен"""
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'lane_depth'").fetchone() is None:
+                conn.execute("CREATE TABLE lane_depth (priority INTEGER PRIMARY KEY, count INTEGER NOT NULL)")
+                # Черга, створена до лічильників, рахується один раз
+                conn.executemany(
+                    "INSERT INTO lane_depth VALUES (?, (SELECT COUNT(*) FROM messages "
+                    "WHERE priority = ? AND status IN ('queued', 'sending')))",
+                    [(lane, lane) for lane in LANES])
+                conn.execute("""CREATE TRIGGER lane_depth_insert AFTER INSERT ON messages
+                    WHEN NEW.status IN ('queued', 'sending') BEGIN
+                        UPDATE lane_depth SET count = count + 1 WHERE priority = NEW.priority;
+                    END""")
+                conn.execute("""CREATE TRIGGER lane_depth_update AFTER UPDATE OF status ON messages
+                    WHEN (OLD.status IN ('queued', 'sending')) != (NEW.status IN ('queued', 'sending')) BEGIN
+                        UPDATE lane_depth SET count = count + CASE WHEN NEW.status IN ('queued', 'sending') THEN 1 ELSE -1 END
+                        WHERE priority = NEW.priority;
+                    END""")
+                conn.execute("""CREATE TRIGGER lane_depth_delete AFTER DELETE ON messages
+                    WHEN OLD.status IN ('queued', 'sending') BEGIN
+                        UPDATE lane_depth SET count = count - 1 WHERE priority = OLD.priority;
+                    END""")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _transaction(self, work):
+        with self._lock:
+            conn = self._db.get()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = work(conn)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return result
+
+    def enqueue(self, items, priority='normal'):
+        """Поставити повідомлення (ключ, номер, текст); повертає (нових, дублікатів)"""
+        lane = PRIORITIES[priority]
+        now = time.time()
+        added = total = 0
+        chunk = []
+
+        def insert(conn):
+            # rowcount, а не total_changes: той рахує і рядки, змінені тригерами
+            return conn.executemany(
+                "INSERT OR IGNORE INTO messages (key, phone, text, priority, created_at) VALUES (?, ?, ?, ?, ?)",
+                chunk).rowcount
+
+        for key, phone, text in items:
+            chunk.append((key, phone, text, lane, now))
+            if len(chunk) >= ENQUEUE_CHUNK:
+                added += self._transaction(insert)
+                total += len(chunk)
+                chunk = []
+        if chunk:
+            added += self._transaction(insert)
+            total += len(chunk)
+        return added, total - added
+
+    def claim(self, gateway, limit, lease):
+        """Забрати для шлюзу до limit готових повідомлень у порядку пріоритету під оренду на lease секунд
+
+        Повідомлення, яке вже пробували відправити, повторюється лише через
+        той самий шлюз: інший не знає його ключа ідемпотентності.
+        """
+        now = time.time()
+
+        def work(conn):
+            rows = conn.execute(
+                """UPDATE messages SET status = 'sending', lease_until = ?, attempts = attempts + 1, gateway = ?
+                   WHERE id IN (SELECT id FROM messages
+                                WHERE status = 'queued' AND next_at <= ? AND (gateway IS NULL OR gateway = ?)
+                                ORDER BY priority, id LIMIT ?)
+                   RETURNING id, key, phone, text, attempts, priority""",
+                (now + lease, gateway, now, gateway, limit)).fetchall()
+            return sorted(rows, key=lambda row: (row[5], row[0]))
+
+        return [Message(*row[:5]) for row in self._transaction(work)]
+
+    def complete(self, sent, retry, failed):
+        """Записати результати пакета
+
+        sent - [(id, gateway_id)], retry - [(id, next_at, помилка)], failed - [(id, помилка)].
+        """
+        now = time.time()
+
+        def work(conn):
+            conn.executemany(
+                "UPDATE messages SET status = 'sent', sent_at = ?, gateway_id = ?, error = NULL, "
+                "lease_until = NULL WHERE id = ? AND status = 'sending'",
+                [(now, gateway_id, message_id) for message_id, gateway_id in sent])
+            conn.executemany(
+                "UPDATE messages SET status = 'queued', next_at = ?, error = ?, lease_until = NULL "
+                "WHERE id = ? AND status = 'sending'",
+                [(next_at, error, message_id) for message_id, next_at, error in retry])
+            conn.executemany(
+                "UPDATE messages SET status = 'failed', error = ?, lease_until = NULL "
+                "WHERE id = ? AND status = 'sending'",
+                [(error, message_id) for message_id, error in failed])
+
+        self._transaction(work)
+
+    def recover(self):
+        """Повернути в чергу повідомлення з простроченою орендою"""
+        now = time.time()
+        return self._transaction(lambda conn: conn.execute(
+            "UPDATE messages SET status = 'queued', lease_until = NULL "
+            "WHERE status = 'sending' AND lease_until < ?", (now,)).rowcount)
+
+    def depth(self):
+        """Повідомлення, що чекають або відправляються: смуга -> кількість"""
+        with self._lock:
+            rows = self._db.get().execute("SELECT priority, count FROM lane_depth").fetchall()
+        depth = dict.fromkeys(PRIORITIES, 0)
+        for lane, count in rows:
+            depth[LANES[lane]] = count
+        return depth
+
+    def counts(self):
+        """Кількість повідомлень за статусами"""
+        with self._lock:
+            rows = self._db.get().execute("SELECT status, COUNT(*) FROM messages GROUP BY status").fetchall()
+        return dict(rows)
+
+    def get(self, key):
+        """Стан повідомлення за ключем ідемпотентності"""
+        with self._lock:
+            cursor = self._db.get().execute(
+                "SELECT key, phone, priority, status, attempts, created_at, sent_at, gateway, gateway_id, error "
+                "FROM messages WHERE key = ?", (key,))
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        message = dict(zip([column[0] for column in cursor.description], row))
+        message['priority'] = LANES[message['priority']]
+        return message
+
+    def close(self):
+        self._db.close()
+
+
+class Dispatcher:
+    """Потоки, що розсилають чергу через шлюзи
+
+    Усі шлюзи беруть нові повідомлення з однієї черги. У кількох процесах
+    розсилає лише той, що утримує блокування lock_file, тож обмеження
+    швидкості шлюзу діє на весь сервіс.
+    """
+
+    def __init__(self, queue, gateways, max_attempts=5, backoff=2.0, backoff_max=600.0,
+                 lease=60.0, idle=0.5, lock_file=None):
+        self.queue = queue
+        self.gateways = gateways
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        # Скільки секунд повідомлення належить потоку, що його відправляє
+        self.lease = lease
+        # Пауза, коли готових повідомлень немає
+        self.idle = idle
+        self.lock_file = lock_file
+        self.running = False
+        self.stats = {gateway.name: {'batches': 0, 'sent': 0, 'retries': 0, 'failed': 0, 'errors': 0}
+                      for gateway in gateways}
+        self._stats_lock = threading.Lock()
+        self._throttles = {gateway.name: Throttle(gateway.rate, gateway.max_batch) for gateway in gateways}
+        self._threads = []
+        self._stopping = threading.Event()
+        self._lock_fd = None
+
+    def start(self):
+        """Запустити розсилку (потоки почнуть працювати, коли отримають блокування)"""
+        if self._threads:
+            return
+        self._stopping.clear()
+        thread = threading.Thread(target=self._run, name="sms-dispatch", daemon=True)
+        self._threads.append(thread)
+        thread.start()
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self):
+        if self.lock_file:
+            self._lock_fd = wait_for_lock(self.lock_file, self._stopping.is_set, self._stopping.wait)
+            if self._lock_fd is None:
+                return
+        self.queue.recover()
+        self.running = True
+        workers = [threading.Thread(target=self._worker, args=(gateway,), name=f"sms-{gateway.name}-{i}",
+                                    daemon=True)
+                   for gateway in self.gateways for i in range(gateway.workers)]
+        for worker in workers:
+            worker.start()
+        # Оренду перевіряємо вдвічі частіше, ніж вона триває
+        while not self._stopping.wait(self.lease / 2):
+            self.queue.recover()
+        for worker in workers:
+            worker.join()
+        self.running = False
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def _worker(self, gateway):
+        throttle = self._throttles[gateway.name]
+        while not self._stopping.is_set():
+            try:
+                if not self.send_once(gateway, throttle):
+                    self._stopping.wait(self.idle)
+            except sqlite3.Error as e:
+                print(f"⚠️ Розсилка: помилка черги: {e}")
+                self._stopping.wait(self.idle)
+
+    def send_once(self, gateway, throttle=None):
+        """Відправити один пакет через шлюз; повертає кількість повідомлень у ньому"""
+        throttle = throttle or self._throttles[gateway.name]
+        # Токени - до claim: очікування не з'їдає оренду, і recover() не поверне
+        # в чергу повідомлення, які ще відправляються. Зайві токени повертаються
+        throttle.acquire(gateway.max_batch)
+        messages = []
+        try:
+            messages = self.queue.claim(gateway.name, gateway.max_batch, self.lease)
+        finally:
+            throttle.release(gateway.max_batch - len(messages))
+        if not messages:
+            return 0
+        stats = self.stats[gateway.name]
+        try:
+            results = gateway.send_batch(messages)
+            if len(results) != len(messages):
+                raise GatewayError(f"шлюз повернув {len(results)} результатів на {len(messages)} повідомлень")
+        except Exception as e:
+            # Невідомо, що з пакета дійшло: повторюємо все з тими самими ключами
+            results = [SendResult(False, error=f"{type(e).__name__}: {e}")] * len(messages)
+            with self._stats_lock:
+                stats['errors'] += 1
+
+        sent, retry, failed = [], [], []
+        for message, result in zip(messages, results):
+            if result.ok:
+                sent.append((message.id, result.gateway_id))
+            elif result.retryable and message.attempts < self.max_attempts:
+                retry.append((message.id, time.time() + self.retry_delay(message.attempts), result.error))
+            else:
+                failed.append((message.id, result.error))
+        self.queue.complete(sent, retry, failed)
+        with self._stats_lock:
+            stats['batches'] += 1
+            stats['sent'] += len(sent)
+            stats['retries'] += len(retry)
+            stats['failed'] += len(failed)
+        return len(messages)
+
+    def retry_delay(self, attempts):
+        """Експоненційна затримка з випадковим розкидом, щоб повтори не йшли хвилею"""
+        return min(self.backoff * 2 ** (attempts - 1), self.backoff_max) * random.uniform(0.5, 1.0)
+
+    def status(self):
+        with self._stats_lock:
+            gateways = {name: dict(stats) for name, stats in self.stats.items()}
+        for gateway in self.gateways:
+            gateways[gateway.name].update(rate=gateway.rate, max_batch=gateway.max_batch, workers=gateway.workers)
+        return {'running': self.running, 'gateways': gateways}
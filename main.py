@@ -3,16 +3,169 @@ SMS Bot - Система реєстрації телефонних номері
 """
 
 import os
+import re
+import io
+import csv
 import json
+import base64
+import bisect
+import gc
+import hashlib
+import gzip
 import time
-from flask import Flask, render_template_string, request, jsonify, redirect, url_for
+import zlib
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from itertools import groupby
+from operator import attrgetter, itemgetter
+from flask import Flask, Response, request, jsonify, redirect, url_for, g
+from werkzeug.http import is_resource_modified
+from storage import JournalStorage, SQLiteStorage
+from search import SearchIndex
+from records import PhoneRecord, Snapshot
+from metrics import Metrics
+from analytics import RegistrationStats, RESOLUTIONS
+from numbering import normalize, normalize_many
+from monitor import Monitor, ResultStore, load_sites
+from dispatch import Dispatcher, DispatchQueue, PRIORITIES, load_gateway
+from admission import ClientLimiter, Gate, retry_after
+from archive import Archive, Expirer
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", "railway-secret-123")
 
 # База даних у пам'яті (для демо)
 phones_database = []
+# Індекс: нормалізований номер (E.164) -> запис
+phones_index = {}
+# Індекс: ID запису -> запис (лише живі записи)
+phones_by_id = {}
+# Пошук за цифрами номера, іменем і примітками
+search_index = SearchIndex()
+# Живі номери за часом реєстрації і операторами (див. /api/stats)
+registrations = RegistrationStats()
+# Кількість видалених записів, що ще лишаються в phones_database
+tombstones = 0
+# Межа (registered_at, ключ): усі записи до неї вже перенесено в архів
+expired_bound = (0.0, '')
+# Список стискається, коли надгробків більше половини (але не менше TOMBSTONES_MIN)
+TOMBSTONES_MIN = 1000
+# База змінюється лише під цим блокуванням; читачі працюють з опублікованим
+# знімком (records.Snapshot) і на записників не чекають
+write_lock = threading.RLock()
+# Версія бази: зростає з кожною застосованою операцією
+version = 0
+snapshot = Snapshot(version, phones_database, 0)
+# Готові тіла повного списку номерів: (шлях, формат, gzip) -> (seq, байти)
+body_cache = {}
+# Журнал змін для /api/changes: (нижня межа, [[seq, зміна], ...]).
+# Зміни з seq <= нижньої межі вже недоступні; список лише дописується,
+# а при обрізанні замінюється новим. Зміна кодується в JSON при першому
+# читанні (див. change_data), а не під write_lock
+change_log = (0, [])
+# Сповіщає потоки SSE про новий опублікований знімок
+changes_cond = threading.Condition()
+# Той самий вигляд, що й у jsonify: впорядковані ключі, без пробілів
+encode_record = json.JSONEncoder(ensure_ascii=False, sort_keys=True, separators=(',', ':')).encode
+# Розбір тіл масового імпорту: orjson помітно швидший за стандартний json
+load_json = orjson.loads if orjson is not None else json.loads
+# Для журналу змін: запис реєстру в зміні перетворюється на словник API
+encode_change = json.JSONEncoder(ensure_ascii=False, sort_keys=True, separators=(',', ':'),
+                                 default=PhoneRecord.to_dict).encode
+# Бінарний снапшот бази (див. snapshot.py)
+SNAPSHOT_FILE = "phones_data.bin"
+# Снапшот попередніх версій - переноситься в бінарний при першому старті
 STATS_FILE = "phones_data.json"
+# Журнал операцій (register/delete/clear), що дописується після снапшоту
+JOURNAL_FILE = "phones_journal.log"
+# Після скількох операцій журнал стискається в снапшот (для sqlite - оновлюється снапшот для старту)
+JOURNAL_COMPACT_EVERY = int(os.getenv("JOURNAL_COMPACT_EVERY", 10000))
+# Відкладений запис журналу фоновим потоком (див. storage.JournalStorage)
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "0") == "1"
+WRITE_BEHIND_MS = int(os.getenv("WRITE_BEHIND_MS", 50))
+WRITE_BEHIND_OPS = int(os.getenv("WRITE_BEHIND_OPS", 1000))
+# Сховище: journal - файли одного процесу, sqlite - спільна база для кількох воркерів
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "journal")
+SQLITE_FILE = os.getenv("SQLITE_FILE", "phones.db")
+# Тека, через яку воркери gunicorn обмінюються метриками (порожньо - лише свій процес)
+METRICS_DIR = os.getenv("METRICS_DIR", "")
+
+# Розміри сторінок списку номерів
+HOME_PAGE_SIZE = int(os.getenv("HOME_PAGE_SIZE", 50))
+API_PAGE_SIZE = 100
+API_PAGE_MAX = 1000
+# Максимальна кількість рядків в одному запиті масового імпорту
+BULK_MAX_ROWS = int(os.getenv("BULK_MAX_ROWS", 100000))
+# Скільки байтів готових тіл списку номерів тримати в кеші поточної версії
+BODY_CACHE_MAX_BYTES = int(os.getenv("BODY_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+# Скільки останніх змін зберігати для /api/changes
+CHANGES_KEEP = int(os.getenv("CHANGES_KEEP", 10000))
+# Потік SSE: коментар-пульс для проксі і максимальна тривалість з'єднання
+# (після неї браузер перепідключається з Last-Event-ID)
+SSE_HEARTBEAT_SECONDS = 15
+SSE_MAX_SECONDS = int(os.getenv("SSE_MAX_SECONDS", 300))
+# Скільки потоків SSE один воркер тримає одночасно (0 - без обмеження).
+# Кожен потік займає потік gthread, тож разом з ADMISSION_CONCURRENCY і
+# ADMISSION_QUEUE значення має бути меншим за --threads; решта клієнтів
+# отримує 503 і опитує /api/changes
+SSE_MAX_STREAMS = int(os.getenv("SSE_MAX_STREAMS", 1))
+# Через скільки секунд клієнт, якому відмовлено в потоці, може спробувати знову
+SSE_RETRY_SECONDS = 30
+# Моніторинг номерів на сайтах (див. monitor.py): JSON {"назва": "адреса з {phone}" | {...}}.
+# Порожньо - моніторинг вимкнено
+MONITOR_SITES = os.getenv("MONITOR_SITES", "")
+MONITOR_DB = os.getenv("MONITOR_DB", "monitor.db")
+# Як часто перевіряти кожен номер повторно, секунди
+MONITOR_INTERVAL = int(os.getenv("MONITOR_INTERVAL", 6 * 3600))
+# Обмеження за замовчуванням для кожного сайту: одночасні запити і запитів на секунду
+MONITOR_CONCURRENCY = int(os.getenv("MONITOR_CONCURRENCY", 4))
+MONITOR_RATE = float(os.getenv("MONITOR_RATE", 5))
+# Розсилка SMS (див. dispatch.py): шлюзи через кому - fake (локальний, нічого не
+# відправляє) або "модуль:Клас". Порожньо - розсилку вимкнено
+DISPATCH_GATEWAY = os.getenv("DISPATCH_GATEWAY", "")
+DISPATCH_DB = os.getenv("DISPATCH_DB", "dispatch.db")
+# Перевизначити обмеження шлюзів: повідомлень на секунду і розмір пакета
+DISPATCH_RATE = os.getenv("DISPATCH_RATE")
+DISPATCH_BATCH = os.getenv("DISPATCH_BATCH")
+# Найдовший текст повідомлення (10 сегментів SMS)
+DISPATCH_TEXT_MAX = 1600
+# Скільки кошиків /api/stats віддає за замовчуванням: година, тиждень, місяць
+STATS_DEFAULT_LAST = {'minute': 60, 'hour': 168, 'day': 30}
+# Допуск запитів на запис (див. admission.py): запитів на секунду з одного
+# клієнта і запас для сплесків, у межах воркера. 0 - без обмеження
+ADMISSION_RATE = float(os.getenv("ADMISSION_RATE", 5))
+ADMISSION_BURST = int(os.getenv("ADMISSION_BURST", 20))
+# Великі тіла (масовий імпорт) коштують додатковий токен за кожні стільки байтів
+# (не більше за ADMISSION_BURST)
+ADMISSION_BYTES_PER_TOKEN = int(os.getenv("ADMISSION_BYTES_PER_TOKEN", 16384))
+# Скільки клієнтів пам'ятає обмежувач (найдавніші витісняються)
+ADMISSION_CLIENTS = int(os.getenv("ADMISSION_CLIENTS", 10000))
+# Одночасні записи воркера і скільки запитів чекають у черзі та як довго (секунди).
+# Разом із SSE_MAX_STREAMS менше за потоки gunicorn (--threads), щоб читачам
+# і /health лишались потоки.
+# 0 - без обмеження
+ADMISSION_CONCURRENCY = int(os.getenv("ADMISSION_CONCURRENCY", 2))
+ADMISSION_QUEUE = int(os.getenv("ADMISSION_QUEUE", 4))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 2))
+# Скільки проксі перед застосунком дописують X-Forwarded-For (на Railway - один)
+TRUSTED_PROXIES = int(os.getenv("TRUSTED_PROXIES", 0))
+# Строк зберігання номерів, секунди (0 - безстроково): старші номери переносяться в архів
+PHONE_TTL = int(os.getenv("PHONE_TTL", 0))
+# Як часто переносити номери з вичерпаним строком, секунди
+EXPIRE_INTERVAL = int(os.getenv("EXPIRE_INTERVAL", 60))
+# Записів в одному пакеті архіву: між пакетами записники не чекають на перенесення
+EXPIRE_BATCH = 10000
+ARCHIVE_FILE = os.getenv("ARCHIVE_FILE", "phones_archive.ndjson.gz")
 
 # Сайти для демонстрації
 SITES = {
@@ -24,29 +177,963 @@ SITES = {
 }
 
 # Статистика
-stats = {"started_at": time.time(), "requests": 0, "phones_registered": 0}
+stats = {"started_at": time.time(), "phones_registered": 0}
+# Затримки маршрутів і внутрішніх фаз (див. /metrics)
+metrics = Metrics(METRICS_DIR or None)
+# Допуск запитів на запис
+client_limiter = ClientLimiter(ADMISSION_RATE, ADMISSION_BURST, ADMISSION_CLIENTS) if ADMISSION_RATE > 0 else None
+write_gate = Gate(ADMISSION_CONCURRENCY, ADMISSION_QUEUE, ADMISSION_QUEUE_TIMEOUT) if ADMISSION_CONCURRENCY > 0 else None
+# Потоки SSE без черги: зайвий клієнт одразу переходить на опитування
+stream_gate = Gate(SSE_MAX_STREAMS, 0, 0) if SSE_MAX_STREAMS > 0 else None
+# Методи, що не змінюють дані: допуск їх не обмежує
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
 
-def load_phones():
-    """Завантажити номери з файлу"""
-    global phones_database
-    try:
-        if os.path.exists(STATS_FILE):
-            with open(STATS_FILE, 'r', encoding='utf-8') as f:
-                phones_database = json.load(f)
-                stats["phones_registered"] = len(phones_database)
-    except:
+NON_DIGITS = re.compile(r'\D')
+# Допустимі типи імені і приміток у масовому імпорті
+TEXT_TYPES = (str, type(None))
+# Запит, схожий на номер телефону: лише цифри, +, пробіли, дефіси, дужки
+PHONE_QUERY = re.compile(r'^[\d\s+\-()]+$')
+
+def normalize_phone(phone):
+    """Ключ збереженого номера у форматі E.164 (+380XXXXXXXXX)
+
+    Нові номери перевіряє і нормалізує numbering.normalize; ця функція
+    лише будує ключі для записів, збережених раніше як є.
+    """
+    digits = NON_DIGITS.sub('', phone)
+    if len(digits) == 10 and digits.startswith('0'):
+        digits = '380' + digits[1:]
+    elif len(digits) == 9:
+        digits = '380' + digits
+    return '+' + digits if digits else ''
+
+def make_record_id(key, registered_at):
+    """Незмінний ID запису, однаковий у всіх воркерів і після перезапуску"""
+    raw = f"{key}|{registered_at!r}".encode()
+    return hashlib.blake2b(raw, digest_size=8).hexdigest()
+
+def record_ids_at(registered_at):
+    """make_record_id для номерів одного пакета: час форматується один раз"""
+    suffix = f"|{registered_at!r}".encode()
+    blake2b = hashlib.blake2b
+    return lambda key: blake2b(key.encode() + suffix, digest_size=8).hexdigest()
+
+def make_record(data, key=None):
+    """Створити компактний запис зі словника (формат API і сховища)"""
+    if isinstance(data, PhoneRecord):
+        return data
+    key = key or normalize_phone(data['phone'])
+    record_id = data.get('id') or make_record_id(key, data['registered_at'])
+    return PhoneRecord.from_dict(data, key, record_id)
+
+def rebuild_index():
+    """Перебудувати індекси номерів"""
+    global phones_database, tombstones, expired_bound
+    phones_index.clear()
+    phones_by_id.clear()
+    tombstones = 0
+    expired_bound = (0.0, '')
+    for record in phones_database:
+        phones_index[record.key] = record
+        phones_by_id[record.id] = record
+    if len(phones_index) < len(phones_database):
+        # Старий phones_data.json міг зберегти один номер у різних записах
+        # (+380671234567 і 0671234567) - лишається перший зареєстрований, як при реєстрації
+        phones_index.clear()
+        phones_by_id.clear()
+        unique = []
+        for record in phones_database:
+            if record.key not in phones_index:
+                phones_index[record.key] = record
+                phones_by_id[record.id] = record
+                unique.append(record)
+        phones_database = unique
+    # Пошуковий індекс будується при першому пошуку: старт не чекає на
+    # розбір імен і приміток усіх записів; агрегати - при першому /api/stats
+    search_index.invalidate()
+    registrations.invalidate()
+
+def ensure_search_index():
+    """Побудувати пошуковий індекс, якщо його ще немає"""
+    if not search_index.built:
+        search_index.rebuild(phones_index.items())
+
+def ensure_registrations():
+    """Побудувати агрегати реєстрацій, якщо їх ще немає"""
+    if not registrations.built:
+        registrations.rebuild(phones_index.values())
+
+def is_live(record):
+    """Запис не видалений (видалені лишаються в списку до компакції)"""
+    return record.deleted is None
+
+def publish():
+    """Опублікувати знімок бази для читачів"""
+    global snapshot
+    seq = storage.seq
+    modified_at = snapshot.modified_at if seq == snapshot.seq else time.time()
+    snapshot = Snapshot(version, phones_database, len(phones_by_id), seq, modified_at)
+    with changes_cond:
+        changes_cond.notify_all()
+
+def record_change(op, **change):
+    """Додати застосовану операцію в журнал змін"""
+    change['seq'] = op['seq']
+    change['op'] = op['op']
+    append_changes([[op['seq'], change]])
+
+def append_changes(entries):
+    """Дописати записи [seq, зміна] в журнал змін, відкидаючи найстаріші"""
+    global change_log
+    floor, log = change_log
+    log.extend(entries)
+    if len(log) > 2 * CHANGES_KEEP:
+        dropped = len(log) - CHANGES_KEEP
+        change_log = (log[dropped - 1][0], log[dropped:])
+
+def change_data(entry):
+    """JSON зміни з журналу: кодується один раз, а не для кожного клієнта"""
+    data = entry[1]
+    if not isinstance(data, str):
+        # Два читачі можуть закодувати зміну одночасно - результат той самий
+        data = entry[1] = encode_change(data)
+    return data
+
+def reset_changes():
+    """Почати журнал змін з поточного стану сховища"""
+    global change_log
+    change_log = (storage.seq, [])
+
+def changes_since(since, seq):
+    """Зміни після since; None - частина з них вже недоступна або since з іншої бази"""
+    floor, log = change_log
+    if since < floor or since > seq:
+        return None
+    return log[bisect.bisect_right(log, since, key=itemgetter(0)):]
+
+def read_changes(since):
+    """Знімок і зміни після since (None - зміни недоступні)"""
+    view = snapshot
+    entries = changes_since(since, view.seq)
+    if entries is None and since > view.seq:
+        # Клієнт бачив seq іншого воркера, а цей ще не синхронізувався
+        # (записник тримав блокування) - наздоганяємо сховище і пробуємо знову
+        sync_storage(wait=True)
+        view = snapshot
+        entries = changes_since(since, view.seq)
+    return view, entries
+
+def compact_tombstones():
+    """Прибрати видалені записи зі списку"""
+    global phones_database, tombstones
+    # Новий список замість зміни старого: потоки, що його читають, не ламаються
+    phones_database = [record for record in phones_database if is_live(record)]
+    tombstones = 0
+
+# Стабільний ключ порядку номерів: (registered_at, ключ)
+record_sort_key = attrgetter('registered_at', 'key')
+
+def apply_registers(ops):
+    """Застосувати пакет реєстрацій (під write_lock), повертає ті, що щось змінили
+
+    Те саме, що apply_op для кожної, але список номерів, агрегати і журнал
+    змін оновлюються один раз на пакет: масовий імпорт не платить за
+    поштучну вставку.
+    """
+    global phones_database, version, expired_bound
+    records = []
+    accepted = []
+    for op in ops:
+        record = make_record(op['record'], op.get('key'))
+        key = record.key
+        # Дублікат номера, зокрема всередині того самого пакета
+        if key in phones_index:
+            continue
+        phones_index[key] = record
+        phones_by_id[record.id] = record
+        records.append(record)
+        accepted.append(op)
+    if not records:
+        return accepted
+    version += 1
+
+    # Список упорядкований за (registered_at, ключ) - на цьому тримаються курсори.
+    # Номери пакета здебільшого вже впорядковані, тож сортування лінійне
+    added = sorted(records, key=record_sort_key)
+    first = record_sort_key(added[0])
+    # Запис старший за межу архіву (розбіжність годинників) - наступне
+    # перенесення почне пошук з нього
+    if first < expired_bound:
+        expired_bound = first
+    if phones_database and first < record_sort_key(phones_database[-1]):
+        # Опублікований список читають інші потоки - вставка в середину
+        # робиться в копії; впорядкований хвіст і пакет Timsort зливає за лінійний час
+        pos = bisect.bisect_right(phones_database, first, key=record_sort_key)
+        tail = phones_database[pos:]
+        tail.extend(added)
+        tail.sort(key=record_sort_key)
+        phones_database = phones_database[:pos] + tail
+    else:
+        phones_database.extend(added)
+
+    if search_index.built:
+        for record in records:
+            search_index.add(record.key, record)
+    if registrations.built:
+        for (registered_at, carrier), count in Counter(
+                (record.registered_at, record.carrier) for record in records).items():
+            registrations.add(registered_at, carrier, count)
+    # Ключ - для межі перенесення на сторінці (phone може бути не нормалізованим)
+    append_changes([[op['seq'], {'phone': record, 'key': record.key, 'seq': op['seq'], 'op': 'register'}]
+                    for op, record in zip(accepted, records)])
+    if monitor is not None:
+        for record in records:
+            monitor.schedule(record.key)
+    stats["phones_registered"] = len(phones_by_id)
+    return accepted
+
+def apply_ops(ops):
+    """Застосувати операції журналу по порядку, повертає ті, що щось змінили"""
+    applied = []
+    for register, group in groupby(ops, key=lambda op: op['op'] == 'register'):
+        if register:
+            applied += apply_registers(list(group))
+        else:
+            applied += [op for op in group if apply_op(op)]
+    return applied
+
+def apply_op(op):
+    """Застосувати операцію журналу до бази в пам'яті (під write_lock)
+
+    Повертає False, якщо операція нічого не змінила (дублікат номера
+    або вже видалений запис).
+    """
+    global phones_database, tombstones, version, expired_bound
+    applied = False
+    if op['op'] == 'register':
+        return bool(apply_registers([op]))
+    elif op['op'] == 'delete':
+        record = phones_index.get(op['phone'])
+        # Номер могли видалити й зареєструвати знову - тоді це інший запис
+        if record is not None and op.get('id', record.id) == record.id:
+            del phones_index[op['phone']]
+            version += 1
+            # Видалення за O(1): запис лишається в списку як надгробок,
+            # старші знімки досі бачать його живим
+            record.deleted = version
+            del phones_by_id[record.id]
+            search_index.remove(op['phone'], record)
+            registrations.remove(record.registered_at, record.carrier)
+            tombstones += 1
+            if tombstones > TOMBSTONES_MIN and tombstones * 2 > len(phones_database):
+                compact_tombstones()
+            record_change(op, id=record.id, key=record.key)
+            if monitor is not None:
+                monitor.forget(record.key)
+            applied = True
+    elif op['op'] == 'clear':
+        version += 1
         phones_database = []
+        phones_index.clear()
+        phones_by_id.clear()
+        search_index.clear()
+        registrations.clear()
+        tombstones = 0
+        record_change(op)
+        if monitor is not None:
+            monitor.forget_all()
+        applied = True
+    elif op['op'] == 'expire':
+        # Записи до межі - префікс упорядкованого списку: пошук починається з
+        # межі попереднього перенесення, тож робота пропорційна кількості записів, що вийшли
+        bound = tuple(op['before'])
+        records = phones_database
+        start = bisect.bisect_left(records, expired_bound, key=record_sort_key)
+        end = bisect.bisect_left(records, bound, key=record_sort_key)
+        expired = [records[pos] for pos in range(start, end) if records[pos].deleted is None]
+        if expired:
+            version += 1
+            for record in expired:
+                record.deleted = version
+                del phones_index[record.key]
+                del phones_by_id[record.id]
+                search_index.remove(record.key, record)
+                registrations.remove(record.registered_at, record.carrier)
+                if monitor is not None:
+                    monitor.forget(record.key)
+            tombstones += len(expired)
+            record_change(op, before=list(bound), count=len(expired))
+            applied = True
+        expired_bound = max(expired_bound, bound)
+        if tombstones > TOMBSTONES_MIN and tombstones * 2 > len(phones_database):
+            compact_tombstones()
+    stats["phones_registered"] = len(phones_by_id)
+    return applied
+
+def make_storage():
+    """Створити сховище відповідно до STORAGE_BACKEND"""
+    journal = JournalStorage(SNAPSHOT_FILE, JOURNAL_FILE,
+                             compact_every=JOURNAL_COMPACT_EVERY,
+                             write_behind=WRITE_BEHIND,
+                             window_ms=WRITE_BEHIND_MS,
+                             window_ops=WRITE_BEHIND_OPS,
+                             legacy_file=STATS_FILE)
+    if STORAGE_BACKEND == "sqlite":
+        return SQLiteStorage(SQLITE_FILE, normalize_phone, make_record_id, legacy=journal,
+                             compact_every=JOURNAL_COMPACT_EVERY)
+    if STORAGE_BACKEND != "journal":
+        raise ValueError(f"Невідоме сховище: {STORAGE_BACKEND}")
+    return journal
+
+storage = make_storage()
+
+def load_phones():
+    """Завантажити номери зі сховища"""
+    global phones_database, version
+    with write_lock, metrics.phase('load'):
+        version += 1
+        # Мільйон нових об'єктів поспіль запускає збирач сміття знову і знову,
+        # хоча циклів серед них немає - на час завантаження він вимикається
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            records, ops = storage.load()
+            phones_database = [make_record(data) for data in records]
+            # Стабільне сортування: номери одного пакета вже впорядковані за ключем
+            phones_database.sort(key=attrgetter('registered_at'))
+            rebuild_index()
+            apply_ops(ops)
+            if tombstones:
+                compact_tombstones()
+        finally:
+            if gc_enabled:
+                gc.enable()
+        # Завантажені записи живуть до кінця процесу - наступні збирання їх не обходять
+        gc.freeze()
+        stats["phones_registered"] = len(phones_by_id)
+        # Одноразове перенесення JSON-снапшоту в бінарний формат
+        if storage.needs_compaction(len(phones_by_id)):
+            save_phones()
+        # Клієнти, що стежили за змінами до перезавантаження, отримають 410 і перечитають список
+        reset_changes()
+        publish()
 
 def save_phones():
-    """Зберегти номери у файл"""
+    """Записати повний снапшот бази (компакція сховища)"""
+    with write_lock:
+        if tombstones:
+            compact_tombstones()
+        storage.compact(phones_database)
+
+def sync_storage(wait=False):
+    """Застосувати зміни, зроблені іншими воркерами (wait - дочекатися записника)"""
+    # Якщо зараз пише інший потік, він і так наздоганяє сховище -
+    # читач на нього не чекає
+    if not write_lock.acquire(blocking=wait):
+        return
+    try:
+        with metrics.phase('sync'):
+            ops = storage.poll()
+        if ops is None:
+            load_phones()
+            return
+        if ops:
+            apply_ops(ops)
+            publish()
+    finally:
+        write_lock.release()
+
+def commit(*ops):
+    """Записати операції в сховище і застосувати їх, повертає прийняті
+
+    Записники виконуються по одному; операція, що нічого не змінила
+    (номер щойно зареєстрував інший потік), не вважається прийнятою.
+    """
+    with metrics.phase('lock_wait'):
+        write_lock.acquire()
     try:
-        with open(STATS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(phones_database, f, ensure_ascii=False, indent=2)
-    except:
-        pass
+        with metrics.phase('persist'):
+            synced, accepted = storage.commit(list(ops))
+        if synced is None:
+            # Відстали від спільного журналу - перечитуємо стан повністю
+            load_phones()
+            return accepted
+        with metrics.phase('apply'):
+            apply_ops(synced)
+            accepted = apply_ops(accepted)
+        if storage.needs_compaction(len(phones_by_id)):
+            with metrics.phase('compaction'):
+                save_phones()
+        publish()
+    finally:
+        write_lock.release()
+    return accepted
+
+def make_monitor():
+    """Створити планувальник перевірок, якщо задано MONITOR_SITES"""
+    sites = load_sites(MONITOR_SITES, concurrency=MONITOR_CONCURRENCY, rate=MONITOR_RATE)
+    if not sites:
+        return None
+    return Monitor(sites, ResultStore(MONITOR_DB),
+                   keys_func=lambda: [record.key for record in snapshot],
+                   is_live=lambda key: key in phones_index,
+                   # Номери, зареєстровані іншими воркерами, приходять через сховище
+                   refresh=sync_storage,
+                   interval=MONITOR_INTERVAL,
+                   # Перевіряє лише один воркер - той, що утримує блокування
+                   lock_file=MONITOR_DB + '.lock')
+
+monitor = make_monitor()
+
+def make_dispatcher():
+    """Створити розсилку SMS, якщо задано DISPATCH_GATEWAY"""
+    if not DISPATCH_GATEWAY:
+        return None
+    gateways = [load_gateway(spec.strip()) for spec in DISPATCH_GATEWAY.split(',')]
+    for gateway in gateways:
+        if DISPATCH_RATE:
+            gateway.rate = float(DISPATCH_RATE)
+        if DISPATCH_BATCH:
+            gateway.max_batch = int(DISPATCH_BATCH)
+    # Розсилає лише один воркер, тож обмеження шлюзу діє на весь сервіс
+    return Dispatcher(DispatchQueue(DISPATCH_DB), gateways, lock_file=DISPATCH_DB + '.lock')
+
+dispatcher = make_dispatcher()
+
+# Номери з вичерпаним строком (див. archive.py)
+archive = Archive(ARCHIVE_FILE)
+
+def expired_batch(cutoff, limit):
+    """Живі записи, зареєстровані раніше за cutoff (не більше limit), і межа для операції expire"""
+    records = phones_database
+    pos = bisect.bisect_left(records, expired_bound, key=record_sort_key)
+    batch = []
+    while pos < len(records) and records[pos].registered_at < cutoff:
+        record = records[pos]
+        if record.deleted is None:
+            if len(batch) == limit:
+                # Межа - перший запис, що не ввійшов у пакет
+                return batch, record_sort_key(record)
+            batch.append(record)
+        pos += 1
+    return batch, (cutoff, '')
+
+def expire_phones(cutoff=None):
+    """Перенести в архів номери, зареєстровані раніше за cutoff (за замовчуванням - старші за PHONE_TTL)
+
+    Повертає кількість перенесених номерів.
+    """
+    if cutoff is None:
+        cutoff = time.time() - PHONE_TTL
+    total = 0
+    while True:
+        # Блокування тримається на один пакет: записники між пакетами не чекають
+        with write_lock:
+            # Видалене іншими воркерами не повинно потрапити в архів
+            sync_storage()
+            records, bound = expired_batch(cutoff, EXPIRE_BATCH)
+            if not records:
+                return total
+            with metrics.phase('archive'):
+                archive.append([dict(record.to_dict(), key=record.key) for record in records])
+            if not commit({'op': 'expire', 'before': bound}):
+                return total
+        total += len(records)
+        if len(records) < EXPIRE_BATCH:
+            return total
+
+def make_expirer():
+    """Створити перенесення в архів, якщо задано PHONE_TTL"""
+    if PHONE_TTL <= 0:
+        return None
+    # Переносить лише один воркер - той, що утримує блокування
+    return Expirer(expire_phones, EXPIRE_INTERVAL, lock_file=ARCHIVE_FILE + '.lock')
+
+expirer = make_expirer()
 
 # Завантажити дані при старті
 load_phones()
+if monitor is not None:
+    monitor.start()
+if dispatcher is not None:
+    dispatcher.start()
+if expirer is not None:
+    expirer.start()
+
+# Стилі та скрипти сторінки віддаються окремими файлами з довгим кешуванням
+APP_CSS = '''
+* {
+    margin: 0;
+    padding: 0;
+    box-sizing: border-box;
+}
+
+body {
+    font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
+    background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+    color: #333;
+    min-height: 100vh;
+    padding: 20px;
+}
+
+.container {
+    max-width: 1200px;
+    margin: 0 auto;
+    background: rgba(255, 255, 255, 0.95);
+    border-radius: 20px;
+    padding: 30px;
+    box-shadow: 0 10px 30px rgba(0, 0, 0, 0.2);
+}
+
+header {
+    text-align: center;
+    margin-bottom: 40px;
+    padding-bottom: 20px;
+    border-bottom: 2px solid #eee;
+}
+
+h1 {
+    color: #4a5568;
+    font-size: 2.5rem;
+    margin-bottom: 10px;
+}
+
+.subtitle {
+    color: #718096;
+    font-size: 1.2rem;
+}
+
+.main-content {
+    display: grid;
+    grid-template-columns: 1fr 1fr;
+    gap: 30px;
+}
+
+@media (max-width: 768px) {
+    .main-content {
+        grid-template-columns: 1fr;
+    }
+}
+
+.card {
+    background: white;
+    border-radius: 15px;
+    padding: 25px;
+    box-shadow: 0 5px 15px rgba(0, 0, 0, 0.1);
+}
+
+.card h2 {
+    color: #4a5568;
+    margin-bottom: 20px;
+    display: flex;
+    align-items: center;
+    gap: 10px;
+}
+
+.form-group {
+    margin-bottom: 20px;
+}
+
+label {
+    display: block;
+    margin-bottom: 8px;
+    font-weight: 600;
+    color: #4a5568;
+}
+
+input, textarea, select {
+    width: 100%;
+    padding: 12px 15px;
+    border: 2px solid #e2e8f0;
+    border-radius: 10px;
+    font-size: 16px;
+    transition: border-color 0.3s;
+}
+
+input:focus, textarea:focus, select:focus {
+    outline: none;
+    border-color: #667eea;
+}
+
+textarea {
+    min-height: 100px;
+    resize: vertical;
+}
+
+.btn {
+    background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+    color: white;
+    border: none;
+    padding: 14px 25px;
+    border-radius: 10px;
+    font-size: 16px;
+    font-weight: 600;
+    cursor: pointer;
+    transition: transform 0.2s, box-shadow 0.2s;
+    display: inline-flex;
+    align-items: center;
+    gap: 8px;
+}
+
+.btn:hover {
+    transform: translateY(-2px);
+    box-shadow: 0 5px 15px rgba(102, 126, 234, 0.4);
+}
+
+.btn-delete {
+    background: linear-gradient(135deg, #f56565 0%, #c53030 100%);
+}
+
+.btn-export {
+    background: linear-gradient(135deg, #48bb78 0%, #2f855a 100%);
+}
+
+.phones-list {
+    max-height: 400px;
+    overflow-y: auto;
+}
+
+.phone-item {
+    background: #f7fafc;
+    border-radius: 10px;
+    padding: 15px;
+    margin-bottom: 10px;
+    border-left: 4px solid #667eea;
+}
+
+.phone-item:nth-child(odd) {
+    background: #edf2f7;
+}
+
+.phone-number {
+    font-weight: bold;
+    font-size: 1.1rem;
+    color: #2d3748;
+}
+
+.phone-carrier {
+    margin-left: 8px;
+    padding: 2px 8px;
+    border-radius: 10px;
+    background: #e2e8f0;
+    color: #4a5568;
+    font-size: 0.8rem;
+    font-weight: normal;
+}
+
+.phone-meta {
+    display: flex;
+    justify-content: space-between;
+    margin-top: 8px;
+    color: #718096;
+    font-size: 0.9rem;
+}
+
+.empty-state {
+    text-align: center;
+    padding: 40px 20px;
+    color: #a0aec0;
+}
+
+.empty-state i {
+    font-size: 3rem;
+    margin-bottom: 15px;
+    opacity: 0.5;
+}
+
+.stats-grid {
+    display: grid;
+    grid-template-columns: repeat(auto-fit, minmax(200px, 1fr));
+    gap: 20px;
+    margin-top: 30px;
+}
+
+.stat-card {
+    background: linear-gradient(135deg, #4299e1 0%, #3182ce 100%);
+    color: white;
+    padding: 20px;
+    border-radius: 15px;
+    text-align: center;
+}
+
+.stat-value {
+    font-size: 2.5rem;
+    font-weight: bold;
+    margin: 10px 0;
+}
+
+.stat-label {
+    font-size: 0.9rem;
+    opacity: 0.9;
+}
+
+.alert {
+    padding: 15px;
+    border-radius: 10px;
+    margin-bottom: 20px;
+    display: flex;
+    align-items: center;
+    gap: 10px;
+}
+
+.alert-success {
+    background: #c6f6d5;
+    color: #22543d;
+    border-left: 4px solid #48bb78;
+}
+
+.alert-error {
+    background: #fed7d7;
+    color: #742a2a;
+    border-left: 4px solid #f56565;
+}
+
+.sites-grid {
+    display: grid;
+    grid-template-columns: repeat(auto-fill, minmax(180px, 1fr));
+    gap: 15px;
+    margin: 20px 0;
+}
+
+.site-card {
+    background: #edf2f7;
+    padding: 15px;
+    border-radius: 10px;
+    text-align: center;
+    transition: transform 0.2s;
+}
+
+.site-card:hover {
+    transform: translateY(-3px);
+}
+
+.site-icon {
+    font-size: 2rem;
+    margin-bottom: 10px;
+}
+
+.site-name {
+    font-weight: 600;
+    color: #4a5568;
+}
+'''
+
+APP_JS = r'''
+// Оновлення часу роботи
+const startedAt = parseFloat(document.body.dataset.startedAt);
+setInterval(() => {
+    document.getElementById('uptime').textContent = 
+        Math.floor((Date.now()/1000) - startedAt);
+}, 1000);
+
+// Живе оновлення списку: сервер надсилає лише зміни (/api/changes/stream),
+// а форми працюють через API без перезавантаження сторінки
+const list = document.querySelector('.phones-list');
+const pageSize = parseInt(document.body.dataset.pageSize, 10);
+const lastPage = document.body.dataset.lastPage === '1';
+
+function showMessage(text, type, icon) {
+    let alert = document.querySelector('.alert');
+    if (!alert) {
+        alert = document.createElement('div');
+        document.querySelector('.main-content').before(alert);
+    }
+    alert.className = 'alert alert-' + type;
+    alert.textContent = icon + ' ' + text;
+}
+
+function setTotal(value) {
+    let total = 0;
+    document.querySelectorAll('.total-count').forEach(el => {
+        total = typeof value === 'function' ? value(parseInt(el.textContent, 10)) : value;
+        el.textContent = total;
+    });
+    // Кнопка очищення - лише коли є що очищати (і після вставки в порожній список)
+    const clear = document.querySelector('form[action="/clear"]');
+    if (clear) clear.style.display = total > 0 ? 'inline' : 'none';
+}
+
+function element(tag, text, style) {
+    const el = document.createElement(tag);
+    if (text) el.textContent = text;
+    if (style) el.style.cssText = style;
+    return el;
+}
+
+function phoneItem(phone, key) {
+    const item = element('div');
+    item.className = 'phone-item';
+    item.dataset.id = phone.id;
+    item.dataset.key = key;
+    item.dataset.registeredAt = phone.registered_at;
+    const number = element('div', '📱 ' + phone.phone + ' ');
+    number.className = 'phone-number';
+    if (phone.carrier) {
+        const carrier = element('span', phone.carrier);
+        carrier.className = 'phone-carrier';
+        number.appendChild(carrier);
+    }
+    item.appendChild(number);
+    if (phone.name) {
+        const name = element('div', '👤 ', 'margin-top: 5px;');
+        name.appendChild(element('strong', phone.name));
+        item.appendChild(name);
+    }
+    if (phone.notes) {
+        item.appendChild(element('div', '📝 ' + phone.notes, 'margin-top: 5px; color: #4a5568;'));
+    }
+    const meta = element('div');
+    meta.className = 'phone-meta';
+    meta.appendChild(element('span', '🕒 ' + phone.timestamp));
+    const form = element('form', null, 'display: inline;');
+    form.method = 'POST';
+    form.action = '/delete/' + phone.id;
+    const button = element('button', 'Видалити', 'padding: 5px 10px; font-size: 12px;');
+    button.type = 'submit';
+    button.className = 'btn btn-delete';
+    form.appendChild(button);
+    meta.appendChild(form);
+    item.appendChild(meta);
+    return item;
+}
+
+function showEmptyState() {
+    if (list.querySelector('.phone-item, .empty-state')) return;
+    const empty = element('div');
+    empty.className = 'empty-state';
+    empty.appendChild(element('div', '📭'));
+    empty.appendChild(element('h3', 'Немає зареєстрованих номерів'));
+    empty.appendChild(element('p', 'Додайте перший номер телефону'));
+    list.appendChild(empty);
+}
+
+function applyChange(change) {
+    if (change.op === 'register') {
+        setTotal(n => n + 1);
+        // Нові номери - в кінці списку, тож видимі лише на останній сторінці
+        if (lastPage && list.querySelectorAll('.phone-item').length < pageSize) {
+            const empty = list.querySelector('.empty-state');
+            if (empty) empty.remove();
+            list.appendChild(phoneItem(change.phone, change.key));
+        }
+    } else if (change.op === 'delete') {
+        const item = list.querySelector('.phone-item[data-id="' + change.id + '"]');
+        if (item) item.remove();
+        setTotal(n => Math.max(n - 1, 0));
+        showEmptyState();
+    } else if (change.op === 'clear') {
+        list.querySelectorAll('.phone-item').forEach(el => el.remove());
+        setTotal(0);
+        showEmptyState();
+    } else if (change.op === 'expire') {
+        // Межа - пара (registered_at, ключ), як і на сервері: номери пакета
+        // мають однаковий час, і частина з них може лишитись
+        const [before, beforeKey] = change.before;
+        list.querySelectorAll('.phone-item').forEach(el => {
+            const registeredAt = parseFloat(el.dataset.registeredAt);
+            if (registeredAt < before || (registeredAt === before && el.dataset.key < beforeKey)) el.remove();
+        });
+        setTotal(n => Math.max(n - change.count, 0));
+        showEmptyState();
+    }
+}
+
+// Остання застосована зміна: з неї продовжує опитування, якщо потоку немає
+let seq = document.body.dataset.seq;
+
+// Опитування /api/changes - коли сервер відмовив у потоці або EventSource немає
+async function pollChanges() {
+    try {
+        const response = await fetch('/api/changes?since=' + seq);
+        // Пропущені зміни вже недоступні - сторінку треба завантажити заново
+        if (response.status === 410) return location.reload();
+        if (response.ok) {
+            const body = await response.json();
+            body.changes.forEach(applyChange);
+            seq = body.seq;
+            if (body.more) return pollChanges();
+        }
+    } catch (e) {
+        // Мережа недоступна - спробуємо наступного разу
+    }
+    setTimeout(pollChanges, 5000);
+}
+
+if (list && window.EventSource) {
+    const source = new EventSource('/api/changes/stream?since=' + seq);
+    source.addEventListener('change', e => {
+        applyChange(JSON.parse(e.data));
+        seq = e.lastEventId;
+    });
+    source.addEventListener('reset', () => location.reload());
+    // Розрив браузер перепідключає сам, а відмову (503) - ні
+    source.addEventListener('error', () => {
+        if (source.readyState === EventSource.CLOSED) pollChanges();
+    });
+} else if (list) {
+    pollChanges();
+}
+
+// Відмова допуску (429): показати повідомлення сервера замість звичайної помилки
+async function rejected(response) {
+    if (response.status !== 429) return false;
+    showMessage((await response.json()).message, 'error', '⏳');
+    return true;
+}
+
+const registerForm = document.querySelector('form[action="/register"]');
+registerForm.addEventListener('submit', async e => {
+    e.preventDefault();
+    // form.name - атрибут самої форми, тому поля беремо через elements
+    const fields = registerForm.elements;
+    const row = {
+        phone: fields.phone.value.trim(),
+        name: fields.name.value.trim(),
+        notes: fields.notes.value.trim()
+    };
+    const response = await fetch('/api/phones/bulk', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify([row])
+    });
+    if (await rejected(response)) return;
+    const result = response.ok ? (await response.json()).results[0] : {status: 'invalid'};
+    if (result.status === 'registered') {
+        showMessage('Номер ' + row.phone + ' успішно зареєстровано!', 'success', '✅');
+        registerForm.reset();
+    } else if (result.status === 'duplicate') {
+        showMessage('Номер ' + row.phone + ' вже зареєстрований', 'error', '⚠️');
+    } else {
+        showMessage('Помилка: невірний номер ' + row.phone, 'error', '❌');
+    }
+});
+
+// Кнопки видалення є і в рядках, доданих потоком змін
+list.addEventListener('submit', async e => {
+    const match = e.target.action.match(/\/delete\/([^/]+)$/);
+    if (!match) return;
+    e.preventDefault();
+    const response = await fetch('/api/phones/' + match[1], {method: 'DELETE'});
+    if (await rejected(response)) return;
+    if (response.ok) {
+        const deleted = (await response.json()).deleted;
+        showMessage('Номер ' + deleted.phone + ' видалено', 'success', '🗑️');
+    } else {
+        showMessage('Номер не знайдено', 'error', '❌');
+    }
+});
+
+const clearForm = document.querySelector('form[action="/clear"]');
+if (clearForm) {
+    clearForm.addEventListener('submit', async e => {
+        e.preventDefault();
+        // Відповідь - перенаправлення на головну, яке не потрібне
+        const response = await fetch('/clear', {method: 'POST', redirect: 'manual'});
+        if (await rejected(response)) return;
+        showMessage('Всі номери видалено', 'success', '🗑️');
+    });
+}
+'''
 
 HTML_TEMPLATE = '''
 <!DOCTYPE html>
@@ -55,254 +1142,10 @@ HTML_TEMPLATE = '''
     <title>📱 SMS Bot - Реєстрація номерів</title>
     <meta charset="utf-8">
     <meta name="viewport" content="width=device-width, initial-scale=1">
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-        
-        body {
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            color: #333;
-            min-height: 100vh;
-            padding: 20px;
-        }
-        
-        .container {
-            max-width: 1200px;
-            margin: 0 auto;
-            background: rgba(255, 255, 255, 0.95);
-            border-radius: 20px;
-            padding: 30px;
-            box-shadow: 0 10px 30px rgba(0, 0, 0, 0.2);
-        }
-        
-        header {
-            text-align: center;
-            margin-bottom: 40px;
-            padding-bottom: 20px;
-            border-bottom: 2px solid #eee;
-        }
-        
-        h1 {
-            color: #4a5568;
-            font-size: 2.5rem;
-            margin-bottom: 10px;
-        }
-        
-        .subtitle {
-            color: #718096;
-            font-size: 1.2rem;
-        }
-        
-        .main-content {
-            display: grid;
-            grid-template-columns: 1fr 1fr;
-            gap: 30px;
-        }
-        
-        @media (max-width: 768px) {
-            .main-content {
-                grid-template-columns: 1fr;
-            }
-        }
-        
-        .card {
-            background: white;
-            border-radius: 15px;
-            padding: 25px;
-            box-shadow: 0 5px 15px rgba(0, 0, 0, 0.1);
-        }
-        
-        .card h2 {
-            color: #4a5568;
-            margin-bottom: 20px;
-            display: flex;
-            align-items: center;
-            gap: 10px;
-        }
-        
-        .form-group {
-            margin-bottom: 20px;
-        }
-        
-        label {
-            display: block;
-            margin-bottom: 8px;
-            font-weight: 600;
-            color: #4a5568;
-        }
-        
-        input, textarea, select {
-            width: 100%;
-            padding: 12px 15px;
-            border: 2px solid #e2e8f0;
-            border-radius: 10px;
-            font-size: 16px;
-            transition: border-color 0.3s;
-        }
-        
-        input:focus, textarea:focus, select:focus {
-            outline: none;
-            border-color: #667eea;
-        }
-        
-        textarea {
-            min-height: 100px;
-            resize: vertical;
-        }
-        
-        .btn {
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            color: white;
-            border: none;
-            padding: 14px 25px;
-            border-radius: 10px;
-            font-size: 16px;
-            font-weight: 600;
-            cursor: pointer;
-            transition: transform 0.2s, box-shadow 0.2s;
-            display: inline-flex;
-            align-items: center;
-            gap: 8px;
-        }
-        
-        .btn:hover {
-            transform: translateY(-2px);
-            box-shadow: 0 5px 15px rgba(102, 126, 234, 0.4);
-        }
-        
-        .btn-delete {
-            background: linear-gradient(135deg, #f56565 0%, #c53030 100%);
-        }
-        
-        .btn-export {
-            background: linear-gradient(135deg, #48bb78 0%, #2f855a 100%);
-        }
-        
-        .phones-list {
-            max-height: 400px;
-            overflow-y: auto;
-        }
-        
-        .phone-item {
-            background: #f7fafc;
-            border-radius: 10px;
-            padding: 15px;
-            margin-bottom: 10px;
-            border-left: 4px solid #667eea;
-        }
-        
-        .phone-item:nth-child(odd) {
-            background: #edf2f7;
-        }
-        
-        .phone-number {
-            font-weight: bold;
-            font-size: 1.1rem;
-            color: #2d3748;
-        }
-        
-        .phone-meta {
-            display: flex;
-            justify-content: space-between;
-            margin-top: 8px;
-            color: #718096;
-            font-size: 0.9rem;
-        }
-        
-        .empty-state {
-            text-align: center;
-            padding: 40px 20px;
-            color: #a0aec0;
-        }
-        
-        .empty-state i {
-            font-size: 3rem;
-            margin-bottom: 15px;
-            opacity: 0.5;
-        }
-        
-        .stats-grid {
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(200px, 1fr));
-            gap: 20px;
-            margin-top: 30px;
-        }
-        
-        .stat-card {
-            background: linear-gradient(135deg, #4299e1 0%, #3182ce 100%);
-            color: white;
-            padding: 20px;
-            border-radius: 15px;
-            text-align: center;
-        }
-        
-        .stat-value {
-            font-size: 2.5rem;
-            font-weight: bold;
-            margin: 10px 0;
-        }
-        
-        .stat-label {
-            font-size: 0.9rem;
-            opacity: 0.9;
-        }
-        
-        .alert {
-            padding: 15px;
-            border-radius: 10px;
-            margin-bottom: 20px;
-            display: flex;
-            align-items: center;
-            gap: 10px;
-        }
-        
-        .alert-success {
-            background: #c6f6d5;
-            color: #22543d;
-            border-left: 4px solid #48bb78;
-        }
-        
-        .alert-error {
-            background: #fed7d7;
-            color: #742a2a;
-            border-left: 4px solid #f56565;
-        }
-        
-        .sites-grid {
-            display: grid;
-            grid-template-columns: repeat(auto-fill, minmax(180px, 1fr));
-            gap: 15px;
-            margin: 20px 0;
-        }
-        
-        .site-card {
-            background: #edf2f7;
-            padding: 15px;
-            border-radius: 10px;
-            text-align: center;
-            transition: transform 0.2s;
-        }
-        
-        .site-card:hover {
-            transform: translateY(-3px);
-        }
-        
-        .site-icon {
-            font-size: 2rem;
-            margin-bottom: 10px;
-        }
-        
-        .site-name {
-            font-weight: 600;
-            color: #4a5568;
-        }
-    </style>
+    <link rel="stylesheet" href="{{ assets['app.css'] }}">
 </head>
-<body>
+<body data-started-at="{{ stats.started_at }}" data-seq="{{ seq }}"
+      data-page-size="{{ page_size }}" data-last-page="{{ 0 if next_cursor else 1 }}">
     <div class="container">
         <header>
             <h1>📱 SMS Bot - Реєстрація номерів</h1>
@@ -366,22 +1209,22 @@ HTML_TEMPLATE = '''
                         <a href="/export" class="btn btn-export" target="_blank">
                             📥 Експорт JSON
                         </a>
-                        {% if phones %}
-                        <form method="POST" action="/clear" style="display: inline;">
+                        <form method="POST" action="/clear" style="display: {{ 'inline' if total else 'none' }};">
                             <button type="submit" class="btn btn-delete" 
                                     onclick="return confirm('Видалити всі номери?')">
                                 🗑️ Очистити
                             </button>
                         </form>
-                        {% endif %}
                     </div>
                 </div>
                 
                 <div class="phones-list">
                     {% if phones %}
                         {% for phone in phones %}
-                        <div class="phone-item">
-                            <div class="phone-number">📱 {{ phone.phone }}</div>
+                        <div class="phone-item" data-id="{{ phone.id }}" data-key="{{ phone.key }}" data-registered-at="{{ phone.registered_at }}">
+                            <div class="phone-number">📱 {{ phone.phone }}
+                                {% if phone.carrier %}<span class="phone-carrier">{{ phone.carrier }}</span>{% endif %}
+                            </div>
                             {% if phone.name %}
                             <div style="margin-top: 5px;">
                                 👤 <strong>{{ phone.name }}</strong>
@@ -394,7 +1237,7 @@ HTML_TEMPLATE = '''
                             {% endif %}
                             <div class="phone-meta">
                                 <span>🕒 {{ phone.timestamp }}</span>
-                                <form method="POST" action="/delete/{{ loop.index0 }}" 
+                                <form method="POST" action="/delete/{{ phone.id }}" 
                                       style="display: inline;">
                                     <button type="submit" class="btn btn-delete" 
                                             style="padding: 5px 10px; font-size: 12px;">
@@ -414,7 +1257,14 @@ HTML_TEMPLATE = '''
                 </div>
                 
                 <div style="margin-top: 20px; text-align: center;">
-                    <p>Всього номерів: <strong>{{ phones|length }}</strong></p>
+                    <p>Всього номерів: <strong class="total-count">{{ total }}</strong></p>
+                    {% if cursor or next_cursor %}
+                    <p style="margin-top: 10px;">
+                        {% if cursor %}<a href="/" style="color: #4299e1; text-decoration: none;">⏮ На початок</a>{% endif %}
+                        {% if cursor and next_cursor %} | {% endif %}
+                        {% if next_cursor %}<a href="/?cursor={{ next_cursor }}" style="color: #4299e1; text-decoration: none;">Далі ⏭</a>{% endif %}
+                    </p>
+                    {% endif %}
                 </div>
             </div>
         </div>
@@ -429,13 +1279,13 @@ HTML_TEMPLATE = '''
             
             <div class="stat-card">
                 <div class="stat-label">📊 Запитів</div>
-                <div class="stat-value">{{ stats.requests }}</div>
+                <div class="stat-value">{{ requests }}</div>
                 <div class="stat-label">всього</div>
             </div>
             
             <div class="stat-card">
                 <div class="stat-label">📱 Номерів</div>
-                <div class="stat-value">{{ phones|length }}</div>
+                <div class="stat-value total-count">{{ total }}</div>
                 <div class="stat-label">зареєстровано</div>
             </div>
             
@@ -456,38 +1306,136 @@ HTML_TEMPLATE = '''
         </footer>
     </div>
     
-    <script>
-        // Оновлення часу роботи
-        setInterval(() => {
-            document.getElementById('uptime').textContent = 
-                Math.floor((Date.now()/1000) - {{ stats.started_at }});
-        }, 1000);
-        
-        // Автоформатування номера телефону
-        document.getElementById('phone').addEventListener('input', function(e) {
-            let value = e.target.value.replace(/\D/g, '');
-            if (value.length > 0) {
-                if (!value.startsWith('380')) {
-                    value = '380' + value;
-                }
-                e.target.value = '+' + value;
-            }
-        });
-    </script>
+    <script src="{{ assets['app.js'] }}"></script>
 </body>
 </html>
 '''
 
+# Шаблон компілюється один раз при старті, а не на кожен запит
+HOME_TEMPLATE = app.jinja_env.from_string(HTML_TEMPLATE)
+
+def build_asset(name, content, mimetype):
+    """Підготувати статичний файл: ім'я з відбитком і стиснуті варіанти"""
+    data = content.encode('utf-8')
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    stem, ext = name.rsplit('.', 1)
+    variants = {'gzip': gzip.compress(data, 9, mtime=0)}
+    if brotli is not None:
+        variants['br'] = brotli.compress(data)
+    return f"{stem}.{digest}.{ext}", {'mimetype': mimetype, 'etag': digest, 'data': data, 'variants': variants}
+
+# Ім'я з відбитком -> файл; логічне ім'я -> URL для шаблону
+STATIC_ASSETS = {}
+ASSET_URLS = {}
+for asset_name, asset_content, asset_mimetype in (('app.css', APP_CSS, 'text/css'),
+                                                  ('app.js', APP_JS, 'application/javascript')):
+    fingerprinted, asset = build_asset(asset_name, asset_content, asset_mimetype)
+    STATIC_ASSETS[fingerprinted] = asset
+    ASSET_URLS[asset_name] = f"/assets/{fingerprinted}"
+
+def route_label():
+    """Шаблон маршруту (без ID і параметрів) - мітка метрик"""
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_started = metrics.start(route_label())
+
+@app.after_request
+def finish_request_metrics(response):
+    # Потокові відповіді (/export, /api/phones) міряються до початку передачі тіла
+    started = g.pop('metrics_started', None)
+    if started is not None:
+        metrics.finish(route_label(), request.method, response.status_code, started)
+    return response
+
+def client_address():
+    """Адреса клієнта: з X-Forwarded-For, якщо перед застосунком TRUSTED_PROXIES проксі"""
+    if TRUSTED_PROXIES:
+        # Ліві адреси підставляє сам клієнт - довіряємо лише дописаній нашим проксі
+        forwarded = request.headers.get('X-Forwarded-For', '').split(',')
+        if len(forwarded) >= TRUSTED_PROXIES:
+            return forwarded[-TRUSTED_PROXIES].strip()
+    return request.remote_addr
+
+def too_many_requests(seconds, message):
+    """Відповідь 429 з Retry-After"""
+    response = jsonify({"status": "error", "message": message})
+    response.status_code = 429
+    response.headers['Retry-After'] = retry_after(seconds)
+    return response
+
+@app.before_request
+def admit_request():
+    """Допуск запитів на запис: швидка відмова замість черги без меж"""
+    if request.method in SAFE_METHODS:
+        return None
+    if client_limiter is not None:
+        cost = min(ADMISSION_BURST, 1 + (request.content_length or 0) // ADMISSION_BYTES_PER_TOKEN)
+        wait = client_limiter.acquire(client_address(), cost)
+        if wait:
+            return too_many_requests(wait, f"Забагато запитів, спробуйте через {retry_after(wait)} с")
+    if write_gate is not None:
+        if not write_gate.acquire():
+            return too_many_requests(1, "Сервер зайнятий, спробуйте пізніше")
+        g.admitted = True
+    return None
+
+@app.teardown_request
+def release_request(exc):
+    if g.pop('admitted', False):
+        write_gate.release()
+
+@app.before_request
+def sync_before_request():
+    # /health відповідає одразу: перевірка Railway не чекає на зміни інших воркерів
+    if request.endpoint != 'health':
+        sync_storage()
+
 @app.route('/')
 def home():
-    stats["requests"] += 1
-    return render_template_string(HTML_TEMPLATE, 
-                                 phones=phones_database,
-                                 sites=SITES,
-                                 stats=stats,
-                                 message=request.args.get('message'),
-                                 message_type=request.args.get('type', 'success'),
-                                 message_icon=request.args.get('icon', '✅'))
+    view = snapshot
+    cursor = request.args.get('cursor')
+    try:
+        phones, next_cursor = page_phones(view, cursor, HOME_PAGE_SIZE)
+    except ValueError:
+        cursor = None
+        phones, next_cursor = page_phones(view, None, HOME_PAGE_SIZE)
+    with metrics.phase('render'):
+        return HOME_TEMPLATE.render(phones=phones,
+                                    total=view.total,
+                                    seq=view.seq,
+                                    page_size=HOME_PAGE_SIZE,
+                                    cursor=cursor,
+                                    next_cursor=next_cursor,
+                                    sites=SITES,
+                                    stats=stats,
+                                    requests=metrics.total_requests(),
+                                    assets=ASSET_URLS,
+                                    message=request.args.get('message'),
+                                    message_type=request.args.get('type', 'success'),
+                                    message_icon=request.args.get('icon', '✅'))
+
+@app.route('/assets/<name>')
+def static_asset(name):
+    """Статичні файли з відбитком у імені: кешуються браузером назавжди"""
+    asset = STATIC_ASSETS.get(name)
+    if asset is None:
+        return jsonify({"status": "error", "message": "Файл не знайдено"}), 404
+    body = asset['data']
+    encoding = None
+    for candidate in ('br', 'gzip'):
+        if candidate in asset['variants'] and candidate in request.accept_encodings:
+            body = asset['variants'][candidate]
+            encoding = candidate
+            break
+    response = Response(body, mimetype=asset['mimetype'])
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    response.set_etag(asset['etag'])
+    return response.make_conditional(request)
 
 @app.route('/register', methods=['POST'])
 def register_phone():
@@ -502,41 +1450,66 @@ def register_phone():
                                type='error',
                                icon='❌'))
     
-    # Перевірка, чи номер вже існує
-    for existing in phones_database:
-        if existing['phone'] == phone:
-            return redirect(url_for('home',
-                                   message=f'Номер {phone} вже зареєстрований',
-                                   type='error',
-                                   icon='⚠️'))
+    with metrics.phase('normalize'):
+        number = normalize(phone)
+    if number is None:
+        return redirect(url_for('home',
+                               message=f'Помилка: невірний номер {phone}',
+                               type='error',
+                               icon='❌'))
+    key = number.key
+    with metrics.phase('dedup'):
+        # Перевірка, чи номер вже існує
+        duplicate = key in phones_index
+    
+    if duplicate:
+        return redirect(url_for('home',
+                               message=f'Номер {phone} вже зареєстрований',
+                               type='error',
+                               icon='⚠️'))
     
     # Додати новий номер
+    registered_at = time.time()
     new_phone = {
-        'phone': phone,
+        'id': make_record_id(key, registered_at),
+        'phone': key,
         'name': name if name else None,
         'notes': notes if notes else None,
-        'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
-        'registered_at': time.time()
+        'carrier': number.carrier,
+        'timestamp': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(registered_at)),
+        'registered_at': registered_at
     }
     
-    phones_database.append(new_phone)
-    stats["phones_registered"] = len(phones_database)
-    save_phones()
+    if not commit({'op': 'register', 'key': key, 'record': new_phone}):
+        # Номер щойно зареєстрував інший воркер
+        return redirect(url_for('home',
+                               message=f'Номер {phone} вже зареєстрований',
+                               type='error',
+                               icon='⚠️'))
     
     return redirect(url_for('home',
-                           message=f'Номер {phone} успішно зареєстровано!',
+                           message=f'Номер {key} успішно зареєстровано!',
                            type='success',
                            icon='✅'))
 
-@app.route('/delete/<int:index>', methods=['POST'])
-def delete_phone(index):
-    """Видалити номер за індексом"""
-    if 0 <= index < len(phones_database):
-        deleted_phone = phones_database.pop(index)
-        stats["phones_registered"] = len(phones_database)
-        save_phones()
+def delete_record(record_id):
+    """Видалити номер за ID, повертає видалений запис або None"""
+    with write_lock:
+        record = phones_by_id.get(record_id)
+        if record is None:
+            return None
+        if not commit({'op': 'delete', 'phone': record.key, 'id': record_id}):
+            # Номер щойно видалив інший воркер
+            return None
+    return record
+
+@app.route('/delete/<record_id>', methods=['POST'])
+def delete_phone(record_id):
+    """Видалити номер за ID"""
+    deleted_phone = delete_record(record_id)
+    if deleted_phone is not None:
         return redirect(url_for('home',
-                               message=f'Номер {deleted_phone["phone"]} видалено',
+                               message=f'Номер {deleted_phone.phone} видалено',
                                type='success',
                                icon='🗑️'))
     return redirect(url_for('home',
@@ -544,31 +1517,563 @@ def delete_phone(index):
                            type='error',
                            icon='❌'))
 
+@app.route('/api/phones/search')
+def search_phones():
+    """Пошук номерів: ?q=цифри (префікс/суфікс) або слова з імені та приміток"""
+    query = request.args.get('q', '').strip()
+    mode = request.args.get('mode')
+    limit = min(max(request.args.get('limit', API_PAGE_SIZE, type=int), 1), API_PAGE_MAX)
+    if not query:
+        return jsonify({"status": "error", "message": "Порожній запит"}), 400
+    if mode is None:
+        mode = 'prefix' if PHONE_QUERY.match(query) else 'text'
+    if mode in ('prefix', 'suffix'):
+        digits = NON_DIGITS.sub('', query)
+        if not digits:
+            return jsonify({"status": "error", "message": "Запит не містить цифр"}), 400
+        # Національний формат 0XX... -> міжнародний 380XX...
+        if mode == 'prefix' and digits.startswith('0'):
+            digits = '38' + digits
+    elif mode != 'text':
+        return jsonify({"status": "error", "message": f"Невідомий режим пошуку: {mode}"}), 400
+
+    # Пошуковий індекс змінюється на місці, тож пошук (до 1 мс) іде під блокуванням записників
+    with write_lock, metrics.phase('search'):
+        ensure_search_index()
+        if mode == 'prefix':
+            keys = search_index.search_prefix(digits, limit)
+        elif mode == 'suffix':
+            keys = search_index.search_suffix(digits, limit)
+        else:
+            keys = search_index.search_text(query, limit)
+        records = [phones_index[key] for key in keys if key in phones_index]
+
+    return jsonify({
+        "query": query,
+        "mode": mode,
+        "phones": [record.to_dict() for record in records]
+    })
+
+@app.route('/api/phones/<record_id>', methods=['DELETE'])
+def api_delete_phone(record_id):
+    """API для видалення номера за ID"""
+    deleted_phone = delete_record(record_id)
+    if deleted_phone is None:
+        return jsonify({"status": "error", "message": "Номер не знайдено"}), 404
+    return jsonify({"status": "success", "deleted": deleted_phone.to_dict()})
+
 @app.route('/clear', methods=['POST'])
 def clear_all():
     """Очистити всі номери"""
-    phones_database.clear()
-    stats["phones_registered"] = 0
-    save_phones()
+    commit({'op': 'clear'})
     return redirect(url_for('home',
                            message='Всі номери видалено',
                            type='success',
                            icon='🗑️'))
 
-@app.route('/export')
-def export_phones():
-    """Експорт номерів у форматі JSON"""
+def json_response(data):
+    """JSON-відповідь з великим тілом: через orjson, якщо він встановлений"""
+    if orjson is None:
+        return jsonify(data)
+    return Response(orjson.dumps(data), mimetype='application/json')
+
+def parse_bulk_rows():
+    """Розібрати тіло масового імпорту: JSON-масив, NDJSON або CSV"""
+    content_type = request.mimetype
+    fmt = request.args.get('format')
+    text = request.get_data(as_text=True)
+    if fmt == 'csv' or content_type in ('text/csv', 'application/csv'):
+        rows = list(csv.reader(io.StringIO(text)))
+        # Рядок заголовка (phone,name,notes) пропускаємо. Заголовок - перша клітинка
+        # без жодної цифри: невірний номер першим рядком рахується як невірний
+        if rows and rows[0] and not any(c.isdigit() for c in rows[0][0]):
+            rows = rows[1:]
+        return rows
+    if fmt == 'ndjson' or content_type in ('application/x-ndjson', 'application/ndjson'):
+        return [load_json(line) for line in text.splitlines() if line.strip()]
+    rows = load_json(text)
+    if not isinstance(rows, list):
+        raise ValueError("очікується масив номерів")
+    return rows
+
+@app.route('/api/phones/bulk', methods=['POST'])
+def bulk_register():
+    """Масова реєстрація номерів одним записом у сховище"""
+    try:
+        with metrics.phase('parse'):
+            rows = parse_bulk_rows()
+    except (ValueError, csv.Error) as e:
+        return jsonify({"status": "error", "message": f"Невірний формат даних: {e}"}), 400
+    if len(rows) > BULK_MAX_ROWS:
+        return jsonify({"status": "error", "message": f"Забагато рядків: максимум {BULK_MAX_ROWS}"}), 413
+
+    now = time.time()
+    timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now))
+    record_id = record_ids_at(now)
+    fields = []
+    # Рядки, де ім'я або примітки - не текст (об'єкт, масив, число)
+    bad_text = set()
+    for row_no, row in enumerate(rows):
+        # Рядок може бути номером, об'єктом {phone, name, notes} або рядком CSV
+        if isinstance(row, dict):
+            phone, name, notes = row.get('phone'), row.get('name'), row.get('notes')
+        elif isinstance(row, list):
+            phone, name, notes = (row + [None, None, None])[:3]
+        else:
+            phone, name, notes = row, None, None
+        if not isinstance(name, TEXT_TYPES) or not isinstance(notes, TEXT_TYPES):
+            bad_text.add(row_no)
+        fields.append((str(phone) if phone is not None else '', name, notes))
+    with metrics.phase('normalize'):
+        numbers = normalize_many([phone for phone, _, _ in fields])
+
+    results = []
+    ops = []
+    seen = set()
+    invalid = 0
+    dedup_started = time.perf_counter()
+    for row_no, ((phone, name, notes), number) in enumerate(zip(fields, numbers)):
+        if number is None or row_no in bad_text:
+            results.append({"row": row_no, "phone": phone.strip(), "status": "invalid"})
+            invalid += 1
+            continue
+        key = number.key
+        if key in seen or key in phones_index:
+            results.append({"row": row_no, "phone": phone.strip(), "key": key, "status": "duplicate"})
+            continue
+        seen.add(key)
+        new_id = record_id(key)
+        ops.append({'op': 'register', 'key': key, 'record': {
+            'id': new_id,
+            'phone': key,
+            'name': (name.strip() or None) if name else None,
+            'notes': (notes.strip() or None) if notes else None,
+            'carrier': number.carrier,
+            'timestamp': timestamp,
+            'registered_at': now
+        }})
+        results.append({"row": row_no, "phone": phone.strip(), "key": key, "carrier": number.carrier,
+                        "id": new_id, "status": "registered"})
+    metrics.observe_phase('dedup', time.perf_counter() - dedup_started)
+
+    # Номери одного пакета мають однаковий registered_at, тож впорядковуємо їх за ключем
+    ops.sort(key=itemgetter('key'))
+    accepted = commit(*ops) if ops else []
+    # Номери, які між перевіркою і записом зареєстрував інший воркер
+    if len(accepted) != len(ops):
+        accepted_keys = {op['key'] for op in accepted}
+        for result in results:
+            if result["status"] == "registered" and result["key"] not in accepted_keys:
+                result["status"] = "duplicate"
+                del result["id"], result["carrier"]
+
+    return json_response({
+        "status": "success",
+        "registered": len(accepted),
+        "duplicates": len(results) - len(accepted) - invalid,
+        "invalid": invalid,
+        "results": results
+    })
+
+@app.route('/api/phones/normalize', methods=['POST'])
+def normalize_phones():
+    """Нормалізувати номери без реєстрації: JSON-масив рядків"""
+    rows = request.get_json(silent=True)
+    if not isinstance(rows, list) or not all(isinstance(row, str) for row in rows):
+        return jsonify({"status": "error", "message": "Очікується JSON-масив номерів"}), 400
+    if len(rows) > BULK_MAX_ROWS:
+        return jsonify({"status": "error", "message": f"Забагато рядків: максимум {BULK_MAX_ROWS}"}), 413
+    with metrics.phase('normalize'):
+        numbers = normalize_many(rows)
     return jsonify({
         "status": "success",
-        "count": len(phones_database),
-        "phones": phones_database,
-        "exported_at": time.strftime('%Y-%m-%d %H:%M:%S')
+        "results": [
+            {"input": row, "valid": False} if number is None else
+            {"input": row, "valid": True, "phone": number.key, "country": number.country, "carrier": number.carrier}
+            for row, number in zip(rows, numbers)
+        ]
     })
 
+@app.route('/api/stats')
+def registration_stats():
+    """Реєстрації живих номерів за часом: ?resolution=minute|hour|day&last=N&carrier=..."""
+    resolution = request.args.get('resolution', 'hour')
+    if resolution not in RESOLUTIONS:
+        return jsonify({"status": "error", "message": f"Невідома роздільність: {resolution}"}), 400
+    last = request.args.get('last', STATS_DEFAULT_LAST[resolution], type=int)
+    if last < 1:
+        return jsonify({"status": "error", "message": "last має бути додатним"}), 400
+    carrier = request.args.get('carrier') or None
+    # Кільця змінюються на місці, тож запит (кілька сотень кошиків) іде під блокуванням записників
+    with write_lock, metrics.phase('stats'):
+        ensure_registrations()
+        result = registrations.query(resolution, last, carrier)
+    return jsonify(dict(result, status="success"))
+
+def encode_cursor(record):
+    """Непрозорий курсор, що вказує на запис"""
+    raw = f"{record.registered_at!r}|{record.key}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Розібрати курсор у ключ порядку; ValueError - невірний курсор"""
+    raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+    registered_at, key = raw.split('|', 1)
+    return float(registered_at), key
+
+def page_phones(view, cursor, limit):
+    """Сторінка номерів знімка після курсора: (записи, наступний курсор)"""
+    records, count = view.records, view.count
+    pos = bisect.bisect_right(records, decode_cursor(cursor), hi=count, key=record_sort_key) if cursor else 0
+    page = []
+    while pos < count and len(page) < limit:
+        if view.is_live(records[pos]):
+            page.append(records[pos])
+        pos += 1
+    # Наступна сторінка є, якщо далі лишився хоч один живий запис
+    while pos < count and not view.is_live(records[pos]):
+        pos += 1
+    next_cursor = encode_cursor(page[-1]) if page and pos < count else None
+    return page, next_cursor
+
+# Поля записів у CSV-експорті
+EXPORT_FIELDS = ('phone', 'name', 'notes', 'timestamp', 'registered_at', 'carrier')
+EXPORT_MIMETYPES = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+# Скільки записів кодується за один крок потоку
+STREAM_CHUNK = 1000
+
+def iter_chunks(records):
+    """Розбити записи на шматки по STREAM_CHUNK"""
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= STREAM_CHUNK:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def stream_phones(fmt, records, prefix='[', suffix=']'):
+    """Генератор тіла відповіді зі списком номерів"""
+    if fmt == 'ndjson':
+        for chunk in iter_chunks(records):
+            yield ''.join(encode_record(r.to_dict()) + '\n' for r in chunk)
+    elif fmt == 'csv':
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(EXPORT_FIELDS)
+        for chunk in iter_chunks(records):
+            writer.writerows([getattr(r, field) for field in EXPORT_FIELDS] for r in chunk)
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+        yield buf.getvalue()
+    else:
+        yield prefix
+        separator = ''
+        for chunk in iter_chunks(records):
+            yield separator + ','.join(encode_record(r.to_dict()) for r in chunk)
+            separator = ','
+        yield suffix
+
+def gzip_stream(chunks):
+    """Стиснути потік gzip на льоту"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+def cache_body(key, seq, chunks):
+    """Передавати тіло далі і зберегти його в кеші версії seq, якщо воно не завелике"""
+    parts = []
+    size = 0
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        if parts is not None:
+            size += len(chunk)
+            if size <= BODY_CACHE_MAX_BYTES:
+                parts.append(chunk)
+            else:
+                parts = None
+        yield chunk
+    # Тіло передано повністю (обірвані з'єднання сюди не доходять)
+    if parts is None:
+        return
+    for other_key, (other_seq, _) in list(body_cache.items()):
+        if other_seq < seq:
+            # Тіла старших версій більше не знадобляться
+            body_cache.pop(other_key, None)
+    cached = body_cache.get(key)
+    if cached is not None and cached[0] >= seq:
+        return
+    if sum(len(body) for _, body in body_cache.values()) + size <= BODY_CACHE_MAX_BYTES:
+        body_cache[key] = (seq, b''.join(parts))
+
+def phones_response(view, records, default_format='json', prefix='[', suffix=']', cache=False, headers=None):
+    """Відповідь зі списком номерів знімка у форматі ?format=json|ndjson|csv
+
+    ETag - версія знімка (номер операції сховища) і представлення; на
+    If-None-Match з тією ж версією відповідь 304 без серіалізації.
+    If-Modified-Since не враховується: Last-Modified має точність до секунди,
+    і дві зміни за одну секунду він не розрізняє. З
+    cache=True готове тіло повного списку кешується до наступної зміни бази.
+    """
+    fmt = request.args.get('format', default_format)
+    if fmt not in EXPORT_MIMETYPES:
+        return jsonify({"status": "error", "message": f"Невідомий формат: {fmt}"}), 400
+    # gzip вмикається заголовком Accept-Encoding, ?gzip=0 його вимикає
+    use_gzip = 'gzip' in request.accept_encodings and request.args.get('gzip') != '0'
+    etag = f"v{view.seq}-{fmt}{'-gzip' if use_gzip else ''}"
+    modified_at = datetime.fromtimestamp(view.modified_at, timezone.utc)
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=None):
+        response = Response(status=304)
+    else:
+        key = (request.path, fmt, use_gzip)
+        cached = body_cache.get(key) if cache else None
+        if cached is not None and cached[0] == view.seq:
+            response = Response(cached[1], mimetype=EXPORT_MIMETYPES[fmt])
+        else:
+            body = stream_phones(fmt, records, prefix, suffix)
+            if use_gzip:
+                body = gzip_stream(body)
+            if cache:
+                body = cache_body(key, view.seq, body)
+            response = Response(body, mimetype=EXPORT_MIMETYPES[fmt])
+        if use_gzip:
+            response.headers['Content-Encoding'] = 'gzip'
+    response.set_etag(etag)
+    response.last_modified = modified_at
+    response.headers['Vary'] = 'Accept-Encoding'
+    # Клієнт може зберігати відповідь, але щоразу перевіряє її за ETag
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers.update(headers or {})
+    return response
+
+@app.route('/export')
+def export_phones():
+    """Експорт номерів (JSON, NDJSON або CSV) потоком"""
+    view = snapshot
+    exported_at = time.strftime('%Y-%m-%d %H:%M:%S')
+    return phones_response(
+        view, view,
+        prefix=f'{{"count":{view.total},"exported_at":"{exported_at}","phones":[',
+        suffix='],"status":"success"}',
+        cache=True)
+
 @app.route('/api/phones')
 def api_phones():
-    """API для отримання списку номерів"""
-    return jsonify(phones_database)
+    """API для отримання списку номерів (?limit=&cursor= - посторінково)"""
+    view = snapshot
+    limit = request.args.get('limit', type=int)
+    cursor = request.args.get('cursor')
+    if limit is None and cursor is None:
+        return phones_response(view, view, cache=True)
+
+    limit = min(max(limit or API_PAGE_SIZE, 1), API_PAGE_MAX)
+    try:
+        page, next_cursor = page_phones(view, cursor, limit)
+    except ValueError:
+        return jsonify({"status": "error", "message": "Невірний курсор"}), 400
+    return phones_response(
+        view, page,
+        prefix=f'{{"count":{view.total},"next_cursor":{json.dumps(next_cursor)},"phones":[',
+        suffix=']}',
+        headers={'X-Next-Cursor': next_cursor} if next_cursor else None)
+
+@app.route('/api/archive')
+def archived_phones():
+    """Номери, перенесені в архів: ?phone=, ?since=&until= (unix-час), ?limit=&cursor= - посторінково"""
+    phone = request.args.get('phone', '').strip()
+    since = request.args.get('since', type=float)
+    until = request.args.get('until', type=float)
+    limit = min(max(request.args.get('limit', API_PAGE_SIZE, type=int), 1), API_PAGE_MAX)
+    key = None
+    if phone:
+        number = normalize(phone)
+        key = number.key if number is not None else normalize_phone(phone)
+    try:
+        # Пошук номера обходить увесь архів; запит за часом - лише пакети свого проміжку
+        with metrics.phase('archive_read'):
+            records, next_cursor = archive.query(key, since, until, request.args.get('cursor'), limit)
+    except ValueError:
+        return jsonify({"status": "error", "message": "Невірний курсор"}), 400
+    return jsonify({
+        "status": "success",
+        "count": archive.count(),
+        "next_cursor": next_cursor,
+        "phones": records
+    })
+
+@app.route('/api/changes')
+def api_changes():
+    """Зміни бази після ?since=N (seq з попередньої відповіді або data-seq сторінки)"""
+    since = request.args.get('since', type=int)
+    if since is None:
+        return jsonify({"status": "error", "message": "Потрібен параметр since"}), 400
+    limit = min(max(request.args.get('limit', API_PAGE_MAX, type=int), 1), API_PAGE_MAX)
+    # Знімок читається першим: усі зміни до його seq уже є в журналі
+    view, entries = read_changes(since)
+    if entries is None:
+        return jsonify({"status": "error",
+                        "message": "Зміни вже недоступні, завантажте список заново",
+                        "seq": view.seq}), 410
+    more = len(entries) > limit
+    entries = entries[:limit]
+    # Наступний since: остання віддана зміна, а якщо віддано все - версія знімка
+    if more:
+        seq = entries[-1][0]
+    else:
+        seq = max(view.seq, entries[-1][0]) if entries else view.seq
+    body = f'{{"changes":[{",".join(map(change_data, entries))}],"more":{json.dumps(more)},"seq":{seq}}}'
+    return Response(body, mimetype='application/json')
+
+@app.route('/api/changes/stream')
+def stream_changes():
+    """Потік змін (Server-Sent Events) після ?since=N або Last-Event-ID"""
+    since = request.headers.get('Last-Event-ID', request.args.get('since'))
+    try:
+        since = int(since) if since is not None else snapshot.seq
+    except ValueError:
+        return jsonify({"status": "error", "message": "Невірний since"}), 400
+    # Потік тримає потік воркера до SSE_MAX_SECONDS - понад ліміт краще
+    # відмовити, ніж лишити /health і решту запитів без вільних потоків
+    if stream_gate is not None and not stream_gate.acquire():
+        response = jsonify({"status": "error", "message": "Забагато потоків змін, використовуйте /api/changes"})
+        response.status_code = 503
+        response.headers['Retry-After'] = retry_after(SSE_RETRY_SECONDS)
+        return response
+
+    def events(since):
+        deadline = time.monotonic() + SSE_MAX_SECONDS
+        heartbeat = time.monotonic() + SSE_HEARTBEAT_SECONDS
+        yield 'retry: 1000\n\n'
+        while time.monotonic() < deadline:
+            # Зміни інших воркерів потрапляють сюди лише через сховище
+            sync_storage()
+            view, entries = read_changes(since)
+            if entries is None:
+                yield f'event: reset\ndata: {{"seq":{view.seq}}}\n\n'
+                return
+            if entries:
+                yield ''.join(f'id: {entry[0]}\nevent: change\ndata: {change_data(entry)}\n\n' for entry in entries)
+                since = entries[-1][0]
+                heartbeat = time.monotonic() + SSE_HEARTBEAT_SECONDS
+            elif time.monotonic() >= heartbeat:
+                yield ': ping\n\n'
+                heartbeat = time.monotonic() + SSE_HEARTBEAT_SECONDS
+            with changes_cond:
+                if snapshot is view:
+                    changes_cond.wait(timeout=1)
+
+    response = Response(events(since), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Проксі (nginx) не повинні буферизувати потік
+    response.headers['X-Accel-Buffering'] = 'no'
+    if stream_gate is not None:
+        # Викликається і тоді, коли клієнт відключився посеред потоку
+        response.call_on_close(stream_gate.release)
+    return response
+
+@app.route('/api/phones/<record_id>/checks')
+def phone_checks(record_id):
+    """Результати перевірки номера на сайтах (None - ще не перевірено)"""
+    if monitor is None:
+        return jsonify({"status": "error", "message": "Моніторинг вимкнено"}), 404
+    record = phones_by_id.get(record_id)
+    if record is None:
+        return jsonify({"status": "error", "message": "Номер не знайдено"}), 404
+    checks = monitor.store.for_key(record.key)
+    return jsonify({
+        "status": "success",
+        "phone": record.to_dict(),
+        "checks": {name: checks.get(name) for name in monitor.sites}
+    })
+
+@app.route('/api/monitor')
+def monitor_status():
+    """Стан моніторингу: результати за сайтами і планувальник цього воркера"""
+    if monitor is None:
+        return jsonify({"status": "error", "message": "Моніторинг вимкнено"}), 404
+    return jsonify({
+        "status": "success",
+        "results": monitor.store.summary(),
+        "scheduler": monitor.status()
+    })
+
+@app.route('/api/dispatch', methods=['POST'])
+def create_dispatch():
+    """Поставити SMS у чергу розсилки: усім номерам або ?ids
+
+    Тіло JSON: {"text": ..., "priority": "high|normal|bulk", "campaign": ..., "ids": [...]}.
+    Ключ ідемпотентності кожного повідомлення - "<кампанія>:<номер>", тож
+    повтор запиту з тією самою кампанією (або заголовком Idempotency-Key)
+    не поставить повідомлення вдруге.
+    """
+    if dispatcher is None:
+        return jsonify({"status": "error", "message": "Розсилку вимкнено"}), 404
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"status": "error", "message": "Очікується JSON-об'єкт"}), 400
+    text = str(data.get('text') or '').strip()
+    if not text:
+        return jsonify({"status": "error", "message": "Порожній текст повідомлення"}), 400
+    if len(text) > DISPATCH_TEXT_MAX:
+        return jsonify({"status": "error",
+                        "message": f"Текст довший за {DISPATCH_TEXT_MAX} символів"}), 400
+    priority = data.get('priority', 'normal')
+    if priority not in PRIORITIES:
+        return jsonify({"status": "error", "message": f"Невідомий пріоритет: {priority}"}), 400
+    campaign = str(data.get('campaign') or request.headers.get('Idempotency-Key') or os.urandom(8).hex())
+
+    ids = data.get('ids')
+    missing = []
+    if ids is None:
+        records = snapshot
+    elif isinstance(ids, list):
+        records = [phones_by_id[record_id] for record_id in ids if record_id in phones_by_id]
+        missing = [record_id for record_id in ids if record_id not in phones_by_id]
+    else:
+        return jsonify({"status": "error", "message": "ids має бути списком"}), 400
+
+    queued, duplicates = dispatcher.queue.enqueue(
+        ((f"{campaign}:{record.key}", record.key, text) for record in records), priority)
+    return jsonify({
+        "status": "success",
+        "campaign": campaign,
+        "queued": queued,
+        "duplicates": duplicates,
+        "missing": missing
+    }), 202
+
+@app.route('/api/dispatch')
+def dispatch_status():
+    """Стан розсилки: глибина черги за смугами, повідомлення за статусами, шлюзи"""
+    if dispatcher is None:
+        return jsonify({"status": "error", "message": "Розсилку вимкнено"}), 404
+    return jsonify({
+        "status": "success",
+        "depth": dispatcher.queue.depth(),
+        "messages": dispatcher.queue.counts(),
+        "dispatcher": dispatcher.status()
+    })
+
+@app.route('/api/dispatch/<path:key>')
+def dispatch_message(key):
+    """Стан повідомлення за ключем ідемпотентності"""
+    if dispatcher is None:
+        return jsonify({"status": "error", "message": "Розсилку вимкнено"}), 404
+    message = dispatcher.queue.get(key)
+    if message is None:
+        return jsonify({"status": "error", "message": "Повідомлення не знайдено"}), 404
+    return jsonify({"status": "success", "message": message})
 
 @app.route('/health')
 def health():
@@ -576,11 +2081,35 @@ def health():
         "status": "healthy",
         "service": "SMS Bot - Phone Registry",
         "uptime": int(time.time() - stats["started_at"]),
-        "requests": stats["requests"],
+        "requests": metrics.total_requests(),
         "phones_registered": stats["phones_registered"],
+        "storage": storage.name,
+        "write_behind": WRITE_BEHIND,
+        "journal_backlog": storage.backlog(),
+        "monitor": "off" if monitor is None else "active" if monitor.running else "standby",
+        "dispatch_queue": None if dispatcher is None else sum(dispatcher.queue.depth().values()),
+        "expiry": "off" if expirer is None else "active" if expirer.running else "standby",
         "timestamp": time.strftime('%Y-%m-%d %H:%M:%S')
     })
 
+@app.route('/metrics')
+def prometheus_metrics():
+    """Метрики всіх воркерів у текстовому форматі Prometheus"""
+    gauges = {
+        'phones_registered': ("Зареєстровані номери", len(phones_by_id)),
+        'journal_backlog': ("Операції, ще не записані на диск", storage.backlog()),
+    }
+    gauges['archived_phones'] = ("Номери в архіві", archive.count())
+    if write_gate is not None:
+        gauges['admission_active'] = ("Записи, що виконуються", write_gate.active)
+        gauges['admission_waiting'] = ("Записи в черзі допуску", write_gate.waiting)
+    if stream_gate is not None:
+        gauges['sse_streams'] = ("Відкриті потоки змін", stream_gate.active)
+    if dispatcher is not None:
+        gauges['dispatch_queue_depth'] = ("SMS у черзі розсилки", sum(dispatcher.queue.depth().values()))
+    body = metrics.render(gauges)
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
     port = int(os.getenv("PORT", 8000))
     print(f"🚀 Запуск SMS Bot Phone Registry на порті {port}")
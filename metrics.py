@@ -0,0 +1,262 @@
+"""
+SMS Bot - Метрики запитів у текстовому форматі Prometheus
+
+Кожен воркер рахує метрики в пам'яті: кількість запитів за маршрутом,
+методом і статусом, гістограми затримки маршрутів і внутрішніх фаз
+(перевірка дублікатів, запис у сховище, рендер шаблону...) та кількість
+запитів у роботі. Якщо задано теку, воркер раз на flush_interval секунд
+записує свій стан у файл worker-<pid>-<час старту>.json, а /metrics
+будь-якого воркера сумує файли всіх. Файли завершених воркерів і ті, що
+не оновлювались довше за expire секунд, видаляються.
+"""
+
+import os
+import json
+import time
+import glob
+import atexit
+import bisect
+import threading
+from contextlib import contextmanager
+
+# Межі кошиків гістограм, секунди
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def new_histogram():
+    # Лічильники кошиків (останній - +Inf), сума і кількість спостережень
+    return {'buckets': [0] * (len(BUCKETS) + 1), 'sum': 0.0, 'count': 0}
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Metrics:
+    """Метрики одного процесу з агрегацією між воркерами через файли"""
+
+    def __init__(self, directory=None, prefix="sms_bot", flush_interval=1.0, expire=30.0):
+        self.directory = directory
+        self.prefix = prefix
+        self.flush_interval = flush_interval
+        self.expire = expire
+        self._lock = threading.Lock()
+        # (маршрут, метод, статус) -> кількість
+        self.requests = {}
+        # маршрут -> гістограма затримки; фаза -> гістограма тривалості
+        self.latency = {}
+        self.phases = {}
+        # маршрут -> запитів у роботі
+        self.in_flight = {}
+        self._dirty = False
+        self._flusher_pid = None
+        # Час старту воркера в імені файлу: PID, повторно виданий новому
+        # процесу, не перезапише файл завершеного
+        self._started = None
+        self._flushed_at = 0.0
+        self._others = None
+        self._others_at = 0.0
+
+    def start(self, route):
+        """Запит почався: повертає мітку часу для finish"""
+        if self.directory and self._flusher_pid != os.getpid():
+            self._start_flusher()
+        with self._lock:
+            self.in_flight[route] = self.in_flight.get(route, 0) + 1
+        return time.perf_counter()
+
+    def finish(self, route, method, status, started):
+        """Запит завершився зі статусом status"""
+        elapsed = time.perf_counter() - started
+        key = (route, method, status)
+        with self._lock:
+            self.in_flight[route] -= 1
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self._observe(self.latency, route, elapsed)
+            self._dirty = True
+
+    def observe_phase(self, name, seconds):
+        with self._lock:
+            self._observe(self.phases, name, seconds)
+            self._dirty = True
+
+    @contextmanager
+    def phase(self, name):
+        """Виміряти тривалість внутрішньої фази обробки"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_phase(name, time.perf_counter() - started)
+
+    def _observe(self, histograms, name, seconds):
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = new_histogram()
+        histogram['buckets'][bisect.bisect_left(BUCKETS, seconds)] += 1
+        histogram['sum'] += seconds
+        histogram['count'] += 1
+
+    def state(self):
+        """Стан процесу у вигляді, придатному для JSON"""
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'requests': [[route, method, status, count]
+                             for (route, method, status), count in self.requests.items()],
+                'latency': {name: dict(h, buckets=h['buckets'][:]) for name, h in self.latency.items()},
+                'phases': {name: dict(h, buckets=h['buckets'][:]) for name, h in self.phases.items()},
+                'in_flight': dict(self.in_flight),
+            }
+
+    def collect(self):
+        """Сумарний стан усіх воркерів (файли інших читаються не частіше flush_interval)"""
+        states = [self.state()]
+        if self.directory:
+            states += self._other_states()
+
+        merged = {'requests': {}, 'latency': {}, 'phases': {}, 'in_flight': {}, 'workers': len(states)}
+        for state in states:
+            for route, method, status, count in state['requests']:
+                key = (route, method, status)
+                merged['requests'][key] = merged['requests'].get(key, 0) + count
+            for section in ('latency', 'phases'):
+                for name, histogram in state[section].items():
+                    total = merged[section].get(name)
+                    if total is None:
+                        total = merged[section][name] = new_histogram()
+                    for i, count in enumerate(histogram['buckets']):
+                        total['buckets'][i] += count
+                    total['sum'] += histogram['sum']
+                    total['count'] += histogram['count']
+            for route, count in state['in_flight'].items():
+                merged['in_flight'][route] = merged['in_flight'].get(route, 0) + count
+        return merged
+
+    def _other_states(self):
+        """Стани інших воркерів з їхніх файлів"""
+        now = time.monotonic()
+        if self._others is not None and now - self._others_at < self.flush_interval:
+            return self._others
+        own_file = self._file()
+        states = []
+        for path in glob.glob(os.path.join(self.directory, 'worker-*.json')):
+            if path == own_file:
+                continue
+            try:
+                # Живий воркер оновлює файл щонайменше раз на expire / 3 секунд
+                stale = time.time() - os.path.getmtime(path) > self.expire
+                with open(path, 'r', encoding='utf-8') as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                # Файл саме замінюється або пошкоджений - пропускаємо до наступного разу
+                continue
+            # Завершений воркер більше не звітує: його файл видаляється, щоб
+            # лічильники мертвих процесів не сумувались вічно
+            if stale or not pid_alive(state['pid']):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            states.append(state)
+        self._others = states
+        self._others_at = now
+        return states
+
+    def total_requests(self):
+        """Кількість запитів усіх воркерів"""
+        with self._lock:
+            total = sum(self.requests.values())
+        if self.directory:
+            total += sum(count for state in self._other_states() for *_, count in state['requests'])
+        return total
+
+    def render(self, gauges=None):
+        """Метрики в текстовому форматі Prometheus; gauges - додаткові {назва: (опис, значення)}"""
+        merged = self.collect()
+        p = self.prefix
+        lines = [
+            f"# HELP {p}_requests_total Кількість HTTP-запитів",
+            f"# TYPE {p}_requests_total counter",
+        ]
+        for (route, method, status), count in sorted(merged['requests'].items()):
+            lines.append(f'{p}_requests_total{{route="{escape_label(route)}",method="{method}",'
+                         f'status="{status}"}} {count}')
+        lines += self._render_histograms(
+            f"{p}_request_duration_seconds", "Затримка обробки запиту", 'route', merged['latency'])
+        lines += self._render_histograms(
+            f"{p}_phase_duration_seconds", "Тривалість внутрішніх фаз обробки", 'phase', merged['phases'])
+        lines += [
+            f"# HELP {p}_requests_in_flight Запити в роботі",
+            f"# TYPE {p}_requests_in_flight gauge",
+        ]
+        for route, count in sorted(merged['in_flight'].items()):
+            lines.append(f'{p}_requests_in_flight{{route="{escape_label(route)}"}} {count}')
+        gauges = dict(gauges or {}, workers=("Воркери, що звітують метрики", merged['workers']))
+        for name, (help_text, value) in gauges.items():
+            lines += [
+                f"# HELP {p}_{name} {help_text}",
+                f"# TYPE {p}_{name} gauge",
+                f"{p}_{name} {value}",
+            ]
+        return '\n'.join(lines) + '\n'
+
+    def _render_histograms(self, name, help_text, label, histograms):
+        lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        for key, histogram in sorted(histograms.items()):
+            label_value = escape_label(key)
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), histogram['buckets']):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{label}="{label_value}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_sum{{{label}="{label_value}"}} {histogram["sum"]:.6f}')
+            lines.append(f'{name}_count{{{label}="{label_value}"}} {histogram["count"]}')
+        return lines
+
+    def flush(self):
+        """Записати стан процесу у файл воркера"""
+        if not self.directory:
+            return
+        with self._lock:
+            self._dirty = False
+        self._flushed_at = time.monotonic()
+        path = self._file()
+        tmp_file = path + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.state(), f)
+        os.replace(tmp_file, path)
+
+    def _file(self):
+        return os.path.join(self.directory, f'worker-{os.getpid()}-{self._started}.json')
+
+    def _start_flusher(self):
+        with self._lock:
+            # Після fork потік батьківського процесу не існує - запускаємо свій
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+            self._started = int(time.time() * 1000)
+        os.makedirs(self.directory, exist_ok=True)
+        threading.Thread(target=self._flusher_loop, name="metrics-flusher", daemon=True).start()
+        atexit.register(self.flush)
+
+    def _flusher_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            # Без запитів файл теж оновлюється, інакше інші воркери вважали б його застарілим
+            if self._dirty or time.monotonic() - self._flushed_at > self.expire / 3:
+                try:
+                    self.flush()
+                except OSError as e:
+                    print(f"⚠️ Метрики: не вдалося записати {self._file()}: {e}")
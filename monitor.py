@@ -0,0 +1,477 @@
+"""
+SMS Bot - Моніторинг номерів на сайтах
+
+Кожен зареєстрований номер періодично перевіряється на кожному сайті
+з MONITOR_SITES: GET на адресу сайту з підставленим номером. 2xx -
+номер знайдено, 404/410 - не знайдено; таймаути, помилки з'єднання,
+429 і 5xx повторюються з експоненційною затримкою.
+
+Перевірки виконує asyncio-цикл в окремому потоці. Для кожного сайту -
+своя черга, обмеження одночасних запитів і частоти (token bucket);
+429 з Retry-After призупиняє весь сайт. Пара (номер, сайт), що вже
+в черзі або перевіряється, вдруге не ставиться. Результати пишуться
+пакетами в SQLite, тож їх читають усі воркери, а перевіряє лише той,
+що утримує файлове блокування.
+"""
+
+import os
+import ssl
+import json
+import time
+import random
+import sqlite3
+import asyncio
+import threading
+from collections import deque
+from urllib.parse import urlsplit, quote
+
+from workers import WalConnection, wait_for_lock
+
+USER_AGENT = "sms-bot-monitor/1.0"
+# Коди, після яких перевірку варто повторити
+RETRY_STATUSES = frozenset((408, 425, 429, 500, 502, 503, 504))
+# Найдовший рядок заголовка відповіді, який ми готові читати
+MAX_LINE = 8192
+
+
+class Site:
+    """Сайт для перевірки номерів та його обмеження"""
+
+    def __init__(self, name, url, concurrency=4, rate=5.0, timeout=10.0):
+        self.name = name
+        # Адреса з {phone} - номер у форматі E.164, закодований для URL
+        self.url = url
+        self.concurrency = concurrency
+        # Запитів на секунду (0 - без обмеження)
+        self.rate = rate
+        self.timeout = timeout
+
+    @classmethod
+    def from_config(cls, name, config, **defaults):
+        """Сайт з рядка-адреси або словника {"url": ..., "concurrency": ..., ...}"""
+        if isinstance(config, str):
+            config = {'url': config}
+        if '{phone}' not in config.get('url', ''):
+            raise ValueError(f"{name}: адреса сайту повинна містити {{phone}}")
+        return cls(name, **dict(defaults, **config))
+
+    def check_url(self, key):
+        return self.url.format(phone=quote(key, safe=''))
+
+
+def load_sites(text, **defaults):
+    """Сайти з JSON {"назва": "адреса" | {...}}"""
+    if not text:
+        return []
+    return [Site.from_config(name, config, **defaults) for name, config in json.loads(text).items()]
+
+
+class RateLimiter:
+    """Token bucket для корутин одного циклу"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        # Сайт попросив зачекати (429 з Retry-After)
+        self.paused_until = 0.0
+
+    async def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+async def http_get(url, timeout):
+    """GET без читання тіла: (код, заголовки з назвами в нижньому регістрі)"""
+    return await asyncio.wait_for(_http_get(url), timeout)
+
+
+async def _http_get(url):
+    parts = urlsplit(url)
+    https = parts.scheme == 'https'
+    port = parts.port or (443 if https else 80)
+    reader, writer = await asyncio.open_connection(
+        parts.hostname, port, ssl=ssl.create_default_context() if https else None, limit=MAX_LINE)
+    try:
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        writer.write((f"GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\nUser-Agent: {USER_AGENT}\r\n"
+                      f"Accept: */*\r\nConnection: close\r\n\r\n").encode('ascii'))
+        await writer.drain()
+        status_line = await reader.readline()
+        try:
+            status = int(status_line.split(None, 2)[1])
+        except (IndexError, ValueError):
+            raise ConnectionError(f"Невірна відповідь: {status_line[:80]!r}")
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return status, headers
+    finally:
+        writer.close()
+
+
+def retry_after(headers):
+    """Retry-After у секундах (форму з датою ігноруємо)"""
+    try:
+        return max(float(headers.get('retry-after', '')), 0.0)
+    except ValueError:
+        return None
+
+
+class ResultStore:
+    """Останній результат перевірки кожної пари (номер, сайт) у SQLite"""
+
+    def __init__(self, path):
+        self.path = path
+        self._db = WalConnection(path, self._create_tables)
+        self._lock = threading.Lock()
+
+    def _create_tables(self, conn):
+        conn.execute("""CREATE TABLE IF NOT EXISTS checks (
+            key TEXT NOT NULL,
+            site TEXT NOT NULL,
+            status TEXT NOT NULL,
+            code INTEGER,
+            error TEXT,
+            attempts INTEGER NOT NULL,
+            checked_at REAL NOT NULL,
+            PRIMARY KEY (key, site)
+        ) WITHOUT ROWID""")
+
+    def save_many(self, results):
+        """Записати результати однією транзакцією"""
+        with self._lock:
+            conn = self._db.get()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO checks VALUES (:key, :site, :status, :code, :error, :attempts, :checked_at)",
+                    results)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def for_key(self, key):
+        """Результати номера: сайт -> результат"""
+        with self._lock:
+            rows = self._db.get().execute(
+                "SELECT site, status, code, error, attempts, checked_at FROM checks WHERE key = ?", (key,)).fetchall()
+        return {site: {'status': status, 'code': code, 'error': error, 'attempts': attempts, 'checked_at': checked_at}
+                for site, status, code, error, attempts, checked_at in rows}
+
+    def checked_since(self, site, since):
+        """Номери, перевірені на сайті після since"""
+        with self._lock:
+            rows = self._db.get().execute(
+                "SELECT key FROM checks WHERE site = ? AND checked_at >= ?", (site, since)).fetchall()
+        return {key for (key,) in rows}
+
+    def summary(self):
+        """Кількість результатів: сайт -> статус -> кількість"""
+        with self._lock:
+            rows = self._db.get().execute("SELECT site, status, COUNT(*) FROM checks GROUP BY site, status").fetchall()
+        result = {}
+        for site, status, count in rows:
+            result.setdefault(site, {})[status] = count
+        return result
+
+    def delete(self, keys):
+        with self._lock:
+            self._db.get().executemany("DELETE FROM checks WHERE key = ?", [(key,) for key in keys])
+
+    def clear(self):
+        with self._lock:
+            self._db.get().execute("DELETE FROM checks")
+
+    def close(self):
+        self._db.close()
+
+
+class SiteState:
+    """Черга й лічильники одного сайту (живуть у циклі монітора)"""
+
+    def __init__(self, site):
+        self.site = site
+        self.limiter = RateLimiter(site.rate, burst=site.concurrency)
+        self.queue = None
+        # Номери, перевірені з початку поточного обходу (None - обходу немає)
+        self.done = None
+        self.in_flight = 0
+        self.checks = 0
+        self.retries = 0
+        self.counts = {'found': 0, 'not_found': 0, 'error': 0}
+
+
+class Monitor:
+    """Планувальник перевірок номерів на сайтах
+
+    keys_func повертає живі номери для повного обходу раз на interval
+    секунд, is_live перевіряє номер перед запитом, refresh (якщо задано)
+    викликається раз на tick секунд, щоб підтягнути зміни інших воркерів.
+    Результати записуються в store теж раз на tick секунд.
+    """
+
+    def __init__(self, sites, store, keys_func, is_live=None, refresh=None, interval=6 * 3600,
+                 max_attempts=4, backoff=1.0, backoff_max=300.0, queue_size=1000, tick=1.0,
+                 lock_file=None, fetch=http_get):
+        self.sites = {site.name: SiteState(site) for site in sites}
+        self.store = store
+        self.keys_func = keys_func
+        self.is_live = is_live
+        self.refresh = refresh
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        # Скільки перевірок обходу тримати в черзі сайту (нові номери ставляться поза нею)
+        self.queue_size = queue_size
+        self.tick = tick
+        # Файл, блокування якого робить воркер відповідальним за перевірки
+        self.lock_file = lock_file
+        self.fetch = fetch
+        self.loop = None
+        self.running = False
+        # (номер, сайт) у черзі або в роботі -> майбутні результати для check()
+        self.pending = {}
+        # Команди з інших потоків: ('check' | 'forget', номер) або ('clear', None)
+        self._incoming = deque()
+        self._results = []
+        self._thread = None
+        self._lock_fd = None
+        self._stopping = False
+        self.sweeps = 0
+        self.last_sweep_at = None
+
+    # --- Виклики з інших потоків ---
+
+    def start(self):
+        """Запустити фоновий потік (перевірки почнуться, коли він отримає блокування)"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="site-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stopping = True
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def schedule(self, key):
+        """Перевірити номер на всіх сайтах якнайшвидше"""
+        if self.running:
+            self._incoming.append(('check', key))
+
+    def forget(self, key):
+        """Номер видалено: прибрати його результати"""
+        if self.running:
+            self._incoming.append(('forget', key))
+
+    def forget_all(self):
+        if self.running:
+            self._incoming.append(('clear', None))
+
+    def status(self):
+        """Стан планувальника в цьому процесі"""
+        return {
+            'running': self.running,
+            'sweeps': self.sweeps,
+            'last_sweep_at': self.last_sweep_at,
+            'pending': len(self.pending),
+            'sites': {
+                name: dict(state.counts, queued=state.queue.qsize() if state.queue else 0,
+                           in_flight=state.in_flight, checks=state.checks, retries=state.retries,
+                           concurrency=state.site.concurrency, rate=state.site.rate)
+                for name, state in self.sites.items()
+            },
+        }
+
+    def _run(self):
+        if self.lock_file:
+            self._lock_fd = wait_for_lock(self.lock_file, lambda: self._stopping, time.sleep, self.tick * 5)
+            if self._lock_fd is None:
+                return
+        try:
+            asyncio.run(self._main())
+        finally:
+            self.running = False
+            if self._lock_fd is not None:
+                os.close(self._lock_fd)
+                self._lock_fd = None
+
+    # --- Цикл монітора ---
+
+    async def _main(self):
+        self.loop = asyncio.get_running_loop()
+        for state in self.sites.values():
+            state.queue = asyncio.Queue()
+        workers = [asyncio.create_task(self._worker(state))
+                   for state in self.sites.values() for _ in range(state.site.concurrency)]
+        workers.append(asyncio.create_task(self._sweeper()))
+        self.running = True
+        try:
+            while not self._stopping:
+                await asyncio.sleep(self.tick)
+                if self.refresh is not None:
+                    await self.loop.run_in_executor(None, self.refresh)
+                await self._drain_incoming()
+                await self._flush()
+        finally:
+            self.running = False
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            await self._flush()
+
+    async def check(self, key, site_name):
+        """Перевірити номер на сайті (або дочекатися вже запланованої перевірки)"""
+        future = self.loop.create_future()
+        waiters = self.pending.get((key, site_name))
+        if waiters is None:
+            self._enqueue(key, self.sites[site_name])
+            waiters = self.pending[(key, site_name)]
+        waiters.append(future)
+        return await future
+
+    def _enqueue(self, key, state):
+        """Поставити пару в чергу, якщо її там ще немає"""
+        if (key, state.site.name) in self.pending:
+            return False
+        self.pending[(key, state.site.name)] = []
+        state.queue.put_nowait((key, 1))
+        return True
+
+    async def _drain_incoming(self):
+        forgotten = []
+        clear = False
+        while self._incoming:
+            command, key = self._incoming.popleft()
+            if command == 'check':
+                for state in self.sites.values():
+                    self._enqueue(key, state)
+            elif command == 'forget':
+                forgotten.append(key)
+            else:
+                clear = True
+                forgotten = []
+        if clear or forgotten:
+            # Результати, що ще чекають запису, теж належать видаленим номерам
+            await self._flush()
+            if clear:
+                await self.loop.run_in_executor(None, self.store.clear)
+            else:
+                await self.loop.run_in_executor(None, self.store.delete, forgotten)
+
+    async def _sweeper(self):
+        """Повний обхід номерів раз на interval секунд"""
+        while True:
+            started = time.monotonic()
+            keys = await self.loop.run_in_executor(None, lambda: list(self.keys_func()))
+            await asyncio.gather(*(self._sweep_site(state, keys) for state in self.sites.values()))
+            self.sweeps += 1
+            self.last_sweep_at = time.time()
+            await asyncio.sleep(max(self.interval - (time.monotonic() - started), self.tick))
+
+    async def _sweep_site(self, state, keys):
+        # Номери, перевірені протягом останнього інтервалу, пропускаються
+        state.done = set()
+        fresh = await self.loop.run_in_executor(
+            None, self.store.checked_since, state.site.name, time.time() - self.interval)
+        try:
+            for key in keys:
+                # Обхід не випереджає сайт більше ніж на queue_size перевірок
+                while state.queue.qsize() >= self.queue_size:
+                    await asyncio.sleep(0.05)
+                if key not in fresh and key not in state.done:
+                    self._enqueue(key, state)
+        finally:
+            state.done = None
+
+    async def _worker(self, state):
+        site = state.site
+        while True:
+            key, attempt = await state.queue.get()
+            if self.is_live is not None and not self.is_live(key):
+                self._finish(key, site.name, None)
+                continue
+            await state.limiter.acquire()
+            state.in_flight += 1
+            state.checks += 1
+            code = error = None
+            try:
+                code, headers = await self.fetch(site.check_url(key), site.timeout)
+            except asyncio.CancelledError:
+                raise
+            except asyncio.TimeoutError:
+                error = "timeout"
+            except (OSError, ValueError, UnicodeError) as e:
+                error = f"{type(e).__name__}: {e}"
+            finally:
+                state.in_flight -= 1
+
+            if error is None and code not in RETRY_STATUSES:
+                status = 'found' if 200 <= code < 300 else 'not_found' if code in (404, 410) else 'error'
+                if status == 'error':
+                    error = f"HTTP {code}"
+            elif attempt < self.max_attempts:
+                # Експоненційна затримка з випадковим розкидом, щоб повтори не йшли хвилею
+                delay = min(self.backoff * 2 ** (attempt - 1), self.backoff_max) * random.uniform(0.5, 1.0)
+                if code == 429:
+                    wait = retry_after(headers)
+                    if wait is not None:
+                        state.limiter.pause(wait)
+                        delay = max(delay, wait)
+                state.retries += 1
+                self.loop.call_later(delay, state.queue.put_nowait, (key, attempt + 1))
+                continue
+            else:
+                status = 'error'
+                error = error or f"HTTP {code}"
+
+            state.counts[status] += 1
+            result = {'key': key, 'site': site.name, 'status': status, 'code': code, 'error': error,
+                      'attempts': attempt, 'checked_at': time.time()}
+            self._results.append(result)
+            if state.done is not None:
+                state.done.add(key)
+            self._finish(key, site.name, result)
+
+    def _finish(self, key, site_name, result):
+        for future in self.pending.pop((key, site_name), ()):
+            if not future.done():
+                future.set_result(result)
+
+    async def _flush(self):
+        """Записати накопичені результати одним пакетом"""
+        if not self._results:
+            return
+        results, self._results = self._results, []
+        if self.is_live is not None:
+            # Номер могли видалити, поки його перевіряли
+            results = [result for result in results if self.is_live(result['key'])]
+        try:
+            await self.loop.run_in_executor(None, self.store.save_many, results)
+        except sqlite3.Error as e:
+            print(f"⚠️ Моніторинг: не вдалося записати {len(results)} результатів: {e}")
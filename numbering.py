@@ -0,0 +1,189 @@
+"""
+SMS Bot - Нормалізація номерів і визначення оператора
+
+Правила країн і коди операторів компілюються один раз під час імпорту
+в таблиці цифрових префіксів. Номер без міжнародного префікса вважається
+українським (0XX XXX XX XX або XX XXX XX XX) або міжнародним без +,
+якщо починається з коду країни, для якої є правила. Повторні введення
+віддаються з обмеженого LRU-кешу.
+"""
+
+from collections import namedtuple
+from functools import lru_cache
+
+# Результат нормалізації: номер E.164, країна (ISO), оператор (None - невідомий)
+PhoneNumber = namedtuple('PhoneNumber', 'key country carrier')
+
+# Правило країни: ISO-код, національний префікс, допустимі довжини національного
+# номера, оператори {назва: префікси національного номера}
+COUNTRIES = {
+    '380': ('UA', '0', (9,), {
+        'Київстар': ('67', '68', '77', '96', '97', '98'),
+        'Vodafone': ('50', '66', '75', '95', '99'),
+        'lifecell': ('63', '73', '93'),
+        '3Mob': ('91',),
+        'PEOPLEnet': ('92',),
+        'Інтертелеком': ('89', '94'),
+        # Фіксований зв'язок у найбільших містах
+        'Фіксований (Київ)': ('44',),
+        'Фіксований (Львів)': ('32',),
+        'Фіксований (Одеса)': ('48',),
+        'Фіксований (Харків)': ('57',),
+        'Фіксований (Дніпро)': ('56',),
+    }),
+    '48': ('PL', '', (9,), {}),
+    '373': ('MD', '0', (8,), {}),
+    '40': ('RO', '0', (9,), {}),
+    '36': ('HU', '06', (8, 9), {}),
+    '421': ('SK', '0', (9,), {}),
+    '420': ('CZ', '', (9,), {}),
+    '370': ('LT', '8', (8,), {}),
+    '49': ('DE', '0', tuple(range(6, 14)), {}),
+    '44': ('GB', '0', (9, 10), {}),
+    '1': ('US', '1', (10,), {}),
+}
+# Країна номерів, введених без міжнародного префікса
+DEFAULT_COUNTRY = '380'
+# Номер E.164 - не довше 15 цифр; коротші за 8 не приймаємо для невідомих країн
+MIN_DIGITS = 8
+MAX_DIGITS = 15
+# Розділювачі, які видаляються з введеного номера
+SEPARATORS = str.maketrans('', '', ' \t\u00a0-().')  # \u00a0 - нерозривний пробіл
+CACHE_SIZE = 65536
+# Пакети, більші за цей, нормалізуються в обхід кешу
+BATCH_CACHED = 100
+
+
+class PrefixTable:
+    """Таблиця цифрових префіксів: значення найдовшого збігу"""
+
+    def __init__(self, items=()):
+        self.values = {}
+        # Довжини префіксів від найдовшої: збіг шукається зрізом і одним
+        # зверненням до словника на довжину, без обходу по цифрі
+        self.lengths = ()
+        # Довжина найдовшого префікса
+        self.depth = 0
+        for prefix, value in items:
+            self.insert(prefix, value)
+
+    def insert(self, prefix, value):
+        self.values[prefix] = value
+        self.lengths = tuple(sorted(set(self.lengths) | {len(prefix)}, reverse=True))
+        self.depth = self.lengths[0]
+
+    def longest(self, digits):
+        """(значення, довжина префікса) найдовшого збігу або None"""
+        values = self.values
+        for length in self.lengths:
+            value = values.get(digits[:length])
+            if value is not None and length <= len(digits):
+                return value, length
+        return None
+
+
+class CountryRule:
+    """Скомпільоване правило країни"""
+
+    __slots__ = ('code', 'iso', 'trunk', 'lengths', 'carriers')
+
+    def __init__(self, code, iso, trunk, lengths, carriers):
+        self.code = code
+        self.iso = iso
+        self.trunk = trunk
+        self.lengths = frozenset(lengths)
+        # Назви операторів - константи модуля, тож записи ділять ті самі рядки
+        self.carriers = PrefixTable(
+            (prefix, name) for name, prefixes in carriers.items() for prefix in prefixes)
+
+
+RULES = {code: CountryRule(code, *rule) for code, rule in COUNTRIES.items()}
+COUNTRY_CODES = PrefixTable((code, rule) for code, rule in RULES.items())
+DEFAULT_RULE = RULES[DEFAULT_COUNTRY]
+# Скільки перших символів ключа (+E.164) досить, щоб визначити оператора
+CARRIER_PREFIX_LEN = 1 + max(len(code) + rule.carriers.depth for code, rule in RULES.items())
+
+
+def _national(rule, digits):
+    """Національний номер з номера, набраного всередині країни, або None"""
+    trunk = rule.trunk
+    if trunk and digits.startswith(trunk) and len(digits) - len(trunk) in rule.lengths:
+        return digits[len(trunk):]
+    if len(digits) in rule.lengths and not (trunk and digits.startswith(trunk)):
+        return digits
+    return None
+
+
+def _international(digits):
+    """(правило країни або None, національний номер) для цифр після + або None"""
+    # Коди країн E.164 ніколи не починаються з 0
+    if not MIN_DIGITS <= len(digits) <= MAX_DIGITS or digits.startswith('0'):
+        return None
+    match = COUNTRY_CODES.longest(digits)
+    if match is None:
+        # Країна без правил: після + приймаємо будь-який номер допустимої довжини
+        return None, digits
+    rule, length = match
+    national = digits[length:]
+    if len(national) not in rule.lengths or (rule.trunk and national.startswith(rule.trunk)):
+        return None
+    return rule, national
+
+
+def _normalize(raw):
+    text = raw.strip()
+    # Здебільшого номер уже без розділювачів - translate найдорожчий крок розбору
+    if not (text.isdigit() or text[1:].isdigit()):
+        text = text.translate(SEPARATORS)
+    if text.startswith('+'):
+        digits, international = text[1:], True
+    elif text.startswith('00'):
+        digits, international = text[2:], True
+    else:
+        digits, international = text, False
+    # isdigit пропускає цифри інших письменностей - потрібні лише ASCII
+    if not digits.isdigit() or not digits.isascii():
+        return None
+
+    rule = None
+    if not international:
+        national = _national(DEFAULT_RULE, digits)
+        if national is not None:
+            rule = DEFAULT_RULE
+    if rule is None:
+        # Міжнародний номер, можливо, без + (380XXXXXXXXX)
+        parsed = _international(digits)
+        if parsed is None:
+            return None
+        rule, national = parsed
+        if rule is None:
+            # Без + чи 00 номер країни без правил не відрізнити від помилки
+            if not international:
+                return None
+            return PhoneNumber('+' + digits, None, None)
+
+    match = rule.carriers.longest(national)
+    return PhoneNumber('+' + rule.code + national, rule.iso, match[0] if match else None)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def normalize(raw):
+    """Нормалізувати введений номер: PhoneNumber або None, якщо номер невірний"""
+    return _normalize(raw)
+
+
+def normalize_many(phones):
+    """Нормалізувати пакет номерів (список результатів у тому самому порядку)"""
+    # Пакет здебільшого з унікальних номерів: кеш лише сповільнив би його
+    # і витіснив повторні введення з форми
+    return list(map(normalize if len(phones) <= BATCH_CACHED else _normalize, phones))
+
+
+def carrier_of(key):
+    """Оператор уже нормалізованого номера (+E.164)"""
+    match = COUNTRY_CODES.longest(key[1:])
+    if match is None:
+        return None
+    rule, length = match
+    carrier = rule.carriers.longest(key[1 + length:])
+    return carrier[0] if carrier else None
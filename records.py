@@ -0,0 +1,170 @@
+"""
+SMS Bot - Компактне представлення записів номерів
+"""
+
+import sys
+import time
+import threading
+from itertools import islice
+
+from numbering import carrier_of
+
+# Короткі імена і примітки часто повторюються - інтернуємо їх,
+# щоб однакові рядки зберігались в одному екземплярі
+INTERN_MAX_LEN = 64
+# Лінивий запис можуть вперше читати кілька потоків одночасно
+_decode_lock = threading.Lock()
+
+
+def intern_text(text):
+    if text and len(text) <= INTERN_MAX_LEN:
+        return sys.intern(text)
+    return text or None
+
+
+class PhoneRecord:
+    """Запис номера зі __slots__ замість dict
+
+    Відформатований timestamp не зберігається: він виводиться з
+    registered_at, коли запис серіалізується. Оператор однозначно
+    визначається за ключем, тому в снапшоті й SQLite його немає: для
+    завантажених записів він визначається під час першого звернення.
+    Запис, прочитаний з бінарного снапшоту, так само розбирає номер,
+    ім'я та примітки лише під час першого звернення до них.
+    """
+
+    __slots__ = ('id', 'key', 'registered_at', 'deleted', '_phone', '_name', '_notes', '_carrier', '_src')
+
+    def __init__(self, id, key, phone, name, notes, registered_at, carrier=None):
+        self.id = id
+        # Нормалізований номер (E.164) - той самий рядок, що й ключ індексу
+        self.key = key
+        self.registered_at = registered_at
+        # Версія реєстру, в якій запис видалено (None - живий)
+        self.deleted = None
+        self._phone = phone
+        self._name = intern_text(name)
+        self._notes = intern_text(notes)
+        # Оператор, визначений під час нормалізації (None - визначити за ключем)
+        self._carrier = carrier
+        self._src = None
+
+    @classmethod
+    def lazy(cls, id, key, registered_at, src, offset):
+        """Запис, поля якого ще лежать у снапшоті src за зміщенням offset"""
+        record = cls.__new__(cls)
+        record.id = id
+        record.key = key
+        record.registered_at = registered_at
+        record.deleted = None
+        record._carrier = None
+        # Поки запис не розібрано, _phone зберігає зміщення в снапшоті
+        record._phone = offset
+        record._src = src
+        return record
+
+    def _load(self):
+        with _decode_lock:
+            if self._src is None:
+                # Запис уже розібрав інший потік
+                return
+            phone, name, notes = self._src.decode(self._phone)
+            self._name = intern_text(name)
+            self._notes = intern_text(notes)
+            self._phone = self.key if phone == self.key else phone
+            self._src = None
+
+    @property
+    def phone(self):
+        if self._src is not None:
+            self._load()
+        return self._phone
+
+    @property
+    def name(self):
+        if self._src is not None:
+            self._load()
+        return self._name
+
+    @property
+    def notes(self):
+        if self._src is not None:
+            self._load()
+        return self._notes
+
+    @property
+    def carrier(self):
+        carrier = self._carrier
+        if carrier is None:
+            # Визначається під час першого звернення; '' - оператор невідомий
+            carrier = self._carrier = carrier_of(self.key) or ''
+        return carrier or None
+
+    @property
+    def timestamp(self):
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.registered_at))
+
+    def raw(self):
+        """Нерозібрані байти полів зі снапшоту або None"""
+        with _decode_lock:
+            if self._src is None:
+                return None
+            return self._src.raw(self._phone)
+
+    def to_dict(self):
+        """Запис у форматі API та файлів сховища"""
+        return {
+            'carrier': self.carrier,
+            'id': self.id,
+            'name': self.name,
+            'notes': self.notes,
+            'phone': self.phone,
+            'registered_at': self.registered_at,
+            'timestamp': self.timestamp
+        }
+
+    @classmethod
+    def from_dict(cls, data, key, record_id):
+        phone = data['phone']
+        # Номер, уже записаний у нормалізованому вигляді, ділить рядок із ключем
+        if phone == key:
+            phone = key
+        return cls(record_id, key, phone, data.get('name'), data.get('notes'), data['registered_at'],
+                   data.get('carrier'))
+
+    def __repr__(self):
+        return f"PhoneRecord({self.id!r}, {self.key!r})"
+
+
+class Snapshot:
+    """Незмінний знімок реєстру для читачів
+
+    Поки список опубліковано в знімку, записник лише дописує в його кінець
+    (вставка в середину і компакція створюють новий список), тож перші
+    count записів не змінюються. Видалений запис лишається в списку з
+    версією видалення і для знімків старших версій вважається живим.
+    """
+
+    __slots__ = ('version', 'records', 'count', 'total', 'seq', 'modified_at')
+
+    def __init__(self, version, records, total, seq=None, modified_at=None):
+        self.version = version
+        self.records = records
+        self.count = len(records)
+        # Кількість живих записів у знімку
+        self.total = total
+        # Номер останньої операції сховища: однаковий у всіх воркерів для
+        # того самого стану, тож придатний для ETag
+        self.seq = seq
+        # Час останньої зміни (для Last-Modified)
+        self.modified_at = modified_at
+
+    def is_live(self, record):
+        return record.deleted is None or record.deleted > self.version
+
+    def __iter__(self):
+        """Живі записи знімка у стабільному порядку"""
+        version = self.version
+        for record in islice(self.records, self.count):
+            if record.deleted is None or record.deleted > version:
+                yield record
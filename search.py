@@ -0,0 +1,246 @@
+"""
+SMS Bot - Пошуковий індекс номерів
+
+Номери шукаються за префіксом або суфіксом цифр у відсортованих масивах,
+ім'я та примітки - за словами і триграмами словника. Індекс працює з
+нормалізованими ключами номерів (+380XXXXXXXXX).
+"""
+
+import re
+import bisect
+import unicodedata
+from functools import lru_cache
+from itertools import chain, islice
+
+# Апострофи, що трапляються в українських іменах, зводимо до одного
+APOSTROPHES = str.maketrans({'ʼ': "'", '’': "'", '`': "'", 'ʹ': "'"})
+WORD = re.compile(r"\w+(?:'\w+)*")
+
+
+def fold(text):
+    """Привести текст до порівнюваного вигляду (регістр, юнікод, апострофи)"""
+    return unicodedata.normalize('NFKC', text).translate(APOSTROPHES).casefold()
+
+
+def tokenize(text):
+    """Слова тексту після згортання регістру"""
+    return WORD.findall(fold(text)) if text else []
+
+
+@lru_cache(maxsize=65536)
+def text_tokens(text):
+    """Множина слів тексту (імена і примітки часто повторюються)"""
+    return frozenset(tokenize(text))
+
+
+def trigrams(token):
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+
+class SortedKeys:
+    """Відсортований масив рядків із невеликим буфером нових
+
+    Вставка дописує ключ у буфер, який сортується лише перед пошуком;
+    злиття з основним масивом відбувається, коли буфер перевищує 1/32
+    основного - амортизовано O(1).
+    """
+
+    MERGE_MIN = 1024
+
+    def __init__(self):
+        self.keys = []
+        self.delta = []
+        self.delta_sorted = True
+        # Видалені ключі, що ще лежать в основному масиві
+        self.removed = set()
+
+    def __len__(self):
+        return len(self.keys) + len(self.delta) - len(self.removed)
+
+    def rebuild(self, keys):
+        self.keys = sorted(keys)
+        self.delta = []
+        self.delta_sorted = True
+        self.removed = set()
+
+    def add(self, key):
+        if key in self.removed:
+            # Ключ повернувся - він досі лежить в основному масиві
+            self.removed.discard(key)
+            return
+        self.delta.append(key)
+        self.delta_sorted = False
+        if len(self.delta) > max(self.MERGE_MIN, len(self.keys) // 32):
+            self.merge()
+
+    def remove(self, key):
+        self._sort_delta()
+        pos = bisect.bisect_left(self.delta, key)
+        if pos < len(self.delta) and self.delta[pos] == key:
+            del self.delta[pos]
+            return
+        self.removed.add(key)
+        if len(self.removed) > max(self.MERGE_MIN, len(self.keys) // 32):
+            self.merge()
+
+    def merge(self):
+        keys = self.keys
+        if self.removed:
+            keys = [key for key in keys if key not in self.removed]
+        # Два відсортовані шматки - Timsort зливає їх за лінійний час
+        keys.extend(self.delta)
+        keys.sort()
+        self.keys = keys
+        self.delta = []
+        self.delta_sorted = True
+        self.removed = set()
+
+    def _sort_delta(self):
+        if not self.delta_sorted:
+            self.delta.sort()
+            self.delta_sorted = True
+
+    def prefixed(self, prefix):
+        """Ключі з префіксом у порядку зростання"""
+        self._sort_delta()
+        for keys in (self.keys, self.delta):
+            pos = bisect.bisect_left(keys, prefix)
+            while pos < len(keys) and keys[pos].startswith(prefix):
+                if keys[pos] not in self.removed:
+                    yield keys[pos]
+                pos += 1
+
+
+class SearchIndex:
+    """Інкрементальний індекс номерів, імен і приміток"""
+
+    def __init__(self):
+        self.phones = SortedKeys()
+        # Перевернуті ключі для пошуку за суфіксом
+        self.reversed_phones = SortedKeys()
+        # Слово -> ключі номерів; триграма -> слова словника
+        self.words = {}
+        self.grams = {}
+        # Поки індекс не побудовано, add/remove нічого не роблять
+        self.built = True
+
+    def clear(self):
+        self.phones.rebuild([])
+        self.reversed_phones.rebuild([])
+        self.words.clear()
+        self.grams.clear()
+        self.built = True
+
+    def invalidate(self):
+        """Скинути індекс до наступного rebuild"""
+        self.clear()
+        self.built = False
+
+    def rebuild(self, items):
+        """Побудувати індекс з пар (ключ, запис)"""
+        self.clear()
+        keys = []
+        for key, record in items:
+            keys.append(key)
+            self._add_text(key, record)
+        self.phones.rebuild(keys)
+        self.reversed_phones.rebuild(key[::-1] for key in keys)
+
+    def add(self, key, record):
+        if not self.built:
+            return
+        self.phones.add(key)
+        self.reversed_phones.add(key[::-1])
+        self._add_text(key, record)
+
+    def remove(self, key, record):
+        if not self.built:
+            return
+        self.phones.remove(key)
+        self.reversed_phones.remove(key[::-1])
+        for token in self._tokens(record):
+            keys = self.words.get(token)
+            if keys is None:
+                continue
+            keys.discard(key)
+            if not keys:
+                # Слово зникло зі словника - прибираємо його з триграм
+                del self.words[token]
+                for gram in trigrams(token):
+                    tokens = self.grams.get(gram)
+                    if tokens is not None:
+                        tokens.discard(token)
+                        if not tokens:
+                            del self.grams[gram]
+
+    def search_prefix(self, digits, limit):
+        """Ключі номерів, що починаються з цифр"""
+        return list(islice(self.phones.prefixed('+' + digits), limit))
+
+    def search_suffix(self, digits, limit):
+        """Ключі номерів, що закінчуються цифрами"""
+        return [key[::-1] for key in islice(self.reversed_phones.prefixed(digits[::-1]), limit)]
+
+    def search_text(self, query, limit):
+        """Ключі номерів, у чиїх імені чи примітках є всі слова запиту"""
+        # Для кожного слова запиту - слова словника, що йому відповідають
+        terms = []
+        for term in set(tokenize(query)):
+            tokens = self._match_term(term)
+            if not tokens:
+                return []
+            terms.append((sum(len(self.words[token]) for token in tokens), tokens))
+        if not terms:
+            return []
+        terms.sort(key=lambda item: item[0])
+
+        # Кандидати беруться з найрідкіснішого слова і перевіряються рештою
+        # до першого limit збігів - великі множини популярних слів ніколи
+        # не об'єднуються і не перетинаються повністю
+        _, rarest = terms[0]
+        checks = [[self.words[token] for token in tokens] for _, tokens in terms[1:]]
+        # Ключ може трапитись у кількох словах - повтори відкидаємо
+        seen = set() if len(rarest) > 1 else None
+        result = []
+        for key in chain.from_iterable(self.words[token] for token in rarest):
+            if seen is not None:
+                if key in seen:
+                    continue
+                seen.add(key)
+            for check in checks:
+                if len(check) == 1:
+                    if key not in check[0]:
+                        break
+                elif not any(key in keys for keys in check):
+                    break
+            else:
+                result.append(key)
+                if len(result) >= limit:
+                    break
+        return result
+
+    def _match_term(self, term):
+        """Слова словника для слова запиту: саме слово або (від 3 літер) слова, що його містять"""
+        if len(term) < 3:
+            return [term] if term in self.words else []
+        candidates = None
+        for gram in sorted(trigrams(term), key=lambda g: len(self.grams.get(g, ()))):
+            tokens = self.grams.get(gram)
+            if not tokens:
+                return []
+            candidates = set(tokens) if candidates is None else candidates & tokens
+        return [token for token in candidates if term in token]
+
+    def _tokens(self, record):
+        if not record.name and not record.notes:
+            return ()
+        return text_tokens(record.name) | text_tokens(record.notes)
+
+    def _add_text(self, key, record):
+        for token in self._tokens(record):
+            keys = self.words.get(token)
+            if keys is None:
+                keys = self.words[token] = set()
+                for gram in trigrams(token):
+                    self.grams.setdefault(gram, set()).add(token)
+            keys.add(key)
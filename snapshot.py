@@ -0,0 +1,135 @@
+"""
+SMS Bot - Бінарний снапшот реєстру номерів
+
+Формат файлу (little-endian):
+    заголовок  magic "SMSB", версія u16, резерв u16, seq u64,
+               кількість записів u64, зміщення індексу u64
+    записи     для кожного: довжина u32, далі поля phone, name, notes, key
+               (u32 довжина + UTF-8, 0xFFFFFFFF - None; key лише якщо
+               його не можна записати числом в індексі)
+    індекс     для кожного запису 32 байти: цифри ключа u64 (0 - ключ у
+               полях запису), registered_at f64, id 8 байт, зміщення u64
+
+При старті читається лише індекс; поля записів розбираються з mmap під
+час першого звернення до них.
+"""
+
+import os
+import mmap
+import struct
+
+from records import PhoneRecord
+
+MAGIC = b'SMSB'
+VERSION = 1
+HEADER = struct.Struct('<4sHHQQQ')
+ENTRY = struct.Struct('<Qd8sQ')
+LENGTH = struct.Struct('<I')
+NONE = 0xFFFFFFFF
+# Ключ +XXXXXXXX уміщується в u64, якщо в ньому до 18 цифр без провідного нуля
+MAX_KEY_DIGITS = 18
+
+
+def numeric_key(key):
+    """Цифри ключа як число або 0, якщо ключ не можна відновити з числа"""
+    digits = key[1:]
+    if key.startswith('+') and digits.isdigit() and len(digits) <= MAX_KEY_DIGITS and digits[0] != '0':
+        return int(digits)
+    return 0
+
+
+def encode_fields(*fields):
+    """Запис снапшоту: довжина і поля"""
+    parts = []
+    for field in fields:
+        if field is None:
+            parts.append(LENGTH.pack(NONE))
+        else:
+            data = field.encode('utf-8')
+            parts.append(LENGTH.pack(len(data)))
+            parts.append(data)
+    payload = b''.join(parts)
+    return LENGTH.pack(len(payload)) + payload
+
+
+class SnapshotReader:
+    """Снапшот, відображений у пам'ять"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            # mmap тримає власний дескриптор і переживає заміну файлу через os.replace
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, self.seq, self.count, self.index_offset = HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path}: невідомий формат снапшоту")
+        if self.index_offset + self.count * ENTRY.size != len(self.buf):
+            raise ValueError(f"{path}: пошкоджений снапшот")
+
+    def raw(self, offset):
+        """Байти запису разом із довжиною"""
+        (length,) = LENGTH.unpack_from(self.buf, offset)
+        return self.buf[offset:offset + LENGTH.size + length]
+
+    def decode(self, offset, with_key=False):
+        """Поля запису: (phone, name, notes) або з ключем, якщо with_key"""
+        fields = []
+        pos = offset + LENGTH.size
+        for _ in range(4 if with_key else 3):
+            (length,) = LENGTH.unpack_from(self.buf, pos)
+            pos += LENGTH.size
+            if length == NONE:
+                fields.append(None)
+            else:
+                fields.append(self.buf[pos:pos + length].decode('utf-8'))
+                pos += length
+        return tuple(fields)
+
+    def records(self):
+        """Ліниві записи в порядку снапшоту"""
+        index = memoryview(self.buf)[self.index_offset:self.index_offset + self.count * ENTRY.size]
+        lazy = PhoneRecord.lazy
+        for key_digits, registered_at, record_id, offset in ENTRY.iter_unpack(index):
+            key = f'+{key_digits}' if key_digits else self.decode(offset, with_key=True)[3]
+            yield lazy(record_id.hex(), key, registered_at, self, offset)
+
+
+def snapshot_seq(path):
+    """seq снапшоту з його заголовка або None, якщо файлу немає чи формат інший"""
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+    except FileNotFoundError:
+        return None
+    if len(header) < HEADER.size:
+        return None
+    magic, version, _, seq, _, _ = HEADER.unpack(header)
+    return seq if magic == MAGIC and version == VERSION else None
+
+
+def write_snapshot(path, seq, records):
+    """Атомарно записати снапшот: тимчасовий файл, fsync, os.replace"""
+    # Снапшот спільної бази SQLite можуть записувати кілька воркерів одночасно
+    tmp_file = f'{path}.{os.getpid()}.tmp'
+    entries = bytearray()
+    with open(tmp_file, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, seq, 0, 0))
+        offset = HEADER.size
+        count = 0
+        for record in records:
+            key_digits = numeric_key(record.key)
+            # Ще не розібраний запис копіюється зі старого снапшоту як є
+            raw = record.raw()
+            if raw is None:
+                raw = encode_fields(record.phone, record.name, record.notes,
+                                    None if key_digits else record.key)
+            f.write(raw)
+            entries += ENTRY.pack(key_digits, record.registered_at, bytes.fromhex(record.id), offset)
+            offset += len(raw)
+            count += 1
+        f.write(entries)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, 0, seq, count, offset))
+        f.flush()
+        os.fsync(f.fileno())
+    # Атомарна заміна: на диску завжди або старий, або новий снапшот
+    os.replace(tmp_file, path)
@@ -0,0 +1,440 @@
+"""
+SMS Bot - Сховища реєстру номерів
+
+Кожне сховище працює з операціями журналу:
+    {"op": "register", "key": "+380...", "record": {...}}
+    {"op": "delete", "phone": "+380...", "id": "..."}
+    {"op": "clear"}
+    {"op": "expire", "before": [registered_at, "+380..."]}
+Операція expire видаляє записи, що в порядку (registered_at, ключ) стоять
+раніше за межу before (їх уже перенесено в архів). Видалення з id
+стосується лише запису з цим ID: номер, який тим часом видалили й
+зареєстрували знову, лишається.
+Після запису операція отримує порядковий номер "seq". Кілька операцій,
+записаних разом, журнал зберігає одним рядком {"op": "batch", "ops": [...]}:
+пакет або повторюється цілком, або (якщо рядок обірвано) не повторюється.
+Журнали з окремими рядками на кожну операцію читаються як і раніше.
+"""
+
+import os
+import json
+import atexit
+import threading
+
+from records import PhoneRecord
+from snapshot import SnapshotReader, snapshot_seq, write_snapshot
+from workers import WalConnection
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    def encode_op(op):
+        # Той самий компактний JSON, що й у стандартного кодувальника, на порядок швидше
+        return orjson.dumps(op).decode()
+else:
+    # Один кодувальник на всі записи журналу: без накладних витрат json.dumps на кожен виклик.
+    # Операції - прості словники без циклів, тож перевірка циклічності не потрібна
+    encode_op = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), check_circular=False).encode
+
+
+class JournalStorage:
+    """Снапшот + журнал операцій у файлах (лише для одного процесу)
+
+    Снапшот зберігається в бінарному форматі (див. snapshot.py); старий
+    JSON-снапшот читається один раз і при першій компакції переноситься
+    в бінарний.
+    """
+
+    name = "journal"
+
+    def __init__(self, snapshot_file, journal_file, compact_every=10000,
+                 write_behind=False, window_ms=50, window_ops=1000, legacy_file=None):
+        self.snapshot_file = snapshot_file
+        self.journal_file = journal_file
+        # JSON-снапшот попередніх версій
+        self.legacy_file = legacy_file
+        self.legacy_loaded = False
+        self.compact_every = compact_every
+        # Відкладений запис: фоновий потік групує операції і робить один fsync на пакет
+        self.write_behind = write_behind
+        # Вікно довговічності: не довше N мс або M операцій до запису на диск
+        self.window_ms = window_ms
+        self.window_ops = window_ops
+        self.seq = 0
+        self.ops_since_compact = 0
+        self._file = None
+        self._lock = threading.Lock()
+        self._cond = threading.Condition()
+        # Рядки журналу, що чекають на запис, і кількість операцій у них
+        # (рядок пакета містить багато операцій)
+        self._pending = []
+        self._pending_ops = 0
+        self._flusher = None
+        self._stopping = False
+
+    def load(self):
+        """Прочитати снапшот і операції журналу, новіші за нього
+
+        Записи бінарного снапшоту - ліниві PhoneRecord, JSON-снапшоту - словники.
+        """
+        records = []
+        self.seq = 0
+        self.legacy_loaded = False
+        if os.path.exists(self.snapshot_file):
+            reader = SnapshotReader(self.snapshot_file)
+            records = list(reader.records())
+            self.seq = reader.seq
+        elif self.legacy_file and os.path.exists(self.legacy_file):
+            self.legacy_loaded = True
+            with open(self.legacy_file, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+            # Старий формат - просто список номерів
+            if isinstance(snapshot, list):
+                records = snapshot
+            else:
+                records = snapshot['phones']
+                self.seq = snapshot['seq']
+
+        ops = []
+        self.ops_since_compact = 0
+        if os.path.exists(self.journal_file):
+            good_end = 0
+            with open(self.journal_file, 'rb') as f:
+                for line in f:
+                    try:
+                        if not line.endswith(b'\n'):
+                            raise ValueError("незавершений запис")
+                        op = json.loads(line)
+                    except ValueError:
+                        # Обірваний хвіст після аварійної зупинки - відрізаємо його,
+                        # щоб нові записи не дописувались після сміття
+                        print(f"⚠️ Журнал {self.journal_file}: пошкоджений запис на байті {good_end}, хвіст відкинуто")
+                        break
+                    good_end += len(line)
+                    for op in op['ops'] if op['op'] == 'batch' else (op,):
+                        self.ops_since_compact += 1
+                        # Операції, що вже увійшли в снапшот, пропускаємо
+                        if op['seq'] <= self.seq:
+                            continue
+                        ops.append(op)
+                        self.seq = op['seq']
+            if good_end != os.path.getsize(self.journal_file):
+                os.truncate(self.journal_file, good_end)
+        return records, ops
+
+    def poll(self):
+        """Операції інших процесів (журнал не розділяється між процесами)"""
+        return []
+
+    def commit(self, ops):
+        """Записати операції в журнал, повертає (чужі операції, прийняті операції)"""
+        for op in ops:
+            self.seq += 1
+            op['seq'] = self.seq
+        # Пакет кодується одним викликом кодувальника
+        lines = [encode_op(ops[0] if len(ops) == 1 else {'op': 'batch', 'ops': ops}) + '\n']
+        self.ops_since_compact += len(ops)
+
+        if not self.write_behind:
+            with self._lock:
+                self._write(lines)
+            return [], ops
+
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flusher_loop, name="journal-flusher", daemon=True)
+            self._flusher.start()
+            atexit.register(self.close)
+        with self._cond:
+            self._pending.extend(lines)
+            self._pending_ops += len(ops)
+            self._cond.notify()
+        return [], ops
+
+    def needs_compaction(self, count):
+        """Чи накопичилось у журналі досить операцій для компакції"""
+        # Поріг росте з розміром бази, тож амортизована вартість компакції
+        # на одну операцію не залежить від кількості номерів.
+        # JSON-снапшот переноситься в бінарний одразу після завантаження
+        return self.legacy_loaded or self.ops_since_compact >= max(self.compact_every, count)
+
+    def compact(self, records):
+        """Записати снапшот бази (PhoneRecord) і очистити журнал"""
+        with self._lock:
+            write_snapshot(self.snapshot_file, self.seq, records)
+            if self.legacy_loaded:
+                # Старий файл лишається поруч як резервна копія, але більше не читається
+                os.replace(self.legacy_file, self.legacy_file + '.migrated')
+                self.legacy_loaded = False
+
+            # Операції, що ще чекають у черзі, вже є в снапшоті -
+            # після запису в новий журнал вони будуть пропущені при повторі
+            if self._file is not None:
+                self._file.close()
+            self._file = open(self.journal_file, 'w', encoding='utf-8')
+            self.ops_since_compact = 0
+
+    def backlog(self):
+        """Кількість операцій, ще не записаних на диск"""
+        return self._pending_ops
+
+    def flush(self):
+        """Скинути на диск усі відкладені операції"""
+        with self._lock:
+            with self._cond:
+                lines = self._pending[:]
+                self._pending.clear()
+                self._pending_ops = 0
+            if lines:
+                self._write(lines)
+
+    def close(self):
+        """Зупинити фоновий потік і дописати залишок журналу"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+
+    def _write(self, lines):
+        """Записати рядки в журнал одним fsync"""
+        if self._file is None:
+            self._file = open(self.journal_file, 'a', encoding='utf-8')
+        self._file.write(''.join(lines))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _flusher_loop(self):
+        """Фоновий потік відкладеного запису"""
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._stopping)
+                # Збираємо пакет, поки не мине вікно або не набереться window_ops
+                self._cond.wait_for(
+                    lambda: self._pending_ops >= self.window_ops or self._stopping,
+                    timeout=self.window_ms / 1000)
+                stopping = self._stopping
+            self.flush()
+            if stopping:
+                return
+
+
+class SQLiteStorage:
+    """SQLite у режимі WAL: одна база для всіх воркерів gunicorn
+
+    Таблиця phones - поточний стан (унікальний ключ гарантує відсутність
+    дублікатів між процесами), таблиця oplog - впорядкований журнал змін,
+    за яким кожен воркер наздоганяє свій стан у пам'яті.
+
+    Щоб старт воркера не розбирав кожен рядок phones, стан періодично
+    зберігається в бінарний снапшот (див. snapshot.py) з seq останньої
+    операції oplog: старт читає снапшот і повторює лише новіші операції.
+    """
+
+    name = "sqlite"
+    # Скільки останніх операцій тримати в oplog для відсталих воркерів
+    OPLOG_KEEP = 100000
+
+    def __init__(self, path, key_func, id_func, legacy=None, compact_every=10000):
+        self.path = path
+        # Нормалізація номера в унікальний ключ
+        self.key_func = key_func
+        # ID запису з ключа і часу реєстрації (у таблиці ID не зберігається)
+        self.id_func = id_func
+        # Сховище, з якого дані переносяться в порожню базу при першому запуску
+        self.legacy = legacy
+        self.compact_every = compact_every
+        self.seq = 0
+        # seq останнього прочитаного чи записаного снапшоту (None - снапшоту немає)
+        self.snapshot_seq = None
+        self._db = WalConnection(path, self._create_tables)
+        self._lock = threading.Lock()
+
+    def _create_tables(self, conn):
+        conn.execute("""CREATE TABLE IF NOT EXISTS phones (
+            key TEXT PRIMARY KEY,
+            phone TEXT NOT NULL,
+            name TEXT,
+            notes TEXT,
+            timestamp TEXT,
+            registered_at REAL
+        )""")
+        # Для expire: видалення найстаріших записів без обходу всієї таблиці
+        conn.execute("CREATE INDEX IF NOT EXISTS phones_registered_at ON phones (registered_at)")
+        conn.execute("CREATE TABLE IF NOT EXISTS oplog (seq INTEGER PRIMARY KEY AUTOINCREMENT, op TEXT NOT NULL)")
+        # Випадковий ID бази: снапшот бази, яку видалили й створили заново, не підійде новій
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        conn.execute("INSERT OR IGNORE INTO meta VALUES ('id', lower(hex(randomblob(8))))")
+        self._migrate(conn)
+
+    def _migrate(self, conn):
+        """Перенести дані зі старого сховища в порожню базу"""
+        if self.legacy is None:
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            empty = conn.execute("SELECT NOT EXISTS (SELECT 1 FROM phones) AND NOT EXISTS (SELECT 1 FROM oplog)").fetchone()[0]
+            if empty:
+                records, ops = self.legacy.load()
+                # Повтор журналу поверх снапшоту в упорядкованому словнику
+                state = {}
+                for r in records:
+                    if isinstance(r, PhoneRecord):
+                        r = r.to_dict()
+                    state.setdefault(self.key_func(r['phone']), r)
+                for op in ops:
+                    if op['op'] == 'register':
+                        state.setdefault(self.key_func(op['record']['phone']), op['record'])
+                    elif op['op'] == 'delete':
+                        state.pop(op['phone'], None)
+                    elif op['op'] == 'clear':
+                        state.clear()
+                    elif op['op'] == 'expire':
+                        before = tuple(op['before'])
+                        state = {key: r for key, r in state.items() if (r['registered_at'], key) >= before}
+                conn.executemany(
+                    "INSERT OR IGNORE INTO phones VALUES (?, ?, ?, ?, ?, ?)",
+                    [(key, r['phone'], r['name'], r['notes'], r['timestamp'], r['registered_at'])
+                     for key, r in state.items()])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def load(self):
+        """Прочитати поточний стан бази
+
+        Зі снапшоту - ліниві PhoneRecord і новіші операції oplog, інакше -
+        словники з усіх рядків phones.
+        """
+        with self._lock:
+            conn = self._db.get()
+            conn.execute("BEGIN")
+            try:
+                self.seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM oplog").fetchone()[0]
+                loaded = self._load_snapshot(conn)
+                if loaded is None:
+                    rows = conn.execute(
+                        "SELECT phone, name, notes, timestamp, registered_at FROM phones ORDER BY rowid").fetchall()
+            finally:
+                conn.execute("COMMIT")
+        if loaded is not None:
+            return loaded
+        self.snapshot_seq = None
+        records = [
+            {'phone': phone, 'name': name, 'notes': notes, 'timestamp': timestamp, 'registered_at': registered_at}
+            for phone, name, notes, timestamp, registered_at in rows
+        ]
+        return records, []
+
+    def _snapshot_file(self, conn):
+        db_id = conn.execute("SELECT value FROM meta WHERE key = 'id'").fetchone()[0]
+        return f"{self.path}.{db_id}.snapshot"
+
+    def _load_snapshot(self, conn):
+        """(записи снапшоту, операції після нього) або None, якщо снапшот не підходить"""
+        path = self._snapshot_file(conn)
+        seq = self.seq
+        try:
+            reader = SnapshotReader(path)
+        except (FileNotFoundError, ValueError):
+            return None
+        # Снапшот, новіший за прочитаний стан, щойно записав інший воркер
+        if reader.seq > seq:
+            return None
+        self.seq = reader.seq
+        ops = self._fetch_since()
+        if ops is None:
+            # Частину операцій після снапшоту вже видалено з oplog
+            self.seq = seq
+            return None
+        self.snapshot_seq = reader.seq
+        return list(reader.records()), ops
+
+    def _fetch_since(self):
+        rows = self._db.get().execute("SELECT seq, op FROM oplog WHERE seq > ? ORDER BY seq", (self.seq,)).fetchall()
+        # Потрібні операції вже видалені з oplog - стан треба перечитати повністю
+        if rows and rows[0][0] != self.seq + 1:
+            return None
+        ops = []
+        for seq, op in rows:
+            op = json.loads(op)
+            op['seq'] = seq
+            ops.append(op)
+        if rows:
+            self.seq = rows[-1][0]
+        return ops
+
+    def poll(self):
+        """Операції інших воркерів після останньої відомої; None - треба перезавантаження"""
+        with self._lock:
+            self._db.get()
+            return self._fetch_since()
+
+    def commit(self, ops):
+        """Записати операції в одній транзакції, повертає (чужі операції, прийняті операції)"""
+        with self._lock:
+            conn = self._db.get()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                synced = self._fetch_since()
+                accepted = []
+                for op in ops:
+                    if op['op'] == 'register':
+                        r = op['record']
+                        cur = conn.execute(
+                            "INSERT OR IGNORE INTO phones VALUES (?, ?, ?, ?, ?, ?)",
+                            (op['key'], r['phone'], r['name'], r['notes'], r['timestamp'], r['registered_at']))
+                    elif op['op'] == 'delete':
+                        row = conn.execute("SELECT registered_at FROM phones WHERE key = ?", (op['phone'],)).fetchone()
+                        if row is None or ('id' in op and self.id_func(op['phone'], row[0]) != op['id']):
+                            continue
+                        cur = conn.execute("DELETE FROM phones WHERE key = ?", (op['phone'],))
+                    elif op['op'] == 'expire':
+                        registered_at, key = op['before']
+                        cur = conn.execute(
+                            "DELETE FROM phones WHERE registered_at <= ? AND (registered_at < ? OR key < ?)",
+                            (registered_at, registered_at, key))
+                    else:
+                        cur = conn.execute("DELETE FROM phones")
+                    # Дублікат або вже видалений іншим воркером номер
+                    if cur.rowcount == 0 and op['op'] != 'clear':
+                        continue
+                    op['seq'] = conn.execute(
+                        "INSERT INTO oplog (op) VALUES (?)", (encode_op(op),)).lastrowid
+                    accepted.append(op)
+                if accepted:
+                    self.seq = accepted[-1]['seq']
+                    if self.seq % 1000 < len(accepted):
+                        conn.execute("DELETE FROM oplog WHERE seq <= ?", (self.seq - self.OPLOG_KEEP,))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return synced, accepted
+
+    def needs_compaction(self, count):
+        """Чи час оновити снапшот (WAL SQLite переносить у базу сам)"""
+        # Поріг, як у журналу, росте з розміром бази
+        return self.snapshot_seq is None or self.seq - self.snapshot_seq >= max(self.compact_every, count)
+
+    def compact(self, records):
+        """Записати снапшот бази (PhoneRecord) зі станом на поточний seq"""
+        with self._lock:
+            path = self._snapshot_file(self._db.get())
+            current = snapshot_seq(path)
+            # Досить свіжий снапшот уже записав інший воркер
+            if current is not None and 0 <= self.seq - current < max(self.compact_every, len(records)):
+                self.snapshot_seq = current
+                return
+            write_snapshot(path, self.seq, records)
+            self.snapshot_seq = self.seq
+
+    def backlog(self):
+        return 0
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,21 @@
+"""
+SMS Bot - Перевірка реєстру під паралельними записами
+
+Коротший прогін bench.py stress: записники реєструють і видаляють номери
+зі спільного пулу, читачі знімають знімки, експорт і сторінки API.
+Запуск: python -m pytest tests
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# bench.py сам переходить у тимчасову теку і вимикає обмеження допуску
+import bench  # noqa: E402
+
+
+def test_concurrent_register_delete_export():
+    errors, writes, reads, _ = bench.stress(writers=4, readers=2, seconds=2, pool=50)
+    assert errors == []
+    assert writes and reads
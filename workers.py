@@ -0,0 +1,61 @@
+"""
+SMS Bot - Спільне для кількох воркерів gunicorn
+
+WalConnection - з'єднання SQLite у режимі WAL, яке кожен процес відкриває
+сам (сховище, черга розсилки, результати моніторингу). wait_for_lock -
+вибір єдиного воркера для фонової задачі (монітор, розсилка, архів):
+задачу виконує той, хто утримує flock, решта чекають на своїй черзі.
+"""
+
+import os
+import fcntl
+import sqlite3
+
+
+class WalConnection:
+    """З'єднання SQLite (WAL) поточного процесу, спільне для його потоків
+
+    setup(conn) виконується на кожному новому з'єднанні: схема, міграції.
+    """
+
+    def __init__(self, path, setup=None):
+        self.path = path
+        self.setup = setup
+        self._conn = None
+        self._pid = None
+
+    def get(self):
+        # Після fork з'єднання батьківського процесу використовувати не можна
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            if self.setup is not None:
+                self.setup(conn)
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def wait_for_lock(path, stopped, sleep, interval=5):
+    """Чекати, доки блокування path не звільнить інший воркер
+
+    Повертає дескриптор файлу (закрити його - звільнити блокування) або
+    None, якщо stopped() став істинним раніше. sleep(interval) - пауза між
+    спробами, яку зупинка може перервати (наприклад, Event.wait).
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    while not stopped():
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            sleep(interval)
+            continue
+        return fd
+    os.close(fd)
+    return None